@@ -5,10 +5,14 @@ Import vào full_gmv.py để sử dụng.
 """
 import os
 
+import threading
+from contextlib import contextmanager
+
 # PostgreSQL
 try:
     import psycopg2
     import psycopg2.extras
+    import psycopg2.pool
     HAS_PSYCOPG2 = True
 except ImportError:
     HAS_PSYCOPG2 = False
@@ -343,51 +347,97 @@ def save_deal_list_to_postgresql(deal_list_data, db_url, log_func=print):
         return 0
 
 
-def get_gmv_with_deallist(db_url, limit=500, sort_by='revenue', sort_dir='desc', log_func=print):
+# ============== CONNECTION POOL ==============
+# 1 ThreadedConnectionPool / db_url, mở lazy lần đầu dùng (web request không phải connect+TLS lại)
+PG_POOL_MIN = int(os.environ.get('PG_POOL_MIN', 1))
+PG_POOL_MAX = int(os.environ.get('PG_POOL_MAX', 10))
+_pg_pools = {}
+_pg_pools_lock = threading.Lock()
+
+def get_pg_pool(db_url):
+    """Lấy (hoặc tạo) connection pool cho db_url"""
+    pool = _pg_pools.get(db_url)
+    if pool is None:
+        with _pg_pools_lock:
+            pool = _pg_pools.get(db_url)
+            if pool is None:
+                # TCP keepalive: connection nằm lâu trong pool mà server/proxy đã cắt thì
+                # kernel phát hiện sớm, không đợi tới lúc request dùng tới mới lỗi
+                pool = psycopg2.pool.ThreadedConnectionPool(
+                    PG_POOL_MIN, PG_POOL_MAX, db_url, connect_timeout=10,
+                    keepalives=1, keepalives_idle=30, keepalives_interval=10, keepalives_count=3
+                )
+                _pg_pools[db_url] = pool
+                print(f"[DB] Connection pool created (min={PG_POOL_MIN}, max={PG_POOL_MAX})")
+    return pool
+
+@contextmanager
+def pg_connection(db_url=None, pool=None):
+    """Mượn connection từ pool; rollback transaction dở + trả lại pool khi xong.
+    Connection hỏng (đã đóng / lỗi mạng) bị loại khỏi pool.
+    pool: pool tạo sẵn (vd app.pg_pool), nếu None thì lấy theo db_url."""
+    if pool is None:
+        pool = get_pg_pool(db_url)
+    conn = pool.getconn()
+    broken = False
+    try:
+        yield conn
+    except (psycopg2.OperationalError, psycopg2.InterfaceError):
+        broken = True
+        raise
+    finally:
+        if not conn.closed and not broken:
+            try:
+                conn.rollback()
+            except Exception:
+                broken = True
+        pool.putconn(conn, close=broken or bool(conn.closed))
+
+
+# LEFT JOIN để lấy shop_id và cluster từ deal_list
+GMV_WITH_DEALLIST_SQL = '''
+    SELECT 
+        g.item_id,
+        g.item_name,
+        g.cover_image,
+        g.clicks,
+        g.ctr,
+        g.orders,
+        g.items_sold,
+        g.revenue,
+        g.datetime,
+        g.add_to_cart,
+        COALESCE(d.shop_id, g.shop_id) as shop_id,
+        COALESCE(d.cluster, g.cluster) as cluster,
+        CASE 
+            WHEN COALESCE(d.shop_id, g.shop_id) IS NOT NULL AND COALESCE(d.shop_id, g.shop_id) != '' 
+            THEN 'https://shopee.vn/a-i.' || COALESCE(d.shop_id, g.shop_id) || '.' || g.item_id
+            ELSE g.link_sp
+        END as link_sp
+    FROM gmv_data g
+    LEFT JOIN deal_list d ON g.item_id = d.item_id
+    ORDER BY g.revenue DESC NULLS LAST
+    LIMIT %s
+'''
+
+def get_gmv_with_deallist(db_url=None, limit=500, sort_by='revenue', sort_dir='desc', log_func=print, pool=None):
     """
     Lấy GMV data đã JOIN với deal_list.
     Tự động map shop_id, cluster, link từ deal_list.
+    pool: connection pool tạo sẵn lúc khởi động app (ưu tiên hơn db_url).
     """
     if not HAS_PSYCOPG2:
         log_func("⚠️ psycopg2 chưa được cài đặt")
         return []
-    if not db_url:
+    if not db_url and pool is None:
         log_func("⚠️ Chưa có DATABASE_URL")
         return []
     
     try:
-        conn = psycopg2.connect(db_url, connect_timeout=10)
-        cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-        
-        # LEFT JOIN để lấy shop_id và cluster từ deal_list
-        query = '''
-            SELECT 
-                g.item_id,
-                g.item_name,
-                g.cover_image,
-                g.clicks,
-                g.ctr,
-                g.orders,
-                g.items_sold,
-                g.revenue,
-                g.datetime,
-                g.add_to_cart,
-                COALESCE(d.shop_id, g.shop_id) as shop_id,
-                COALESCE(d.cluster, g.cluster) as cluster,
-                CASE 
-                    WHEN COALESCE(d.shop_id, g.shop_id) IS NOT NULL AND COALESCE(d.shop_id, g.shop_id) != '' 
-                    THEN 'https://shopee.vn/a-i.' || COALESCE(d.shop_id, g.shop_id) || '.' || g.item_id
-                    ELSE g.link_sp
-                END as link_sp
-            FROM gmv_data g
-            LEFT JOIN deal_list d ON g.item_id = d.item_id
-            ORDER BY g.revenue DESC NULLS LAST
-            LIMIT %s
-        '''
-        
-        cursor.execute(query, (limit,))
-        rows = cursor.fetchall()
-        conn.close()
+        with pg_connection(db_url, pool=pool) as conn:
+            cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+            cursor.execute(GMV_WITH_DEALLIST_SQL, (limit,))
+            rows = cursor.fetchall()
         
         # Convert to list of dicts
         result = []
@@ -21,9 +21,18 @@ import re
 import csv
 import argparse
 import sqlite3
+import queue
+import atexit
+from contextlib import contextmanager
 from datetime import datetime, timedelta
-from functools import wraps
+from functools import wraps, lru_cache
 import threading
+import time
+import zlib
+import itertools
+import logging
+from logging.handlers import QueueHandler, QueueListener
+from concurrent.futures import ThreadPoolExecutor
 
 # Import Google Sheets
 try:
@@ -34,11 +43,25 @@ except ImportError:
     GSPREAD_AVAILABLE = False
     print("⚠️ gspread không được cài. Chạy: pip install gspread google-auth")
 
+# orjson (optional) - parse JSON nhanh hơn json stdlib
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
+# flask-compress (optional) - gzip/br response JSON theo Accept-Encoding
+try:
+    from flask_compress import Compress
+    COMPRESS_AVAILABLE = True
+except ImportError:
+    COMPRESS_AVAILABLE = False
+
 # Import PostgreSQL helper
 try:
     from db_helpers import (
         save_to_postgresql, save_deal_list_to_postgresql, 
-        get_gmv_with_deallist, HAS_PSYCOPG2,
+        get_gmv_with_deallist, get_pg_pool, HAS_PSYCOPG2,
         # Multi-session functions
         save_to_postgresql_multi_session, archive_session_data, 
         init_multi_session_tables
@@ -54,6 +77,8 @@ except ImportError:
     def get_gmv_with_deallist(*args, **kwargs):
         print("⚠️ db_helpers không tìm thấy")
         return []
+    def get_pg_pool(*args, **kwargs):
+        return None
     def save_to_postgresql_multi_session(*args, **kwargs):
         print("⚠️ db_helpers không tìm thấy")
         return False
@@ -104,6 +129,7 @@ DEALLIST_CACHE_TTL = 7200  # 2 tiếng cho Deal List
 # GMV Cache
 _gmv_cache = {
     'data': None,
+    'count': 0,
     'timestamp': None
 }
 
@@ -114,6 +140,60 @@ _deallist_cache = {
     'timestamp': None
 }
 
+# API Response Cache (RAM): (path, params handler đọc) -> (expires_at, generation, body bytes)
+# Invalidate bằng bump_data_generation() khi Deal List / GMV được refresh
+_response_cache = {}
+RESPONSE_CACHE_MAX_ENTRIES = 256  # quá ngưỡng -> dọn entry hết hạn / khác generation
+_data_generation = {'value': 0}
+# Single-flight: key đang được tính -> Event; request trùng key chờ thay vì query lại
+_inflight = {}
+_inflight_lock = threading.Lock()
+INFLIGHT_WAIT_TIMEOUT = 30  # giây - quá thời gian thì tự tính
+TOP_GMV_CACHE_TTL = 10  # giây
+TOP_GMV_STREAM_MIN_LIMIT = 1000  # limit > ngưỡng này -> stream SQLite fallback thay vì build cả payload
+ANALYTICS_CACHE_TTL = 30  # giây
+CACHE_STATUS_TTL = 2  # giây - endpoint monitor poll liên tục
+TOP_GMV_BROWSER_MAX_AGE = 30  # giây - Cache-Control cho browser, hết hạn thì revalidate bằng ETag
+
+# Payload JSON đã encode của /api/top-gmv (SQLite fallback): chỉ giữ bản mới nhất
+# ((limit, data_version), body) -> limit khác nhau không giữ thêm body
+_top_gmv_payload = {'entry': None}
+
+def dumps_json_bytes(obj):
+    """Serialize JSON -> bytes (orjson nếu có)"""
+    if ORJSON_AVAILABLE:
+        return orjson.dumps(obj)
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+def bump_data_generation():
+    """Đánh dấu data đã thay đổi -> mọi response cache cũ hết hiệu lực"""
+    _data_generation['value'] += 1
+
+# ============== Logging (web mode) ==============
+# Request thread chỉ enqueue record, QueueListener ghi stdout ở thread riêng
+logger = logging.getLogger('gmv')
+_log_listener = None
+
+def setup_buffered_logging():
+    """Gắn QueueHandler cho logger 'gmv' + access log của werkzeug (gọi 1 lần lúc create_app)"""
+    global _log_listener
+    if _log_listener is not None:
+        return
+    
+    log_queue = queue.Queue(-1)
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.setFormatter(logging.Formatter('%(message)s'))  # giữ format như print cũ
+    _log_listener = QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    _log_listener.start()
+    atexit.register(_log_listener.stop)
+    
+    queue_handler = QueueHandler(log_queue)
+    for name in ('gmv', 'werkzeug'):
+        target = logging.getLogger(name)
+        target.addHandler(queue_handler)
+        target.setLevel(logging.INFO)
+        target.propagate = False
+
 # Admin password from environment
 ADMIN_PASSWORD = os.environ.get('ADMIN_PASSWORD', 'admin123')
 
@@ -125,6 +205,99 @@ def get_db():
     conn.row_factory = sqlite3.Row
     return conn
 
+def open_sqlite_writer(cached_statements=128):
+    """Mở 1 connection SQLite dùng chung cho scraper (WAL + autocommit, tự quản lý transaction)"""
+    conn = sqlite3.connect(DB_PATH, isolation_level=None, check_same_thread=False,
+                           cached_statements=cached_statements)
+    conn.row_factory = sqlite3.Row
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.execute('PRAGMA cache_size=-65536')
+    conn.execute('PRAGMA temp_store=MEMORY')
+    return conn
+
+# ============== SQL cho web analytics (string cố định -> trúng statement cache của connection pool) ==============
+SQL_TOP_GMV_FALLBACK = '''
+    SELECT item_id, item_name, revenue, shop_id, link_sp, datetime, clicks, ctr, orders, items_sold, cluster
+    FROM gmv_data
+    ORDER BY revenue DESC
+    LIMIT ?
+'''
+SQL_CATEGORY_DISTRIBUTION = '''
+    SELECT cluster, SUM(revenue) as total_revenue, COUNT(*) as product_count
+    FROM gmv_data
+    WHERE cluster IS NOT NULL AND cluster != ''
+    GROUP BY cluster
+    ORDER BY total_revenue DESC
+'''
+# Cắt tên 30 ký tự ngay trong SQL (vẫn index-only scan trên idx_gmv_revenue)
+SQL_TOP_PRODUCTS = '''
+    SELECT
+        CASE
+            WHEN item_name IS NULL OR item_name = '' THEN 'N/A'
+            WHEN length(item_name) > 30 THEN substr(item_name, 1, 30) || '...'
+            ELSE item_name
+        END AS name,
+        COALESCE(revenue, 0) AS revenue,
+        COALESCE(orders, 0) AS orders
+    FROM gmv_data
+    ORDER BY revenue DESC
+    LIMIT 10
+'''
+# LEFT JOIN gmv_data để có sẵn item_name fallback trong cùng 1 query
+SQL_ITEM_SESSIONS = '''
+    SELECT r.item_name, r.revenue, r.clicks, r.file_name, r.session_name, g.item_name AS gmv_name
+    FROM raw_session_data r
+    LEFT JOIN gmv_data g ON g.item_id = r.item_id
+    WHERE r.item_id = ?
+'''
+
+# ============== SQLite Connection Pool (web analytics) ==============
+SQLITE_POOL_SIZE = 8
+_sqlite_pool = queue.LifoQueue(maxsize=SQLITE_POOL_SIZE)
+
+def _open_pooled_db():
+    """Connection mới cho pool: giống open_sqlite_writer + mmap"""
+    conn = open_sqlite_writer(cached_statements=256)
+    conn.execute('PRAGMA mmap_size=268435456')
+    return conn
+
+@contextmanager
+def acquire_db():
+    """Mượn 1 connection từ pool (LIFO -> connection vừa dùng, cache còn nóng), trả lại khi xong"""
+    try:
+        conn = _sqlite_pool.get_nowait()
+    except queue.Empty:
+        conn = _open_pooled_db()
+    try:
+        yield conn
+    finally:
+        try:
+            _sqlite_pool.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+def _close_sqlite_pool():
+    while True:
+        try:
+            _sqlite_pool.get_nowait().close()
+        except queue.Empty:
+            break
+
+atexit.register(_close_sqlite_pool)
+
+# (tên index, bảng, CREATE INDEX) cho web analytics - init_db chỉ tạo + ANALYZE index chưa có
+ANALYTICS_INDEXES = (
+    ('idx_gmv_revenue', 'gmv_data',
+     'CREATE INDEX IF NOT EXISTS idx_gmv_revenue ON gmv_data(revenue DESC, item_name, orders)'),
+    ('idx_gmv_cluster_revenue', 'gmv_data', '''
+        CREATE INDEX IF NOT EXISTS idx_gmv_cluster_revenue ON gmv_data(cluster, revenue)
+        WHERE cluster IS NOT NULL AND cluster != ''
+    '''),
+    ('idx_raw_session_item', 'raw_session_data',
+     'CREATE INDEX IF NOT EXISTS idx_raw_session_item ON raw_session_data(item_id)'),
+)
+
 def init_db():
     """Initialize database tables"""
     conn = get_db()
@@ -182,11 +355,35 @@ def init_db():
         )
     ''')
     
+    # Indexes cho web analytics
+    # - top products: covering index -> ORDER BY revenue DESC LIMIT 10 chỉ đọc index
+    # - category distribution: partial index khớp WHERE của query, GROUP BY theo thứ tự index
+    # - item analytics: lookup raw data theo item
+    cursor.execute("SELECT name FROM sqlite_master WHERE type = 'index'")
+    existing_indexes = {row[0] for row in cursor.fetchall()}
+    analyze_tables = set()
+    for index_name, table, index_sql in ANALYTICS_INDEXES:
+        if index_name not in existing_indexes:
+            cursor.execute(index_sql)
+            analyze_tables.add(table)
+    # Index mới tạo -> planner cần thống kê của bảng đó (chỉ lần đầu, không ANALYZE cả DB mỗi lần start)
+    for table in sorted(analyze_tables):
+        cursor.execute(f'ANALYZE {table}')
+    
     conn.commit()
     conn.close()
 
-def get_config(key):
-    """Get config value by key"""
+# Các key timestamp do process khác (scraper/web) ghi -> luôn đọc thẳng DB, không cache
+_UNCACHED_CONFIG_KEYS = {'last_sync', 'last_deallist_sync'}
+
+# Config cache trong RAM (mỗi worker 1 bản): nạp lười theo key hoặc nạp hết lúc create_app.
+# set_config ghi xuyên vào đây; process khác ghi thì worker này chấp nhận stale tới khi invalidate.
+_config_snapshot = {}
+_cfg_generation = {'value': 0}
+_config_lock = threading.RLock()
+
+def _read_config(key):
+    """Đọc config value trực tiếp từ DB"""
     conn = get_db()
     cursor = conn.cursor()
     cursor.execute('SELECT value FROM config WHERE key = ?', (key,))
@@ -194,6 +391,25 @@ def get_config(key):
     conn.close()
     return row['value'] if row else None
 
+def invalidate_config_cache():
+    """Xóa config cache (lần get_config sau sẽ đọc lại DB)"""
+    with _config_lock:
+        _config_snapshot.clear()
+        _cfg_generation['value'] += 1
+
+def get_config(key):
+    """Get config value by key"""
+    if key in _UNCACHED_CONFIG_KEYS:
+        return _read_config(key)
+    try:
+        return _config_snapshot[key]
+    except KeyError:
+        pass
+    with _config_lock:
+        if key not in _config_snapshot:
+            _config_snapshot[key] = _read_config(key)
+        return _config_snapshot[key]
+
 def set_config(key, value):
     """Set config value"""
     conn = get_db()
@@ -203,15 +419,35 @@ def set_config(key, value):
     ''', (key, value))
     conn.commit()
     conn.close()
+    with _config_lock:
+        _config_snapshot[key] = value
+        _cfg_generation['value'] += 1
+
+def load_config_snapshot():
+    """Đọc tất cả config keys vào _config_snapshot (cập nhật in-place)"""
+    conn = get_db()
+    cursor = conn.cursor()
+    cursor.execute('SELECT key, value FROM config')
+    rows = cursor.fetchall()
+    conn.close()
+    with _config_lock:
+        _config_snapshot.clear()
+        _config_snapshot.update((row['key'], row['value']) for row in rows)
+        _cfg_generation['value'] += 1
+    return _config_snapshot
 
-def save_to_sqlite(rows):
-    """Ghi dữ liệu trực tiếp vào SQLite gmv_data table"""
+def save_to_sqlite(rows, conn=None):
+    """Ghi dữ liệu trực tiếp vào SQLite gmv_data table
+    
+    conn: connection dùng chung (từ open_sqlite_writer). Nếu None thì mở/đóng connection riêng.
+    """
     if not rows:
         return 0
     
-    conn = get_db()
+    own_conn = conn is None
+    if own_conn:
+        conn = open_sqlite_writer()
     cursor = conn.cursor()
-    count = 0
     
     def parse_int(val):
         """Parse value to int, handling various formats"""
@@ -229,6 +465,7 @@ def save_to_sqlite(rows):
             except:
                 return 0
     
+    params = []
     for row in rows:
         try:
             # row format from scraper:
@@ -254,31 +491,43 @@ def save_to_sqlite(rows):
                 continue
             
             # Debug first few items
-            if count < 3:
+            if len(params) < 3:
                 print(f"[SQLITE] Inserting: {item_id[:20]}... revenue={revenue}, orders={orders}")
             
-            cursor.execute('''
-                INSERT OR REPLACE INTO gmv_data 
-                (item_id, item_name, cover_image, revenue, datetime, clicks, ctr, orders, items_sold, confirmed_revenue)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (item_id, item_name, cover_image, revenue, dt_str, clicks, ctr, orders, items_sold, confirmed_revenue))
-            count += 1
+            params.append((item_id, item_name, cover_image, revenue, dt_str, clicks, ctr, orders, items_sold, confirmed_revenue))
             
         except Exception as e:
-            print(f"⚠️ Lỗi ghi SQLite row: {e}")
+            print(f"⚠️ Lỗi parse SQLite row: {e}")
             import traceback
             traceback.print_exc()
             continue
     
-    conn.commit()
-    
-    # Update last sync timestamp
-    cursor.execute('''
-        INSERT OR REPLACE INTO config (key, value) VALUES (?, ?)
-    ''', ('last_sync', datetime.now().isoformat()))
-    conn.commit()
-    
-    conn.close()
+    # 1 transaction cho cả batch + last_sync
+    try:
+        cursor.execute('BEGIN IMMEDIATE')
+        cursor.executemany('''
+            INSERT OR REPLACE INTO gmv_data 
+            (item_id, item_name, cover_image, revenue, datetime, clicks, ctr, orders, items_sold, confirmed_revenue)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', params)
+        
+        # Update last sync timestamp
+        cursor.execute('''
+            INSERT OR REPLACE INTO config (key, value) VALUES (?, ?)
+        ''', ('last_sync', datetime.now().isoformat()))
+        cursor.execute('COMMIT')
+    except Exception as e:
+        print(f"⚠️ Lỗi ghi SQLite batch: {e}")
+        try:
+            cursor.execute('ROLLBACK')
+        except sqlite3.Error:
+            pass
+        params = []
+    finally:
+        if own_conn:
+            conn.close()
+    
+    count = len(params)
     print(f"[SQLITE] Total saved: {count} items")
     return count
 
@@ -525,6 +774,7 @@ def get_gmv_from_sheet(limit=500, deallist_url=None, deallist_sheet_name=None, f
     
     # Cập nhật cache (lưu toàn bộ data, không chỉ limit)
     _gmv_cache['data'] = results
+    _gmv_cache['count'] = len(results)
     _gmv_cache['timestamp'] = datetime.now()
     print(f"[CACHE] Updated cache with {len(results)} items")
     
@@ -626,6 +876,8 @@ def sync_deal_list_only(spreadsheet_url, deallist_sheet_name):
             updated += 1
     
     conn.commit()
+    # Cập nhật thống kê cho query planner sau bulk update
+    cursor.execute('PRAGMA optimize')
     conn.close()
     
     # === LƯU VÀO POSTGRESQL ===
@@ -657,6 +909,7 @@ def sync_deal_list_only(spreadsheet_url, deallist_sheet_name):
     
     # Update last sync time
     set_config('last_deallist_sync', datetime.now().isoformat())
+    bump_data_generation()
     
     return updated
 
@@ -685,17 +938,26 @@ def run_gui_mode():
             # Google Sheet variables
             self.gsheet_client = None
             self.current_spreadsheet = None
+            self._spreadsheet_cache = {}  # url -> gspread Spreadsheet (mở 1 lần/phiên)
             self.current_worksheet = None
             self.gsheet_enabled = False
             self.gsheet_header_written = False
             
             # Initialize DB
             init_db()
+            # Connection SQLite dùng chung cho mọi lần save_to_sqlite (WAL)
+            self._sqlite = open_sqlite_writer()
             
             # PostgreSQL variables
             self.postgres_enabled = False
             self.last_archive_time = datetime.now()  # Initialize archive timer
             
+            # Log chi tiết từng sản phẩm (tắt mặc định, chỉ giữ log theo cycle)
+            self._verbose = False
+            
+            # Hash nội dung row đã ghi, theo đích ghi: {'sqlite': {item_id: hash}, 'gsheet': {...}}
+            self._row_hashes = {}
+            
             # Overview scraper variables
             self.overview_running = False
             self.last_overview_archive = None
@@ -838,9 +1100,15 @@ def run_gui_mode():
                     self.gsheet_status.setText("❌ Không tìm thấy service account key")
                     return
                 
-                creds = Credentials.from_service_account_file(SERVICE_ACCOUNT_KEY, scopes=SCOPES)
-                self.gsheet_client = gspread.authorize(creds)
-                self.current_spreadsheet = self.gsheet_client.open_by_url(url)
+                if url in self._spreadsheet_cache:
+                    # Đã mở spreadsheet này trong phiên -> không gọi lại open_by_url
+                    self.current_spreadsheet = self._spreadsheet_cache[url]
+                else:
+                    if self.gsheet_client is None:
+                        creds = Credentials.from_service_account_file(SERVICE_ACCOUNT_KEY, scopes=SCOPES)
+                        self.gsheet_client = gspread.authorize(creds)
+                    self.current_spreadsheet = self.gsheet_client.open_by_url(url)
+                    self._spreadsheet_cache[url] = self.current_spreadsheet
                 
                 worksheets = self.current_spreadsheet.worksheets()
                 
@@ -869,11 +1137,12 @@ def run_gui_mode():
                 self.current_worksheet = self.sheet_selector.itemData(index)
                 self.log(f"📋 Đã chọn sheet: {self.current_worksheet.title}")
         
-        def save_to_gsheet(self, rows, overwrite=False):
+        def save_to_gsheet(self, rows, overwrite=False, _already_normalized=False):
             """
             Ghi dữ liệu vào Google Sheet đã chọn trong GUI.
             overwrite=False: Append data mới vào dưới header (giữ data cũ)
             overwrite=True: Xóa data cũ, ghi data mới
+            _already_normalized=True: rows đã được chuẩn hóa (len == CSV_HEADER_API, str) -> bỏ qua bước chuẩn hóa
             """
             if not self.gsheet_enabled:
                 return False
@@ -891,17 +1160,21 @@ def run_gui_mode():
                 worksheet = self.current_worksheet
                 
                 # Chuẩn bị data
-                all_rows = [CSV_HEADER_API]  # Luôn có header
-                
-                for row in rows:
-                    row_data = list(row) if isinstance(row, (list, tuple)) else [str(row)]
-                    if len(row_data) < len(CSV_HEADER_API):
-                        row_data += [""] * (len(CSV_HEADER_API) - len(row_data))
-                    elif len(row_data) > len(CSV_HEADER_API):
-                        row_data = row_data[:len(CSV_HEADER_API)]
+                if _already_normalized:
+                    # Dùng lại buffer đã chuẩn hóa từ save_to_csv_and_db
+                    all_rows = [CSV_HEADER_API] + rows
+                else:
+                    all_rows = [CSV_HEADER_API]  # Luôn có header
                     
-                    row_data = [str(x) if x is not None else "" for x in row_data]
-                    all_rows.append(row_data)
+                    for row in rows:
+                        row_data = list(row) if isinstance(row, (list, tuple)) else [str(row)]
+                        if len(row_data) < len(CSV_HEADER_API):
+                            row_data += [""] * (len(CSV_HEADER_API) - len(row_data))
+                        elif len(row_data) > len(CSV_HEADER_API):
+                            row_data = row_data[:len(CSV_HEADER_API)]
+                        
+                        row_data = [str(x) if x is not None else "" for x in row_data]
+                        all_rows.append(row_data)
                 
                 if overwrite:
                     # XÓA toàn bộ data cũ và ghi mới
@@ -942,24 +1215,10 @@ def run_gui_mode():
             try:
                 self.log(f"📊 Fetching overview data from API...")
                 
-                # Use page.evaluate() to fetch with credentials (with 30s timeout)
+                # Use window.__gmvFetch (cài trong patched_run_loop) to fetch with credentials (with 30s timeout)
                 try:
                     response = await asyncio.wait_for(
-                        page.evaluate('''
-                            async (url) => {
-                                try {
-                                    const resp = await fetch(url, {
-                                        credentials: 'include',
-                                        headers: {
-                                            'Accept': 'application/json',
-                                        }
-                                    });
-                                    return await resp.json();
-                                } catch(e) {
-                                    return { error: e.message };
-                                }
-                            }
-                        ''', api_url),
+                        page.evaluate(GMV_FETCH_CALL_JS, api_url),
                         timeout=30.0
                     )
                 except asyncio.TimeoutError:
@@ -1078,6 +1337,50 @@ def run_gui_mode():
             
             self.log(f"🛑 Overview scraper loop stopped (Session: {session_id})")
         
+        def _start_archive_task(self, db_url, session_id, elapsed_mins):
+            """Chạy archive_session_data ở background thread, tối đa 1 archive đang chạy"""
+            last_task = getattr(self, '_last_archive_task', None)
+            if last_task is not None and not last_task.done():
+                self.log("⏳ Archive lần trước vẫn đang chạy, bỏ qua lần này")
+                return
+            
+            self.log(f"⏰ Đã qua {elapsed_mins} phút (> 60). Tiến hành archive data (background)...")
+            
+            def _on_archive_done(task):
+                try:
+                    success = task.result()
+                except Exception as e:
+                    self.log(f"❌ Lỗi archive: {e}")
+                    return
+                if success:
+                    self.last_archive_time = datetime.now()
+                    self.log(f"✅ Archive hoàn tất. Reset timer.")
+            
+            self._last_archive_task = asyncio.create_task(
+                asyncio.to_thread(archive_session_data, db_url, session_id, log_func=self.log)
+            )
+            self._last_archive_task.add_done_callback(_on_archive_done)
+        
+        def _filter_changed_rows(self, dest, norm_rows):
+            """Lọc các row có nội dung thay đổi so với lần ghi trước vào `dest` ('sqlite'/'gsheet').
+            
+            Trả về (changed_rows, pending_hashes). Gọi _commit_row_hashes(dest, pending_hashes)
+            sau khi ghi thành công để lần sau bỏ qua các row này.
+            """
+            known = self._row_hashes.setdefault(dest, {})
+            changed = []
+            pending = {}
+            for r in norm_rows:
+                item_id = r[1]
+                h = hash((item_id, *r[3:]))  # bỏ DateTime + tên SP
+                if known.get(item_id) != h:
+                    changed.append(r)
+                    pending[item_id] = h
+            return changed, pending
+        
+        def _commit_row_hashes(self, dest, pending):
+            self._row_hashes.setdefault(dest, {}).update(pending)
+        
         def save_to_csv_and_db(self, rows):
             """Ghi CSV + SQLite song song (+ Google Sheet nếu enabled)"""
             if not rows:
@@ -1125,17 +1428,29 @@ def run_gui_mode():
                             w.writerow(r)
                     self.log(f"✅ Đã ghi {len(norm_rows)} dòng vào CSV")
                     
-                    # Ghi Google Sheet
+                    # Ghi Google Sheet (chỉ các row thay đổi kể từ lần ghi sheet trước)
                     if self.gsheet_enabled:
-                        self.save_to_gsheet(norm_rows)
+                        gsheet_rows, gsheet_hashes = self._filter_changed_rows('gsheet', norm_rows)
+                        if gsheet_rows and self.save_to_gsheet(gsheet_rows, _already_normalized=True):
+                            self._commit_row_hashes('gsheet', gsheet_hashes)
                     
                     self.file_cycle_counter = 0  # Reset counter
                 else:
                     self.log(f"� CSV/GSheet: Đợi thêm {3 - self.file_cycle_counter} cycles nữa (15p interval)...")
                 
                 # === 3. GHI SQLITE ===
-                sqlite_count = save_to_sqlite(norm_rows)
-                self.log(f"💾 Đã ghi/cập nhật {sqlite_count} dòng vào SQLite")
+                sqlite_rows, sqlite_hashes = self._filter_changed_rows('sqlite', norm_rows)
+                if sqlite_rows:
+                    sqlite_count = save_to_sqlite(sqlite_rows, conn=self._sqlite)
+                    if sqlite_count:
+                        self._commit_row_hashes('sqlite', sqlite_hashes)
+                    self.log(f"💾 Đã ghi/cập nhật {sqlite_count}/{len(norm_rows)} dòng vào SQLite (bỏ qua row không đổi)")
+                else:
+                    set_config('last_sync', datetime.now().isoformat())
+                    self.log(f"💾 SQLite: {len(norm_rows)} dòng không thay đổi, bỏ qua")
+                
+                # PostgreSQL vẫn nhận đủ norm_rows: save_to_postgresql_multi_session
+                # DELETE + INSERT lại toàn bộ session mỗi cycle
                 
                 # === 4. GHI POSTGRESQL (Multi-Session) ===
                 self.log(f"🐘 PostgreSQL enabled: {self.postgres_enabled}")
@@ -1157,11 +1472,7 @@ def run_gui_mode():
                         elapsed_mins = int(elapsed.total_seconds() / 60)
                         self.log(f"⏱️ Timer: {elapsed_mins} phút kể từ lần archive trước")
                         if elapsed > timedelta(minutes=60):  # TODO: Đổi lại hours=1 sau khi test
-                            self.log(f"⏰ Đã qua {elapsed_mins} phút (> 60). Tiến hành archive data...")
-                            success = archive_session_data(db_url, session_id, log_func=self.log)
-                            if success:
-                                self.last_archive_time = datetime.now()
-                                self.log(f"✅ Archive hoàn tất. Reset timer.")
+                            self._start_archive_task(db_url, session_id, elapsed_mins)
                         else:
                             self.log(f"⏳ Chưa đến 60 phút, còn {60 - elapsed_mins} phút nữa mới archive")
                 
@@ -1182,8 +1493,8 @@ def run_gui_mode():
                     
                     # Vẫn ghi Google Sheet và SQLite
                     if self.gsheet_enabled:
-                        self.save_to_gsheet(norm_rows)
-                    save_to_sqlite(norm_rows)
+                        self.save_to_gsheet(norm_rows, _already_normalized=True)
+                    save_to_sqlite(norm_rows, conn=self._sqlite)
                     
                     return final_path
                 except Exception as e2:
@@ -1198,6 +1509,41 @@ def run_gui_mode():
                 self.log(traceback.format_exc())
                 return ""
     
+    # Fetcher JS cài 1 lần vào page (window.__gmvFetch), mỗi request chỉ gửi biểu thức ngắn
+    GMV_FETCH_INIT_JS = '''window.__gmvFetch = async (url) => {
+        try {
+            const resp = await fetch(url, {
+                credentials: 'include',
+                headers: {
+                    'Accept': 'application/json',
+                }
+            });
+            return await resp.json();
+        } catch(e) {
+            return { error: e.message };
+        }
+    }'''
+    GMV_FETCH_CALL_JS = "(u) => window.__gmvFetch(u)"
+    
+    # Bỏ ký tự định dạng tiền (₫ , .) bằng 1 lần translate
+    MONEY_STRIP_TABLE = str.maketrans('', '', '₫,.')
+    
+    async def install_gmv_fetch(page):
+        """Cài window.__gmvFetch cho page hiện tại + mọi lần navigate sau (init script)"""
+        await page.context.add_init_script(GMV_FETCH_INIT_JS)
+        await page.evaluate(GMV_FETCH_INIT_JS)
+    
+    # URL template cho productList API (format 1 lần/trang thay vì nối chuỗi)
+    PRODUCT_LIST_API_URL = (
+        "https://creator.shopee.vn/supply/api/lm/sellercenter/realtime/dashboard/productList"
+        "?sessionId={session_id}"
+        "&productName="
+        "&productListTimeRange=0"
+        "&sort=desc"
+        "&page={page_num}"
+        "&pageSize={page_size}"
+    )
+    
     # Extract data via API function
     async def extract_data_via_api(self, page, session_id):
         """Lấy dữ liệu sản phẩm trực tiếp từ API với pageSize=500."""
@@ -1208,35 +1554,32 @@ def run_gui_mode():
         now = datetime.now()
         dt_str = now.strftime("%d-%m:%H:%M:%S")
         
+        verbose = getattr(self, '_verbose', False)  # log chi tiết từng sản phẩm
+        parse_errors = 0
+        
         self.log(f"🚀 Đang lấy dữ liệu qua API với pageSize={page_size}...")
         
+        # APIRequestContext dùng chung cookie với browser context (storage_state)
+        # -> fetch native, không phải compile JS + marshal JSON qua CDP mỗi trang
+        req_ctx = page.context.request
+        
         while True:
-            api_url = (
-                f"https://creator.shopee.vn/supply/api/lm/sellercenter/realtime/dashboard/productList"
-                f"?sessionId={session_id}"
-                f"&productName="
-                f"&productListTimeRange=0"
-                f"&sort=desc"
-                f"&page={page_num}"
-                f"&pageSize={page_size}"
+            api_url = PRODUCT_LIST_API_URL.format(
+                session_id=session_id, page_num=page_num, page_size=page_size
             )
             
             try:
-                response = await page.evaluate('''
-                    async (url) => {
-                        try {
-                            const resp = await fetch(url, {
-                                credentials: 'include',
-                                headers: {
-                                    'Accept': 'application/json',
-                                }
-                            });
-                            return await resp.json();
-                        } catch(e) {
-                            return { error: e.message };
-                        }
-                    }
-                ''', api_url)
+                try:
+                    resp = await req_ctx.get(api_url, headers={"Accept": "application/json"})
+                    body = await resp.body()
+                    response = orjson.loads(body) if ORJSON_AVAILABLE else json.loads(body)
+                except Exception as fetch_err:
+                    # Fallback: fetch trong page qua fetcher đã cài sẵn
+                    self.log(f"⚠️ APIRequestContext lỗi ({fetch_err}), thử lại qua page fetch...")
+                    try:
+                        response = await page.evaluate(GMV_FETCH_CALL_JS, api_url)
+                    except Exception as page_err:
+                        response = {"error": str(page_err)}
                 
                 if not response:
                     self.log("❌ Không nhận được response từ API")
@@ -1265,6 +1608,10 @@ def run_gui_mode():
                 
                 self.log(f"📦 Trang {page_num}: Lấy được {len(product_list)} sản phẩm (Tổng: {total_count})")
                 
+                # Biết totalCount từ trang 1 -> cấp phát sẵn list kết quả
+                if page_num == 1 and isinstance(total_count, int) and total_count > 0:
+                    results = [None] * total_count
+                
                 for product in product_list:
                     try:
                         item_id = str(product.get("itemId", ""))
@@ -1286,7 +1633,7 @@ def run_gui_mode():
                         if isinstance(revenue_raw, (int, float)):
                             revenue = str(int(revenue_raw))
                         else:
-                            revenue = str(revenue_raw).replace("₫", "").replace(",", "").replace(".", "").strip()
+                            revenue = str(revenue_raw).translate(MONEY_STRIP_TABLE).strip()
                         
                         cto_rate = product.get("cor", "0%")
                         if not str(cto_rate).endswith("%"):
@@ -1302,21 +1649,27 @@ def run_gui_mode():
                         if isinstance(nmv_raw, (int, float)):
                             nmv = str(int(nmv_raw))
                         else:
-                            nmv = str(nmv_raw).replace("₫", "").replace(",", "").replace(".", "").strip()
+                            nmv = str(nmv_raw).translate(MONEY_STRIP_TABLE).strip()
                         
                         confirmed_orders = str(product.get("confirmedOrderCnt", 0))
                         confirmed_items_sold = str(product.get("ComfirmedItemsold", product.get("confirmedItemSold", 0)))
                         
-                        results.append([
+                        row = [
                             dt_str, item_id, name, cover_image,
                             clicks, ctr, total_orders, items_sold,
                             revenue, cto_rate, add_to_cart,
                             nmv, confirmed_orders, confirmed_items_sold,
-                        ])
+                        ]
+                        if total_products < len(results):
+                            results[total_products] = row
+                        else:
+                            results.append(row)  # totalCount thiếu/sai -> append
                         total_products += 1
                         
                     except Exception as e:
-                        self.log(f"⚠️ Lỗi parse sản phẩm: {e}")
+                        parse_errors += 1
+                        if verbose:
+                            self.log(f"⚠️ Lỗi parse sản phẩm: {e}")
                         continue
                 
                 if len(product_list) < page_size:
@@ -1331,7 +1684,10 @@ def run_gui_mode():
                 self.log(traceback.format_exc())
                 break
         
+        if parse_errors:
+            self.log(f"⚠️ Bỏ qua {parse_errors} sản phẩm lỗi parse")
         self.log(f"✅ Hoàn thành lấy dữ liệu qua API: {total_products} sản phẩm")
+        del results[total_products:]  # Bỏ các slot None chưa dùng
         return results
     
     # Patched run_loop
@@ -1432,20 +1788,17 @@ def run_gui_mode():
             # Store session_id as instance attribute
             self.current_session_id = session_id
             
+            # Cài fetcher JS 1 lần cho dashboard page (dùng cho sessionInfo/overview)
+            try:
+                await install_gmv_fetch(dashboard_page)
+            except Exception as e:
+                self.log(f"⚠️ Không cài được window.__gmvFetch: {e}")
+            
             # Fetch session info từ API để lấy session title
             session_title = ""
             try:
                 session_info_url = f"https://creator.shopee.vn/supply/api/lm/sellercenter/realtime/dashboard/sessionInfo?sessionId={session_id}"
-                session_info = await dashboard_page.evaluate('''
-                    async (url) => {
-                        try {
-                            const resp = await fetch(url, {credentials: 'include'});
-                            return await resp.json();
-                        } catch(e) {
-                            return {error: e.message};
-                        }
-                    }
-                ''', session_info_url)
+                session_info = await dashboard_page.evaluate(GMV_FETCH_CALL_JS, session_info_url)
                 
                 if session_info and session_info.get('code') == 0:
                     data = session_info.get('data', {})
@@ -1566,19 +1919,64 @@ def run_gui_mode():
 
 # ============== WEB SERVER MODE ==============
 
+@lru_cache(maxsize=1)
 def create_app():
-    """Tạo Flask app - dùng cho cả gunicorn và local development"""
-    from flask import Flask, render_template, request, jsonify, session, redirect, url_for
+    """Tạo Flask app - dùng cho cả gunicorn và local development
+    
+    lru_cache: gọi lại create_app() trả về cùng app, không init_db/đọc config lần nữa.
+    """
+    from flask import Flask, Response, render_template, request, jsonify, session, redirect, url_for, stream_with_context
     from apscheduler.schedulers.background import BackgroundScheduler
     
+    setup_buffered_logging()
+    
     app = Flask(__name__)
     app.secret_key = os.environ.get('SECRET_KEY', 'dev-secret-key-change-in-production')
     
+    # jsonify -> orjson (nếu có). date/Decimal vẫn qua default của Flask để giữ nguyên format
+    if ORJSON_AVAILABLE:
+        from flask.json.provider import DefaultJSONProvider
+        
+        class ORJSONProvider(DefaultJSONProvider):
+            def dumps(self, obj, **kwargs):
+                return orjson.dumps(
+                    obj,
+                    default=self.default,
+                    option=orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+                ).decode('utf-8')
+            
+            def loads(self, s, **kwargs):
+                return orjson.loads(s)
+        
+        app.json = ORJSONProvider(app)
+    
+    # Nén sau cùng (after_request của Compress đăng ký trước nên chạy sau ETag/304 của app)
+    if COMPRESS_AVAILABLE:
+        app.config['COMPRESS_MIMETYPES'] = ['application/json']
+        app.config['COMPRESS_LEVEL'] = 6
+        app.config['COMPRESS_MIN_SIZE'] = 500  # bytes - body nhỏ hơn thì nén không đáng
+        Compress(app)
+    
     # Initialize DB
     try:
         init_db()
     except Exception as e:
-        print(f"[WARNING] init_db failed: {e}")
+        logger.warning(f"[WARNING] init_db failed: {e}")
+    
+    # Preload config 1 lần - get_config() trong routes đọc từ _config_snapshot thay vì query SQLite
+    try:
+        load_config_snapshot()
+    except Exception as e:
+        logger.warning(f"[WARNING] load config failed: {e}")
+    
+    # PostgreSQL: đọc DATABASE_URL 1 lần + tạo pool ngay lúc khởi động
+    DATABASE_URL = os.environ.get('DATABASE_URL', '')
+    app.pg_pool = None
+    if DATABASE_URL and HAS_PSYCOPG2:
+        try:
+            app.pg_pool = get_pg_pool(DATABASE_URL)
+        except Exception as e:
+            logger.warning(f"[WARNING] PostgreSQL pool init failed: {e}")
     
     # ============== Background Auto-Refresh GMV ==============
     # DISABLED: Scraper local now writes directly to PostgreSQL
@@ -1615,7 +2013,7 @@ def create_app():
     # except Exception as e:
     #     print(f"[WARNING] Scheduler failed to start: {e}")
     
-    print("[INFO] GMV data comes from local scraper -> PostgreSQL (scheduler disabled)")
+    logger.info("[INFO] GMV data comes from local scraper -> PostgreSQL (scheduler disabled)")
 
     
     auto_sync_state = {
@@ -1636,11 +2034,11 @@ def create_app():
             if spreadsheet_url and deallist_sheet:
                 count = sync_deal_list_only(spreadsheet_url, deallist_sheet)
                 auto_sync_state['last_auto_sync'] = now.isoformat()
-                print(f"[AUTO-SYNC] {now.strftime('%H:%M:%S')} - Updated {count} products with Deal List")
+                logger.info(f"[AUTO-SYNC] {now.strftime('%H:%M:%S')} - Updated {count} products with Deal List")
             else:
-                print(f"[AUTO-SYNC] Missing configuration. Skipping sync.")
+                logger.warning(f"[AUTO-SYNC] Missing configuration. Skipping sync.")
         except Exception as e:
-            print(f"[AUTO-SYNC] Error: {str(e)}")
+            logger.error(f"[AUTO-SYNC] Error: {str(e)}")
         
         auto_sync_state['next_sync'] = (now.replace(second=0, microsecond=0) + 
                                          __import__('datetime').timedelta(seconds=300)).isoformat()
@@ -1686,6 +2084,108 @@ def create_app():
             return f(*args, **kwargs)
         return decorated_function
     
+    # Thứ tự key khớp thứ tự cột SELECT (tuple rows -> dict(zip(...)))
+    TOP_GMV_KEYS = ('item_id', 'item_name', 'revenue', 'shop_id', 'link_sp', 'datetime',
+                    'clicks', 'ctr', 'orders', 'items_sold', 'cluster')
+    CATEGORY_KEYS = ('cluster', 'revenue', 'count')
+    
+    # ============== RAM Cache Decorator ==============
+    def store_response(key, expires_at, generation, body):
+        if len(_response_cache) >= RESPONSE_CACHE_MAX_ENTRIES:
+            now = time.monotonic()
+            current = _data_generation['value']
+            for stale_key in [k for k, v in list(_response_cache.items()) if v[0] <= now or v[1] != current]:
+                _response_cache.pop(stale_key, None)
+            if len(_response_cache) >= RESPONSE_CACHE_MAX_ENTRIES:
+                _response_cache.clear()
+        _response_cache[key] = (expires_at, generation, body)
+    
+    def ram_cached(ttl, params=()):
+        """Cache body JSON đã serialize theo (path, các query param trong `params`) trong `ttl` giây.
+        Param khác handler không đọc -> không tạo key mới.
+        Handler lỗi (exception / 5xx) -> trả bản cache cũ nếu có (stale-if-error).
+        Cache miss đồng thời cùng key -> chỉ 1 request tính, còn lại chờ kết quả (single-flight)."""
+        def lookup(key):
+            entry = _response_cache.get(key)
+            if entry and entry[0] > time.monotonic() and entry[1] == _data_generation['value']:
+                return entry
+            return None
+        
+        def decorator(f):
+            @wraps(f)
+            def decorated_function(*args, **kwargs):
+                key = (request.path, tuple(request.args.get(name) for name in params))
+                fresh = lookup(key)
+                if fresh:
+                    return Response(fresh[2], mimetype='application/json')
+                
+                with _inflight_lock:
+                    event = _inflight.get(key)
+                    leader = event is None
+                    if leader:
+                        event = _inflight[key] = threading.Event()
+                
+                if not leader:
+                    event.wait(INFLIGHT_WAIT_TIMEOUT)
+                    fresh = lookup(key)
+                    if fresh:
+                        return Response(fresh[2], mimetype='application/json')
+                    # Leader lỗi / không cache được -> tự tính
+                
+                try:
+                    return compute(f, key, args, kwargs)
+                finally:
+                    if leader:
+                        with _inflight_lock:
+                            _inflight.pop(key, None)
+                        event.set()
+            
+            def compute(f, key, args, kwargs):
+                now = time.monotonic()
+                generation = _data_generation['value']
+                entry = _response_cache.get(key)
+                try:
+                    resp = app.make_response(f(*args, **kwargs))
+                except Exception as e:
+                    if not entry:
+                        raise
+                    logger.warning(f"[CACHE] {request.path} lỗi ({e}), trả bản cache cũ")
+                    resp = None
+                
+                if resp is None or resp.status_code >= 500:
+                    if entry:
+                        stale = Response(entry[2], mimetype='application/json')
+                        stale.headers['X-Cache'] = 'STALE'
+                        return stale
+                    return resp
+                
+                if resp.is_streamed:
+                    return resp  # không buffer response stream vào cache
+                
+                if resp.status_code == 200 and resp.mimetype == 'application/json':
+                    store_response(key, now + ttl, generation, resp.get_data())
+                return resp
+            return decorated_function
+        return decorator
+    
+    def conditional_json(max_age):
+        """ETag + If-None-Match -> 304 cho JSON response.
+        ETag = generation-limit-crc32(body): đổi khi refresh hoặc khi data PostgreSQL (scraper ghi) đổi."""
+        def decorator(f):
+            @wraps(f)
+            def decorated_function(*args, **kwargs):
+                resp = app.make_response(f(*args, **kwargs))
+                if resp.status_code != 200 or resp.is_streamed:
+                    return resp
+                
+                limit = request.args.get('limit', 500, type=int)
+                checksum = zlib.crc32(resp.get_data()) & 0xffffffff
+                resp.set_etag(f"{_data_generation['value']}-{limit}-{checksum:08x}")
+                resp.headers['Cache-Control'] = f'max-age={max_age}, must-revalidate'
+                return resp.make_conditional(request)
+            return decorated_function
+        return decorator
+    
     # ============== Routes ==============
     @app.route('/')
     def index():
@@ -1725,16 +2225,18 @@ def create_app():
     
     # ============== API Routes ==============
     @app.route('/api/top-gmv')
+    @conditional_json(max_age=TOP_GMV_BROWSER_MAX_AGE)
+    @ram_cached(ttl=TOP_GMV_CACHE_TTL, params=('limit',))
     def api_top_gmv():
         limit = request.args.get('limit', 500, type=int)
         
         # Đọc từ PostgreSQL với JOIN deal_list
-        db_url = os.environ.get('DATABASE_URL', '')
+        db_url = DATABASE_URL
         
         if db_url:
             try:
                 # Dùng function mới đọc với JOIN deal_list
-                data = get_gmv_with_deallist(db_url, limit=limit)
+                data = get_gmv_with_deallist(db_url, limit=limit, pool=app.pg_pool)
                 
                 if data:
                     return jsonify({
@@ -1745,7 +2247,7 @@ def create_app():
                         'last_sync': get_config('last_deallist_sync') or datetime.now().isoformat()
                     })
             except Exception as e:
-                print(f"[API] PostgreSQL error: {e}")
+                logger.error(f"[API] PostgreSQL error: {e}")
         
         # Fallback: Đọc từ Google Sheet
         deallist_url = get_config('spreadsheet_url')
@@ -1766,38 +2268,26 @@ def create_app():
                 'last_sync': datetime.now().isoformat()
             })
         except Exception as e:
-            print(f"[API] Error reading from Sheet: {e}")
+            logger.error(f"[API] Error reading from Sheet: {e}")
             # Fallback to SQLite if Sheet fails
             try:
-                conn = get_db()
-                cursor = conn.cursor()
-                cursor.execute('''
-                    SELECT item_id, item_name, revenue, shop_id, link_sp, datetime, clicks, ctr, orders, items_sold, cluster
-                    FROM gmv_data
-                    ORDER BY revenue DESC
-                    LIMIT ?
-                ''', (limit,))
+                # limit lớn -> stream từng batch, không giữ cả list dict + body trong RAM
+                if limit > TOP_GMV_STREAM_MIN_LIMIT:
+                    return Response(
+                        stream_with_context(stream_top_gmv_sqlite(limit, str(e))),
+                        mimetype='application/json'
+                    )
                 
-                rows = cursor.fetchall()
-                conn.close()
+                # Scraper ghi SQLite ở process khác -> version theo cả last_sync
+                payload_key = (limit, _data_generation['value'], get_config('last_sync'))
+                cached = _top_gmv_payload['entry']
+                if cached and cached[0] == payload_key:
+                    return Response(cached[1], mimetype='application/json')
                 
-                data = []
-                for row in rows:
-                    data.append({
-                        'item_id': row['item_id'],
-                        'item_name': row['item_name'],
-                        'revenue': row['revenue'],
-                        'shop_id': row['shop_id'],
-                        'link_sp': row['link_sp'],
-                        'datetime': row['datetime'],
-                        'clicks': row['clicks'],
-                        'ctr': row['ctr'],
-                        'orders': row['orders'],
-                        'items_sold': row['items_sold'],
-                        'cluster': row['cluster']
-                    })
+                with acquire_db() as conn:
+                    data = query_top_gmv_sqlite(conn, limit)
                 
-                return jsonify({
+                body = dumps_json_bytes({
                     'success': True,
                     'data': data,
                     'count': len(data),
@@ -1805,73 +2295,150 @@ def create_app():
                     'error': str(e),
                     'last_sync': get_config('last_deallist_sync')
                 })
+                _top_gmv_payload['entry'] = (payload_key, body)
+                return Response(body, mimetype='application/json')
             except Exception as e2:
                 return jsonify({
                     'success': False,
                     'error': f'Sheet error: {e}, SQLite error: {e2}'
                 }), 500
     
+    # ============== Background Refresh (Sheet sync không block request) ==============
+    app.refresh_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix='gmv-refresh')
+    refresh_tasks = {}       # task_id -> (kind, Future)
+    refresh_inflight = {}    # kind -> task_id đang chờ/chạy (gộp request trùng)
+    refresh_lock = threading.Lock()
+    refresh_counter = itertools.count(1)
+    REFRESH_TASKS_KEEP = 50
+    
+    def refresh_gmv_job(deallist_url, deallist_sheet):
+        data = get_gmv_from_sheet(
+            limit=500,
+            deallist_url=deallist_url,
+            deallist_sheet_name=deallist_sheet,
+            force_refresh=True
+        )
+        bump_data_generation()
+        return {
+            'message': f'Đã refresh {len(data)} items từ GMV Sheet',
+            'count': len(data),
+            'cache_ttl': GMV_CACHE_TTL,
+            'timestamp': datetime.now().isoformat()
+        }
+    
+    def refresh_deallist_job(deallist_url, deallist_sheet):
+        item_to_shop, item_to_cluster = get_deallist_mapping(
+            deallist_url=deallist_url,
+            deallist_sheet_name=deallist_sheet,
+            force_refresh=True
+        )
+        
+        # Clear GMV cache để lần load tiếp theo sẽ apply mapping mới
+        _gmv_cache['data'] = None
+        _gmv_cache['count'] = 0
+        _gmv_cache['timestamp'] = None
+        bump_data_generation()
+        
+        return {
+            'message': f'Đã refresh {len(item_to_shop)} items từ Deal List. GMV cache đã xóa.',
+            'count': len(item_to_shop),
+            'cache_ttl': DEALLIST_CACHE_TTL,
+            'gmv_cache_cleared': True,
+            'timestamp': datetime.now().isoformat()
+        }
+    
+    def submit_refresh(kind, job, *args):
+        """Submit job vào refresh_pool. Nếu cùng loại đang chờ/chạy -> trả task_id cũ (coalesce)."""
+        with refresh_lock:
+            task_id = refresh_inflight.get(kind)
+            entry = refresh_tasks.get(task_id) if task_id else None
+            if entry and not entry[1].done():
+                return task_id, True
+            
+            task_id = f"{kind}-{next(refresh_counter)}"
+            future = app.refresh_pool.submit(job, *args)
+            refresh_tasks[task_id] = (kind, future)
+            refresh_inflight[kind] = task_id
+            
+            # Chỉ giữ N task gần nhất: bỏ task cũ nhất đã xong, không bỏ task refresh_inflight còn trỏ tới
+            excess = len(refresh_tasks) - REFRESH_TASKS_KEEP
+            if excess > 0:
+                pinned = set(refresh_inflight.values())
+                removable = [old_id for old_id, (_, old_future) in refresh_tasks.items()
+                             if old_future.done() and old_id not in pinned]
+                for old_id in removable[:excess]:
+                    del refresh_tasks[old_id]
+            return task_id, False
+    
+    def refresh_task_status(task_id, entry=None):
+        """Status dict của task (entry = (kind, future) đã lấy dưới refresh_lock), None nếu không còn"""
+        if entry is None:
+            with refresh_lock:
+                entry = refresh_tasks.get(task_id)
+            if entry is None:
+                return None
+        kind, future = entry
+        status = {'task_id': task_id, 'kind': kind, 'done': future.done()}
+        if future.done():
+            error = future.exception()
+            if error:
+                status.update({'success': False, 'error': str(error)})
+            else:
+                status.update({'success': True, **future.result()})
+        else:
+            status['success'] = True
+            status['running'] = future.running()
+        return status
+    
     @app.route('/api/refresh-gmv', methods=['POST'])
     @admin_required
     def api_refresh_gmv():
-        """Force refresh GMV cache"""
-        try:
-            deallist_url = get_config('spreadsheet_url')
-            deallist_sheet = get_config('deallist_sheet')
-            
-            data = get_gmv_from_sheet(
-                limit=500,
-                deallist_url=deallist_url,
-                deallist_sheet_name=deallist_sheet,
-                force_refresh=True
-            )
-            
-            return jsonify({
-                'success': True,
-                'message': f'Đã refresh {len(data)} items từ GMV Sheet',
-                'count': len(data),
-                'cache_ttl': GMV_CACHE_TTL,
-                'timestamp': datetime.now().isoformat()
-            })
-        except Exception as e:
-            return jsonify({'success': False, 'error': str(e)}), 500
+        """Force refresh GMV cache (chạy nền, trả task_id ngay)"""
+        task_id, coalesced = submit_refresh(
+            'gmv', refresh_gmv_job, get_config('spreadsheet_url'), get_config('deallist_sheet')
+        )
+        return jsonify({
+            'success': True,
+            'task_id': task_id,
+            'coalesced': coalesced,
+            'message': f'Đang refresh GMV Sheet (task {task_id})',
+            'status_url': url_for('api_refresh_status', task_id=task_id)
+        }), 202
     
     @app.route('/api/refresh-deallist', methods=['POST'])
     @admin_required
     def api_refresh_deallist():
-        """Force refresh Deal List cache + clear GMV cache"""
-        global _gmv_cache
-        try:
-            deallist_url = get_config('spreadsheet_url')
-            deallist_sheet = get_config('deallist_sheet')
-            
-            item_to_shop, item_to_cluster = get_deallist_mapping(
-                deallist_url=deallist_url,
-                deallist_sheet_name=deallist_sheet,
-                force_refresh=True
-            )
-            
-            # Clear GMV cache để lần load tiếp theo sẽ apply mapping mới
-            _gmv_cache['data'] = None
-            _gmv_cache['timestamp'] = None
-            
-            return jsonify({
-                'success': True,
-                'message': f'Đã refresh {len(item_to_shop)} items từ Deal List. GMV cache đã xóa.',
-                'count': len(item_to_shop),
-                'cache_ttl': DEALLIST_CACHE_TTL,
-                'gmv_cache_cleared': True,
-                'timestamp': datetime.now().isoformat()
-            })
-        except Exception as e:
-            return jsonify({'success': False, 'error': str(e)}), 500
+        """Force refresh Deal List cache + clear GMV cache (chạy nền, trả task_id ngay)"""
+        task_id, coalesced = submit_refresh(
+            'deallist', refresh_deallist_job, get_config('spreadsheet_url'), get_config('deallist_sheet')
+        )
+        return jsonify({
+            'success': True,
+            'task_id': task_id,
+            'coalesced': coalesced,
+            'message': f'Đang refresh Deal List (task {task_id})',
+            'status_url': url_for('api_refresh_status', task_id=task_id)
+        }), 202
+    
+    @app.route('/api/refresh-status/<task_id>')
+    @admin_required
+    def api_refresh_status(task_id):
+        status = refresh_task_status(task_id)
+        if status is None:
+            return jsonify({'success': False, 'error': 'Task không tồn tại'}), 404
+        return jsonify(status)
     
     @app.route('/api/cache-status')
     @admin_required
+    @ram_cached(ttl=CACHE_STATUS_TTL)
     def api_cache_status():
         """Get cache status"""
         now = datetime.now()
         
+        # Snapshot task đang theo dõi dưới lock, tính status ngoài lock
+        with refresh_lock:
+            inflight = [(kind, task_id, refresh_tasks.get(task_id)) for kind, task_id in refresh_inflight.items()]
+        
         gmv_age = None
         deallist_age = None
         
@@ -1883,7 +2450,7 @@ def create_app():
         return jsonify({
             'gmv': {
                 'has_data': _gmv_cache['data'] is not None,
-                'count': len(_gmv_cache['data']) if _gmv_cache['data'] else 0,
+                'count': _gmv_cache['count'],
                 'age_seconds': gmv_age,
                 'ttl': GMV_CACHE_TTL,
                 'last_update': _gmv_cache['timestamp'].isoformat() if _gmv_cache['timestamp'] else None
@@ -1893,7 +2460,9 @@ def create_app():
                 'age_seconds': deallist_age,
                 'ttl': DEALLIST_CACHE_TTL,
                 'last_update': _deallist_cache['timestamp'].isoformat() if _deallist_cache['timestamp'] else None
-            }
+            },
+            'refresh': {kind: refresh_task_status(task_id, entry)
+                        for kind, task_id, entry in inflight if entry is not None}
         })
     @app.route('/api/sheets', methods=['POST'])
     @admin_required
@@ -1909,7 +2478,7 @@ def create_app():
         if deallist_sheet:
             set_config('spreadsheet_url', spreadsheet_url)
             set_config('deallist_sheet', deallist_sheet)
-            print(f"[CONFIG] Saved: URL={spreadsheet_url[:50]}... Sheet={deallist_sheet}")
+            logger.info(f"[CONFIG] Saved: URL={spreadsheet_url[:50]}... Sheet={deallist_sheet}")
         
         try:
             sheets = get_spreadsheet_sheets(spreadsheet_url)
@@ -1990,71 +2559,110 @@ def create_app():
             }
         })
     
+    # ============== Analytics Query Helpers (dùng chung 1 connection) ==============
+    def query_top_gmv_sqlite(conn, limit):
+        cursor = conn.cursor()
+        cursor.row_factory = None  # tuple rows, zip với TOP_GMV_KEYS
+        cursor.arraysize = 500
+        cursor.execute(SQL_TOP_GMV_FALLBACK, (limit,))
+        return [dict(zip(TOP_GMV_KEYS, row)) for row in cursor.fetchall()]
+    
+    def stream_top_gmv_sqlite(limit, error):
+        """Generator JSON body cho top-gmv SQLite fallback, fetchmany theo batch"""
+        with acquire_db() as conn:
+            cursor = conn.cursor()
+            cursor.row_factory = None
+            cursor.arraysize = 200
+            cursor.execute(SQL_TOP_GMV_FALLBACK, (limit,))
+            
+            yield b'{"success":true,"data":['
+            count = 0
+            while True:
+                rows = cursor.fetchmany()
+                if not rows:
+                    break
+                chunk = b','.join(dumps_json_bytes(dict(zip(TOP_GMV_KEYS, row))) for row in rows)
+                yield (b',' + chunk) if count else chunk
+                count += len(rows)
+        
+        tail = dumps_json_bytes({
+            'count': count,
+            'source': 'sqlite_fallback',
+            'error': error,
+            'last_sync': get_config('last_deallist_sync')
+        })
+        yield b'],' + tail[1:]
+    
+    def query_category_distribution(conn):
+        cursor = conn.cursor()
+        cursor.row_factory = None
+        cursor.execute(SQL_CATEGORY_DISTRIBUTION)
+        return [dict(zip(CATEGORY_KEYS, row)) for row in cursor.fetchall()]
+    
+    def query_top_products(conn):
+        cursor = conn.cursor()
+        cursor.row_factory = None
+        cursor.execute(SQL_TOP_PRODUCTS)
+        return [{'name': name, 'revenue': revenue, 'orders': orders} for name, revenue, orders in cursor.fetchall()]
+    
     @app.route('/api/analytics/category-distribution')
+    @ram_cached(ttl=ANALYTICS_CACHE_TTL)
     def api_category_distribution():
-        conn = get_db()
-        cursor = conn.cursor()
-        cursor.execute('''
-            SELECT cluster, SUM(revenue) as total_revenue, COUNT(*) as product_count
-            FROM gmv_data
-            WHERE cluster IS NOT NULL AND cluster != ''
-            GROUP BY cluster
-            ORDER BY total_revenue DESC
-        ''')
-        
-        rows = cursor.fetchall()
-        conn.close()
-        
-        data = []
-        for row in rows:
-            data.append({
-                'cluster': row['cluster'],
-                'revenue': row['total_revenue'],
-                'count': row['product_count']
-            })
+        with acquire_db() as conn:
+            data = query_category_distribution(conn)
         
         return jsonify({'success': True, 'data': data})
     
     @app.route('/api/analytics/top-products')
+    @ram_cached(ttl=ANALYTICS_CACHE_TTL)
     def api_top_products():
-        conn = get_db()
-        cursor = conn.cursor()
-        cursor.execute('''
-            SELECT item_name, revenue, orders
-            FROM gmv_data
-            ORDER BY revenue DESC
-            LIMIT 10
-        ''')
-        
-        rows = cursor.fetchall()
-        conn.close()
-        
-        data = []
-        for row in rows:
-            name = row['item_name'] or 'N/A'
-            if len(name) > 30:
-                name = name[:30] + '...'
-            data.append({
-                'name': name,
-                'revenue': row['revenue'] or 0,
-                'orders': row['orders'] or 0
-            })
+        with acquire_db() as conn:
+            data = query_top_products(conn)
         
         return jsonify({'success': True, 'data': data})
     
-    @app.route('/api/item-analytics/<item_id>')
-    def api_item_analytics(item_id):
-        conn = get_db()
-        cursor = conn.cursor()
+    @app.route('/api/dashboard')
+    @ram_cached(ttl=TOP_GMV_CACHE_TTL, params=('limit',))
+    def api_dashboard():
+        """Top GMV + category distribution + top products trong 1 request"""
+        limit = request.args.get('limit', 500, type=int)
         
-        cursor.execute('''
-            SELECT item_name, revenue, clicks, file_name, session_name
-            FROM raw_session_data
-            WHERE item_id = ?
-        ''', (item_id,))
+        top_gmv = None
+        source = 'sqlite'
+        db_url = DATABASE_URL
+        if db_url:
+            try:
+                top_gmv = get_gmv_with_deallist(db_url, limit=limit, pool=app.pg_pool)
+                source = 'postgresql_with_deallist'
+            except Exception as e:
+                logger.error(f"[API] PostgreSQL error: {e}")
+        
+        # Cùng 1 connection SQLite cho cả 3 query (page cache còn nóng)
+        with acquire_db() as conn:
+            if not top_gmv:
+                top_gmv = query_top_gmv_sqlite(conn, limit)
+                source = 'sqlite'
+            categories = query_category_distribution(conn)
+            top_products = query_top_products(conn)
         
-        rows = cursor.fetchall()
-        conn.close()
+        return jsonify({
+            'success': True,
+            'top_gmv': top_gmv,
+            'categories': categories,
+            'top_products': top_products,
+            'source': source,
+            'last_sync': get_config('last_deallist_sync')
+        })
+    
+    @app.route('/api/item-analytics/<item_id>')
+    def api_item_analytics(item_id):
+        with acquire_db() as conn:
+            cursor = conn.cursor()
+            cursor.row_factory = None
+            
+            cursor.execute(SQL_ITEM_SESSIONS, (item_id,))
+            
+            rows = cursor.fetchall()
         
         if not rows:
             return jsonify({'success': False, 'error': 'Không tìm thấy Item ID'})
@@ -2064,28 +2672,24 @@ def create_app():
         total_clicks = 0
         item_name = ''
         
-        for row in rows:
-            if not item_name and row['item_name']:
-                item_name = row['item_name']
+        for row_name, revenue, clicks, file_name, session_name, _gmv_name in rows:
+            if not item_name and row_name:
+                item_name = row_name
             
+            revenue = revenue or 0
+            clicks = clicks or 0
             sessions.append({
-                'session': row['session_name'] or 'N/A',
-                'file': row['file_name'] or 'N/A',
-                'revenue': row['revenue'] or 0,
-                'clicks': row['clicks'] or 0
+                'session': session_name or 'N/A',
+                'file': file_name or 'N/A',
+                'revenue': revenue,
+                'clicks': clicks
             })
-            total_revenue += row['revenue'] or 0
-            total_clicks += row['clicks'] or 0
-        
-        # Fallback to gmv_data
-        if not item_name:
-            conn2 = get_db()
-            cursor2 = conn2.cursor()
-            cursor2.execute('SELECT item_name FROM gmv_data WHERE item_id = ?', (item_id,))
-            gmv_row = cursor2.fetchone()
-            conn2.close()
-            if gmv_row and gmv_row['item_name']:
-                item_name = gmv_row['item_name']
+            total_revenue += revenue
+            total_clicks += clicks
+        
+        # Fallback to gmv_data (cột gmv_name từ LEFT JOIN)
+        if not item_name and rows[0][5]:
+            item_name = rows[0][5]
         
         return jsonify({
             'success': True,
@@ -2123,7 +2727,7 @@ def create_app():
         if not session_id:
             return jsonify({'success': False, 'error': 'Missing session_id'}), 400
         
-        db_url = os.environ.get('DATABASE_URL', '')
+        db_url = DATABASE_URL
         if not db_url:
             return jsonify({'success': False, 'error': 'Database not configured'}), 500
         
@@ -2159,7 +2763,7 @@ def create_app():
         if not session_id:
             return jsonify({'success': False, 'error': 'Missing session_id'}), 400
         
-        db_url = os.environ.get('DATABASE_URL', '')
+        db_url = DATABASE_URL
         data = get_overview_history(db_url, session_id, limit)
         
         return jsonify({'success': True, 'data': data, 'count': len(data)})
@@ -2181,7 +2785,7 @@ def create_app():
         """
         from db_helpers import get_overview_sessions
         
-        db_url = os.environ.get('DATABASE_URL', '')
+        db_url = DATABASE_URL
         sessions = get_overview_sessions(db_url)
         
         return jsonify({'success': True, 'sessions': sessions})
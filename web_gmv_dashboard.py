@@ -6,16 +6,32 @@ Hiển thị Top GMV sản phẩm với link Shopee
 import os
 import psycopg2
 import psycopg2.extras
+import psycopg2.pool
+import psycopg2.errors
+from contextlib import contextmanager
+import io
 import json
-from functools import wraps
+import logging
+import operator
+import re
+from functools import wraps, lru_cache
+from urllib.parse import urlencode
 from datetime import datetime, timezone, timedelta
 import threading
 import unicodedata
-from flask import Flask, render_template, request, jsonify, session, redirect, url_for
+from flask import Flask, render_template, request, jsonify, session, redirect, url_for, g, has_request_context
 import gspread
+from gspread.utils import fill_gaps, extract_id_from_url
 from google.oauth2.service_account import Credentials
 from apscheduler.schedulers.background import BackgroundScheduler
 
+# Giờ Việt Nam (UTC+7) cho các mốc last_sync
+TZ_ICT = timezone(timedelta(hours=7))
+SYNC_INTERVAL = timedelta(seconds=300)  # auto-sync mỗi 5 phút
+
+# Không cấu hình handler -> chỉ WARNING+ ra stderr; debug/info là no-op trên production
+logger = logging.getLogger(__name__)
+
 # Google OAuth imports
 try:
     from authlib.integrations.flask_client import OAuth
@@ -32,13 +48,37 @@ except ImportError:
     BCRYPT_AVAILABLE = False
     print("[WARNING] bcrypt not installed. Brand authentication disabled.")
 
+# orjson (optional) - encode JSON nhanh hơn json stdlib cho response lớn (/api/all-data)
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
+# flask-compress (optional) - gzip/br response JSON (chart, /api/all-data) theo Accept-Encoding
+try:
+    from flask_compress import Compress
+    COMPRESS_AVAILABLE = True
+except ImportError:
+    COMPRESS_AVAILABLE = False
+
+# Redis (optional) - cache /api/all-data dùng chung giữa các gunicorn worker (cần REDIS_URL)
+try:
+    import redis
+    REDIS_AVAILABLE = True
+except ImportError:
+    REDIS_AVAILABLE = False
+
 # Multi-session functions from db_helpers
 try:
     from db_helpers import (
         get_active_sessions, get_history_timeslots, get_history_data,
-        cleanup_old_sessions_auto
+        cleanup_old_sessions_auto, get_pg_pool,
+        parse_sheet_title, update_session_title, get_archived_sessions
     )
 except ImportError:
+    def get_pg_pool(*args, **kwargs):
+        return None
     def get_active_sessions(*args, **kwargs):
         return []
     def get_history_timeslots(*args, **kwargs):
@@ -47,10 +87,51 @@ except ImportError:
         return []
     def cleanup_old_sessions_auto(*args, **kwargs):
         return False
+    def parse_sheet_title(*args, **kwargs):
+        return None
+    def update_session_title(*args, **kwargs):
+        return False
+    def get_archived_sessions(*args, **kwargs):
+        return []
 
 app = Flask(__name__)
 app.secret_key = os.environ.get('SECRET_KEY', 'dev-secret-key-change-in-production')
 
+# jsonify -> orjson (nếu có). date/Decimal vẫn qua default của Flask để giữ nguyên format
+if ORJSON_AVAILABLE:
+    from flask.json.provider import DefaultJSONProvider
+    
+    class ORJSONProvider(DefaultJSONProvider):
+        def dumps_bytes(self, obj):
+            return orjson.dumps(
+                obj,
+                default=self.default,
+                option=orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+            )
+        
+        def dumps(self, obj, **kwargs):
+            return self.dumps_bytes(obj).decode('utf-8')
+        
+        def loads(self, s, **kwargs):
+            return orjson.loads(s)
+        
+        def response(self, *args, **kwargs):
+            # Body bytes thẳng từ orjson, không decode sang str rồi Response encode lại
+            obj = self._prepare_response_obj(args, kwargs)
+            return self._app.response_class(self.dumps_bytes(obj) + b'\n', mimetype=self.mimetype)
+    
+    app.json = ORJSONProvider(app)
+
+def json_bytes(obj):
+    """obj -> JSON bytes bằng provider của app (orjson nếu có)"""
+    if ORJSON_AVAILABLE:
+        return app.json.dumps_bytes(obj)
+    return app.json.dumps(obj).encode('utf-8')
+
+# Nén sau cùng (after_request của Compress đăng ký trước nên chạy sau ETag/304 của app)
+if COMPRESS_AVAILABLE:
+    Compress(app)
+
 # Fix for HTTPS behind reverse proxy (Railway, Heroku, etc.)
 from werkzeug.middleware.proxy_fix import ProxyFix
 app.wsgi_app = ProxyFix(app.wsgi_app, x_proto=1, x_host=1)
@@ -58,6 +139,13 @@ app.wsgi_app = ProxyFix(app.wsgi_app, x_proto=1, x_host=1)
 # Database URL (PostgreSQL)
 DATABASE_URL = os.environ.get('DATABASE_URL', '')
 
+# Redis URL (optional, shared response cache)
+REDIS_URL = os.environ.get('REDIS_URL', '')
+redis_client = None
+if REDIS_AVAILABLE and REDIS_URL:
+    redis_client = redis.Redis.from_url(REDIS_URL, socket_timeout=2)
+    print("[CACHE] Redis shared cache enabled")
+
 # Admin password from environment
 ADMIN_PASSWORD = os.environ.get('ADMIN_PASSWORD', 'admin123')
 
@@ -115,57 +203,225 @@ import time
 # Cache configuration
 CACHE_TTL = 60  # 1 minute in seconds
 
-# In-memory cache storage
-data_cache = {
-    'all_data': None,
-    'last_update': 0,
-    'shop_ids': None,
-    'stats': None
-}
+# In-memory cache storage: 1 snapshot bất biến, thay nguyên tuple dưới lock
+# -> reader chỉ đọc 1 reference, không bao giờ thấy trạng thái nửa vời
+from collections import namedtuple
+
+CacheSnapshot = namedtuple(
+    'CacheSnapshot',
+    ['sort_key', 'data', 'shop_ids', 'shop_info', 'stats', 'latest_datetime', 'expires_at', 'body']
+)
+_cache_snapshot = None
+_cache_lock = threading.RLock()
+_cache_refresh_lock = threading.Lock()  # chỉ 1 thread reload khi cache hết hạn
+
+def get_cache_snapshot(sort_key):
+    """Snapshot cho sort_key (còn hạn hay đã hết hạn), None nếu không có / khác key"""
+    snapshot = _cache_snapshot
+    if snapshot is None or snapshot.sort_key != sort_key:
+        return None
+    return snapshot
 
-# Overview cache
-overview_cache = {
-    'sessions': None,
-    'sessions_last_update': 0,
-    'live_data': {},  # {session_id: {data, last_update}}
-}
+def is_snapshot_fresh(snapshot):
+    return snapshot is not None and time.monotonic() < snapshot.expires_at
 
 def get_cached_data():
     """Get data from cache if still valid, else return None"""
-    if data_cache['all_data'] is None:
-        return None
-    if time.time() - data_cache['last_update'] > CACHE_TTL:
+    snapshot = _cache_snapshot
+    if not is_snapshot_fresh(snapshot):
         return None  # Cache expired
-    return data_cache['all_data']
-
-def set_cached_data(data, shop_ids, stats):
-    """Store data in cache"""
-    data_cache['all_data'] = data
-    data_cache['shop_ids'] = shop_ids
-    data_cache['stats'] = stats
-    data_cache['last_update'] = time.time()
+    return snapshot.data
+
+def set_cached_data(data, shop_ids, stats, sort_key=None, shop_info=None, latest_datetime=None):
+    """Store data in cache (kèm body JSON encode sẵn cho cache hit). Trả snapshot mới."""
+    global _cache_snapshot
+    snapshot = CacheSnapshot(
+        sort_key, data, shop_ids, shop_info or [], stats, latest_datetime,
+        time.monotonic() + CACHE_TTL, None
+    )
+    snapshot = snapshot._replace(body=json_bytes(cache_snapshot_response(snapshot)))
+    with _cache_lock:
+        _cache_snapshot = snapshot
     print(f"[CACHE] Cached {len(data)} products")
+    return snapshot
+
+# Shared cache (Redis): body JSON của /api/all-data theo cache_key và của các view @cached_view,
+# mọi worker cùng đọc
+ALL_DATA_REDIS_PREFIX = 'gmv:all:'
+VIEW_REDIS_PREFIX = 'gmv:view:'
+
+def redis_get_all_data(cache_key):
+    if redis_client is None:
+        return None
+    try:
+        return redis_client.get(ALL_DATA_REDIS_PREFIX + cache_key)
+    except redis.RedisError as e:
+        print(f"[CACHE] Redis get failed: {e}")
+        return None
+
+def redis_set_all_data(cache_key, body):
+    if redis_client is None:
+        return
+    try:
+        redis_client.setex(ALL_DATA_REDIS_PREFIX + cache_key, CACHE_TTL, body)
+    except redis.RedisError as e:
+        print(f"[CACHE] Redis set failed: {e}")
+
+def redis_get_view(key):
+    if redis_client is None:
+        return None
+    try:
+        return redis_client.get(VIEW_REDIS_PREFIX + key)
+    except redis.RedisError as e:
+        print(f"[CACHE] Redis get failed: {e}")
+        return None
+
+def redis_set_view(key, body, timeout):
+    if redis_client is None:
+        return
+    try:
+        redis_client.setex(VIEW_REDIS_PREFIX + key, timeout, body)
+    except redis.RedisError as e:
+        print(f"[CACHE] Redis set failed: {e}")
+
+def redis_invalidate(*prefixes):
+    if redis_client is None:
+        return
+    try:
+        for prefix in prefixes:
+            keys = list(redis_client.scan_iter(match=prefix + '*', count=500))
+            if keys:
+                redis_client.delete(*keys)
+    except redis.RedisError as e:
+        print(f"[CACHE] Redis invalidate failed: {e}")
 
 def invalidate_cache():
     """Clear the cache (call after data sync)"""
-    data_cache['all_data'] = None
-    data_cache['last_update'] = 0
-    data_cache['shop_ids'] = None
-    data_cache['stats'] = None
+    global _cache_snapshot
+    global _shop_options_cache
+    with _cache_lock:
+        _cache_snapshot = None
+        view_cache.clear()
+        _shop_options_cache = None
+    redis_invalidate(ALL_DATA_REDIS_PREFIX, VIEW_REDIS_PREFIX)
     print("[CACHE] Cache invalidated")
 
+# Danh sách shop cho dropdown filter: (fetched_at monotonic, shop_ids, shop_info)
+# DISTINCT trên gmv_data x deal_list chỉ đổi khi sync -> TTL ngắn (scraper ghi từ process khác)
+SHOP_OPTIONS_TTL = 60  # seconds
+_shop_options_cache = None
+
+def get_shop_options(cursor):
+    """(shop_ids, shop_info) cho dropdown, cache SHOP_OPTIONS_TTL giây. cursor phải là RealDictCursor.
+    shop_ids có thể lặp nếu 1 shop có nhiều brand_name (giữ như query cũ của /api/all-data)."""
+    global _shop_options_cache
+    cached = _shop_options_cache
+    if cached and time.monotonic() - cached[0] < SHOP_OPTIONS_TTL:
+        return cached[1], cached[2]
+    
+    # Get shop_ids with brand_name - JOIN with deal_list to get brand info
+    # (cột brand_name được đảm bảo trong init_db())
+    # Try to query with brand_name, fallback to without if column doesn't exist
+    try:
+        cursor.execute('''
+            SELECT DISTINCT 
+                COALESCE(d.shop_id, g.shop_id) as shop_id,
+                COALESCE(d.brand_name, '') as brand_name
+            FROM gmv_data g
+            LEFT JOIN deal_list d ON g.item_id = d.item_id
+            WHERE COALESCE(d.shop_id, g.shop_id) IS NOT NULL 
+              AND COALESCE(d.shop_id, g.shop_id) != ''
+            ORDER BY shop_id
+        ''')
+        shop_info_rows = cursor.fetchall()
+        # Build shop_ids list (for backward compatibility) and shop_info list (new, with brand)
+        shop_ids = [row['shop_id'] for row in shop_info_rows]
+        shop_info = [{'shop_id': row['shop_id'], 'brand_name': row['brand_name']} for row in shop_info_rows]
+    except Exception as e:
+        print(f"[API] Fallback: brand_name column not available, using shop_id only: {e}")
+        cursor.connection.rollback()  # query lỗi làm hỏng transaction
+        cursor.execute('''
+            SELECT DISTINCT COALESCE(d.shop_id, g.shop_id) as shop_id 
+            FROM gmv_data g
+            LEFT JOIN deal_list d ON g.item_id = d.item_id
+            WHERE COALESCE(d.shop_id, g.shop_id) IS NOT NULL 
+              AND COALESCE(d.shop_id, g.shop_id) != ''
+            ORDER BY shop_id
+        ''')
+        shop_info_rows = cursor.fetchall()
+        shop_ids = [row['shop_id'] for row in shop_info_rows]
+        shop_info = [{'shop_id': row['shop_id'], 'brand_name': ''} for row in shop_info_rows]
+    
+    _shop_options_cache = (time.monotonic(), shop_ids, shop_info)
+    return shop_ids, shop_info
+
+# Per-view response cache: (key_prefix, path, query args) -> (expires_at, body, mimetype)
+view_cache = {}
+VIEW_CACHE_MAX_ENTRIES = 512  # search/page khác nhau -> nhiều key, quá ngưỡng thì dọn
+
+def _store_view_cache(key, body, mimetype, timeout):
+    now = time.monotonic()
+    if len(view_cache) >= VIEW_CACHE_MAX_ENTRIES:
+        for stale_key in [k for k, v in list(view_cache.items()) if v[0] <= now]:
+            view_cache.pop(stale_key, None)
+        if len(view_cache) >= VIEW_CACHE_MAX_ENTRIES:
+            view_cache.clear()
+    view_cache[key] = (now + timeout, body, mimetype)
+
+def cached_view(key_prefix, timeout=CACHE_TTL):
+    """Cache response JSON của view theo query string trong `timeout` giây (process + Redis nếu có).
+    Chỉ cache 200 + success != False; invalidate_cache() xóa toàn bộ.
+    View trả lỗi mà còn bản cũ (đã hết hạn) trong process -> trả bản cũ (stale-if-error)."""
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            query = tuple(sorted(request.args.items(multi=True)))
+            key = (key_prefix, request.path, query)
+            entry = view_cache.get(key)
+            if entry and time.monotonic() < entry[0]:
+                return app.response_class(entry[1], mimetype=entry[2])
+            
+            # Worker khác đã tính -> lấy body từ Redis, giữ luôn 1 bản trong process
+            redis_key = f"{key_prefix}:{request.path}?{urlencode(query)}"
+            body = redis_get_view(redis_key)
+            if body is not None:
+                _store_view_cache(key, body, 'application/json', timeout)
+                return app.response_class(body, mimetype='application/json')
+            
+            resp = app.make_response(f(*args, **kwargs))
+            if resp.status_code == 200 and resp.is_json and not resp.is_streamed:
+                payload = resp.get_json(silent=True)
+                if isinstance(payload, dict) and payload.get('success') is False:
+                    if entry:
+                        print(f"[CACHE] {key_prefix} failed, serving stale response")
+                        return app.response_class(entry[1], mimetype=entry[2])
+                else:
+                    body = resp.get_data()
+                    _store_view_cache(key, body, resp.mimetype, timeout)
+                    redis_set_view(redis_key, body, timeout)
+            return resp
+        return decorated_function
+    return decorator
+
+# Overview cache (mốc thời gian theo time.monotonic())
+overview_cache = {
+    'sessions': None,
+    'sessions_last_update': 0,
+    'live_data': {},  # {session_id: {data, last_update}}
+}
+
 def get_cached_overview_sessions():
     """Get overview sessions from cache"""
     if overview_cache['sessions'] is None:
         return None
-    if time.time() - overview_cache['sessions_last_update'] > CACHE_TTL:
+    if time.monotonic() - overview_cache['sessions_last_update'] > CACHE_TTL:
         return None
     return overview_cache['sessions']
 
 def set_cached_overview_sessions(sessions):
     """Cache overview sessions"""
     overview_cache['sessions'] = sessions
-    overview_cache['sessions_last_update'] = time.time()
+    overview_cache['sessions_last_update'] = time.monotonic()
     print(f"[CACHE] Cached {len(sessions)} overview sessions")
 
 def get_cached_overview_live(session_id):
@@ -173,7 +429,7 @@ def get_cached_overview_live(session_id):
     if session_id not in overview_cache['live_data']:
         return None
     cached = overview_cache['live_data'][session_id]
-    if time.time() - cached['last_update'] > CACHE_TTL:
+    if time.monotonic() - cached['last_update'] > CACHE_TTL:
         return None
     return cached['data']
 
@@ -181,37 +437,507 @@ def set_cached_overview_live(session_id, data):
     """Cache overview live data for a session"""
     overview_cache['live_data'][session_id] = {
         'data': data,
-        'last_update': time.time()
+        'last_update': time.monotonic()
     }
     print(f"[CACHE] Cached overview live data for session {session_id}")
 
 # ============== Helper Functions ==============
 
+def _strip_combining(text):
+    # Normalize to decomposed form, then remove combining marks
+    nfkd = unicodedata.normalize('NFKD', text)
+    return ''.join(c for c in nfkd if not unicodedata.combining(c))
+
+# Bảng translate chữ Latin có dấu (gồm toàn bộ chữ tiếng Việt) -> chữ ASCII,
+# sinh từ chính _strip_combining nên kết quả y hệt đường NFKD
+_DIACRITIC_TABLE = str.maketrans({
+    c: stripped
+    for c in map(chr, [*range(0xC0, 0x250), *range(0x1E00, 0x1F00)])
+    if (stripped := _strip_combining(c)) != c and stripped.isascii()
+})
+
+@lru_cache(maxsize=2048)
 def normalize_vietnamese(text):
     """Remove Vietnamese diacritics for easier matching"""
     if not text:
         return ""
-    # Normalize to decomposed form, then remove combining marks
-    nfkd = unicodedata.normalize('NFKD', text)
-    return ''.join(c for c in nfkd if not unicodedata.combining(c)).lower().replace(' ', '')
+    if not text.isascii():
+        text = text.translate(_DIACRITIC_TABLE)
+        if not text.isascii():  # còn ký tự ngoài bảng (vd 'đ', dấu rời) -> NFKD như cũ
+            text = _strip_combining(text)
+    return text.lower().replace(' ', '')
+
+# Bảng translate xoá mọi ký tự ASCII không phải chữ số (shop_id luôn là ASCII)
+_ASCII_NON_DIGITS = str.maketrans('', '', ''.join(c for c in map(chr, range(128)) if not c.isdigit()))
+
+def _digits_only(value):
+    """Chỉ giữ chữ số: '975865932' trả thẳng, ASCII dùng str.translate, còn lại lọc từng ký tự"""
+    if value.isdigit():
+        return value
+    if value.isascii():
+        return value.translate(_ASCII_NON_DIGITS)
+    return ''.join(c for c in value if c.isdigit())
+
+def _parse_int(value):
+    """int(value), lỗi/rỗng -> 0"""
+    try:
+        return int(value or 0)
+    except (TypeError, ValueError):
+        return 0
+
+def _parse_sheet_count(value, drop_dots=False):
+    """Ô sheet (int/float/str '1,234', '1.5') -> int, lỗi/rỗng -> 0.
+    int và chuỗi toàn chữ số đi đường tắt, chỉ giá trị lạ mới tới try/except.
+    drop_dots: bỏ cả '.' (dấu nghìn kiểu VN của doanh thu)"""
+    if type(value) is int:
+        return value
+    if isinstance(value, str):
+        value = value.replace(',', '')
+        if drop_dots:
+            value = value.replace('.', '')
+        if value.isdecimal():
+            return int(value)
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        pass
+    # Chuỗi số thập phân ('1.5') -> cắt phần lẻ như int(float)
+    try:
+        return int(float(value))
+    except (TypeError, ValueError, OverflowError):
+        return 0
+
+# Bỏ mọi ký tự không phải chữ số / dấu '-' (dấu phân cách nghìn, khoảng trắng, ký hiệu tiền)
+_NON_DIGIT_RE = re.compile(r'[^\d-]')
+
+def _parse_money(value):
+    """Số tiền dạng '1.234.567' / '1,234,567' -> int, lỗi/rỗng -> 0.
+    Parse thẳng chuỗi chữ số bằng int() (không qua float -> không mất chính xác khi > 2^53)"""
+    digits = _NON_DIGIT_RE.sub('', str(value))
+    if not digits or digits == '-':
+        return 0
+    try:
+        return int(digits)
+    except ValueError:  # vd '12-3'
+        return 0
+
+@lru_cache(maxsize=32)
+def _resolve_deallist_cols(headers):
+    """Tìm cột (item_id, shop_id, cluster, brand) trong header Deal List.
+    item_id ưu tiên 'Final Item ID', fallback cột 'Item ID' đầu tiên.
+    Cache theo tuple(headers) -> sync lại cùng sheet không phải resolve lại."""
+    item_id_col = None
+    fallback_item_id_col = None
+    shop_id_col = None
+    cluster_col = None
+    brand_col = None
+    
+    for key in headers:
+        key_lower = key.lower().replace(' ', '').replace('_', '')
+        if 'finalitemid' in key_lower:
+            item_id_col = key
+        if fallback_item_id_col is None and 'itemid' in key_lower:
+            fallback_item_id_col = key
+        if 'shopid' in key_lower:
+            shop_id_col = key
+        if 'cluster' in key_lower:
+            cluster_col = key
+        # Look for brand column: "Nhãn hàng" only (exact match to avoid matching price columns)
+        if key_lower == 'nhãnhàng' or key_lower == 'nhanhang' or key.strip().lower() == 'nhãn hàng':
+            brand_col = key
+    
+    return item_id_col or fallback_item_id_col, shop_id_col, cluster_col, brand_col
+
+def _resolve_deallist_indexes(headers):
+    """Như _resolve_deallist_cols nhưng trả thêm chỉ số cột: ((tên cột...), (index...)).
+    Header trùng tên -> cột bên phải nhất (giống dict header->cell trước đây)."""
+    col_names = _resolve_deallist_cols(tuple(dict.fromkeys(headers)))
+    last_idx = {header: i for i, header in enumerate(headers)}
+    return col_names, tuple(last_idx[col] if col else None for col in col_names)
+
+def _classify_gmv_header(key):
+    """Map header của rawdata sheet -> tên field gmv_data (None nếu không dùng)"""
+    key_lower = key.lower().replace(' ', '')
+    key_normalized = normalize_vietnamese(key)  # Remove Vietnamese diacritics
+    
+    if 'tensanpham' in key_normalized or 'itemname' in key_normalized:
+        return 'item_name'
+    if 'datetime' in key_lower or 'thoigian' in key_normalized:
+        return 'datetime'
+    if ('doanhthu' in key_normalized) and 'confirm' not in key_lower and 'nmv' not in key_lower:
+        # Only match "Doanh thu" column, NOT "NMV (Confirmed Revenue)"
+        return 'revenue'
+    if 'luotclick' in key_normalized or 'clicks' in key_normalized:
+        return 'clicks'
+    if 'tyleclick' in key_normalized and 'dathang' not in key_normalized:
+        return 'ctr'
+    if 'tongdonhang' in key_normalized or 'orders' in key_normalized:
+        return 'orders'
+    if 'mathang' in key_normalized or 'itemssold' in key_normalized:
+        return 'items_sold'
+    if 'themvaogio' in key_normalized or 'giohang' in key_normalized or 'addtocart' in key_lower:
+        return 'add_to_cart'
+    if 'nmv' in key_lower or 'confirm' in key_lower:
+        return 'confirmed_revenue'
+    return None
+
+# Header của sheet raw monthly (MERGE STACK): (role, pattern trên header lower giữ dấu cách,
+# pattern trên header lower bỏ ' '/'_'). 1 header có thể khớp nhiều role (vd 'Tỷ lệ click vào sản phẩm'
+# khớp cả clicks lẫn click_to_product_rate) -> mỗi role lấy header khớp đầu tiên
+_MONTHLY_HEADER_PATTERNS = (
+    ('item_name', re.compile('tên sản phẩm'), re.compile('tensanpham|tênsp|tensp|itemname|productname')),
+    ('item_id', re.compile('item id'), re.compile('itemid')),
+    ('revenue', re.compile('doanh thu'), re.compile('doanhthu|revenue')),
+    ('clicks', None, re.compile('click')),
+    ('file', None, re.compile('file')),
+    ('session', re.compile('phiên'), re.compile('phien|session')),
+    ('total_orders', re.compile('tổng đơn hàng'), re.compile('tongdonhang|totalorders|orders')),
+    ('items_sold', re.compile('các mặt hàng được bán|mặt hàng'), re.compile('cacmathangduocban|itemssold')),
+    ('add_to_cart', re.compile('thêm vào giỏ hàng|giỏ hàng'), re.compile('themvaogiohang|addtocart')),
+    ('click_to_product_rate', re.compile('tỷ lệ click vào sản phẩm|product click rate'),
+     re.compile('tyleclickvaosanpham|clicktoproductrate')),
+    ('click_to_order_rate', re.compile('tỷ lệ click để đặt hàng|click to order rate'),
+     re.compile('tyleclickdedathang|clicktoorderrate')),
+)
+
+@lru_cache(maxsize=256)
+def _classify_monthly_header(key):
+    """Các role mà header của sheet raw monthly khớp (tuple, có thể rỗng)"""
+    key_lower = key.lower().replace(' ', '').replace('_', '')
+    key_original = key.lower()
+    return tuple(
+        role for role, original_rx, lower_rx in _MONTHLY_HEADER_PATTERNS
+        if (original_rx is not None and original_rx.search(key_original)) or lower_rx.search(key_lower)
+    )
+
+def _resolve_monthly_cols(keys):
+    """role -> header đầu tiên khớp role đó"""
+    cols = {}
+    for key in keys:
+        for role in _classify_monthly_header(key):
+            cols.setdefault(role, key)
+    return cols
 
 # ============== Database Functions ==============
 
+def _acquire_db():
+    pool = get_pg_pool(DATABASE_URL)
+    if pool is None:
+        return psycopg2.connect(DATABASE_URL)
+    try:
+        conn = pool.getconn()
+        if conn.closed:
+            # Connection đã chết khi còn nằm trong pool -> loại bỏ, mượn cái khác
+            pool.putconn(conn, close=True)
+            conn = pool.getconn()
+        return conn
+    except psycopg2.pool.PoolError:
+        # Pool cạn (connection chưa được trả) -> mở connection riêng, close_db sẽ đóng hẳn
+        logger.warning("[DB] Pool exhausted, opening direct connection")
+        return psycopg2.connect(DATABASE_URL)
+
 def get_db():
-    """Get database connection (direct connection)"""
-    return psycopg2.connect(DATABASE_URL)
+    """Get database connection (mượn từ pool dùng chung với db_helpers, trả lại bằng close_db).
+    Trong request: connection được ghi vào flask.g để teardown_request trả về pool nếu route lỗi giữa chừng."""
+    conn = _acquire_db()
+    if has_request_context():
+        g.setdefault('_db_conns', []).append(conn)
+    return conn
 
 def close_db(conn):
-    """Close database connection"""
-    if conn:
+    """Trả connection về pool (rollback transaction dở; connection hỏng/ngoài pool thì đóng hẳn)"""
+    if not conn:
+        return
+    if has_request_context():
+        conns = g.get('_db_conns')
+        if conns and conn in conns:
+            conns.remove(conn)
+    pool = get_pg_pool(DATABASE_URL)
+    broken = bool(conn.closed)
+    if not broken:
+        try:
+            conn.rollback()
+        except Exception:
+            broken = True
+    try:
+        if pool is None:
+            raise psycopg2.pool.PoolError('no pool')
+        pool.putconn(conn, close=broken)
+    except psycopg2.pool.PoolError:
         try:
             conn.close()
         except Exception:
             pass
 
-def init_db():
-    """Initialize database tables"""
+@contextmanager
+def db_cursor(dict_cursor=False):
+    """Yield (conn, cursor): commit khi xong, rollback khi lỗi, luôn trả connection về pool"""
     conn = get_db()
+    try:
+        cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) if dict_cursor else conn.cursor()
+        yield conn, cursor
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        close_db(conn)
+
+@app.teardown_request
+def release_request_db(exc):
+    """Trả về pool các connection mà route chưa close_db (vd exception giữa get_db và close_db)"""
+    for conn in g.pop('_db_conns', ()):
+        logger.warning("[DB] Releasing connection leaked by %s", request.path)
+        close_db(conn)
+
+_COPY_ESCAPE = str.maketrans({'\\': '\\\\', '\t': '\\t', '\n': '\\n', '\r': '\\r'})
+
+def copy_rows(cursor, table, columns, rows):
+    """Bulk load rows bằng COPY FROM STDIN (text format: tab-separated, NULL = \\N)"""
+    buf = io.StringIO()
+    for row in rows:
+        buf.write('\t'.join('\\N' if v is None else str(v).translate(_COPY_ESCAPE) for v in row))
+        buf.write('\n')
+    buf.seek(0)
+    cursor.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT text)", buf)
+
+# Dưới ngưỡng này COPY không lợi hơn execute_values (chi phí dựng buffer > phần parse tiết kiệm)
+COPY_MIN_ROWS = 200
+
+def bulk_insert_rows(cursor, table, columns, rows):
+    """Insert nhiều row: COPY khi đủ lớn, execute_values cho batch nhỏ"""
+    if len(rows) >= COPY_MIN_ROWS:
+        copy_rows(cursor, table, columns, rows)
+    elif rows:
+        psycopg2.extras.execute_values(
+            cursor, f"INSERT INTO {table} ({', '.join(columns)}) VALUES %s", rows, page_size=500
+        )
+
+# Advisory lock id cho init_db: nhiều gunicorn worker boot cùng lúc chỉ 1 worker chạy DDL
+INIT_DB_LOCK_ID = 42
+
+# Indexes tạo bởi init_db: (tên index, bảng, cột)
+DB_INDEXES = (
+    ('idx_gmv_revenue', 'gmv_data', 'revenue DESC'),
+    ('idx_gmv_clicks', 'gmv_data', 'clicks DESC'),
+    ('idx_gmv_orders', 'gmv_data', 'orders DESC'),
+    ('idx_gmv_add_to_cart', 'gmv_data', 'add_to_cart DESC'),
+    ('idx_gmv_confirmed_revenue', 'gmv_data', 'confirmed_revenue DESC'),
+    ('idx_gmv_items_sold', 'gmv_data', 'items_sold DESC'),
+    ('idx_gmv_shop_id', 'gmv_data', 'shop_id'),
+    ('idx_gmv_item_name', 'gmv_data', 'item_name'),
+    # Filter theo session + sort metric (/api/all-data?session_id=..., /api/analytics/top-products):
+    # cả 2 ORDER BY metric DESC NULLS LAST -> index cùng NULLS LAST đọc thẳng theo thứ tự thay vì sort.
+    # Cột session_id do init_multi_session_tables thêm -> nếu chưa có, lần boot sau tạo lại
+    ('idx_gmv_session_revenue_nl', 'gmv_data', 'session_id, revenue DESC NULLS LAST'),
+    ('idx_gmv_session_clicks_nl', 'gmv_data', 'session_id, clicks DESC NULLS LAST'),
+    ('idx_gmv_session_add_to_cart_nl', 'gmv_data', 'session_id, add_to_cart DESC NULLS LAST'),
+    ('idx_gmv_session_orders_nl', 'gmv_data', 'session_id, orders DESC NULLS LAST'),
+    # /api/item-analytics/<item_id>: WHERE item_id = %s
+    ('idx_raw_session_item', 'raw_session_data', 'item_id'),
+    ('idx_brand_users_email', 'brand_users', 'email'),
+    ('idx_user_brand_mapping_email', 'user_brand_mapping', 'user_email'),
+    ('idx_user_brand_mapping_brand', 'user_brand_mapping', 'brand_name'),
+    ('idx_user_shop_mapping_email', 'user_shop_mapping', 'user_email'),
+    ('idx_user_shop_mapping_shop', 'user_shop_mapping', 'shop_id'),
+    ('idx_host_schedule_session', 'host_schedule', 'session_id'),
+    ('idx_host_schedule_host', 'host_schedule', 'host_name'),
+    ('idx_host_schedule_date', 'host_schedule', 'session_date'),
+)
+# Index cũ đã bị thay (trùng cột với index trong DB_INDEXES) -> init_db drop nếu còn
+OBSOLETE_DB_INDEXES = ('idx_gmv_session_revenue',)
+
+def table_db_indexes(table):
+    """(tên index, cột) trong DB_INDEXES của 1 bảng"""
+    return [(index_name, columns) for index_name, t, columns in DB_INDEXES if t == table]
+
+def _column_type(cursor, table, column):
+    """data_type của cột trong information_schema (None nếu chưa có cột)"""
+    cursor.execute('''
+        SELECT data_type FROM information_schema.columns
+        WHERE table_schema = current_schema() AND table_name = %s AND column_name = %s
+    ''', (table, column))
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+def _migrate_to_bigint(cursor, table, column):
+    """ALTER cột sang BIGINT chỉ khi catalog cho thấy còn là INTEGER (tránh AccessExclusiveLock mỗi lần boot)"""
+    if _column_type(cursor, table, column) == 'integer':
+        cursor.execute(f'ALTER TABLE {table} ALTER COLUMN {column} TYPE BIGINT')
+        logger.info("[DB] Migrated %s.%s to BIGINT", table, column)
+
+def create_missing_indexes(conn):
+    """Tạo các index trong DB_INDEXES chưa có bằng CREATE INDEX CONCURRENTLY (không khoá ghi bảng).
+    conn phải ở autocommit; index INVALID (do lần CONCURRENTLY trước lỗi) được drop rồi tạo lại,
+    index trong OBSOLETE_DB_INDEXES được drop."""
+    cursor = conn.cursor()
+    cursor.execute('''
+        SELECT c.relname, i.indisvalid
+        FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+        WHERE c.relnamespace = current_schema()::regnamespace
+    ''')
+    existing = dict(cursor.fetchall())
+    
+    created = 0
+    for index_name, table, columns in DB_INDEXES:
+        if existing.get(index_name):
+            continue
+        try:
+            if index_name in existing:
+                cursor.execute(f'DROP INDEX CONCURRENTLY IF EXISTS {index_name}')
+            cursor.execute(f'CREATE INDEX CONCURRENTLY IF NOT EXISTS {index_name} ON {table}({columns})')
+            created += 1
+        except Exception as e:
+            logger.warning("[DB] Index %s creation note: %s", index_name, e)
+    if created:
+        logger.info("[DB] Created %d index(es)", created)
+    
+    for index_name in OBSOLETE_DB_INDEXES:
+        if index_name not in existing:
+            continue
+        try:
+            cursor.execute(f'DROP INDEX CONCURRENTLY IF EXISTS {index_name}')
+            logger.info("[DB] Dropped obsolete index %s", index_name)
+        except Exception as e:
+            logger.warning("[DB] Index %s drop note: %s", index_name, e)
+
+def init_db():
+    """Initialize database tables (chạy dưới advisory lock, bỏ qua DDL mà catalog cho thấy đã có)"""
+    # Connection riêng: cần autocommit cho CREATE INDEX CONCURRENTLY và giữ session-level lock
+    conn = psycopg2.connect(DATABASE_URL)
+    try:
+        conn.autocommit = True
+        conn.cursor().execute('SELECT pg_advisory_lock(%s)', (INIT_DB_LOCK_ID,))
+        try:
+            conn.autocommit = False
+            _create_tables(conn)
+            conn.commit()
+            
+            conn.autocommit = True
+            create_missing_indexes(conn)
+        finally:
+            conn.rollback()
+            conn.autocommit = True
+            conn.cursor().execute('SELECT pg_advisory_unlock(%s)', (INIT_DB_LOCK_ID,))
+    finally:
+        conn.close()
+    logger.info("[DB] Database tables initialized")
+
+# Stats tổng (không filter) của gmv_data: materialized view 1 row, refresh sau sync + định kỳ
+# (scraper ghi gmv_data từ process khác) -> /api/top-gmv, /api/all-data không aggregate cả bảng mỗi request
+GMV_STATS_LOCK_ID = 9002
+GMV_STATS_REFRESH_INTERVAL = 60  # seconds
+
+def _create_gmv_stats_view(cursor):
+    cursor.execute('''
+        CREATE MATERIALIZED VIEW IF NOT EXISTS gmv_stats AS
+        SELECT 
+            1 as id,
+            COUNT(*) as total_products,
+            COALESCE(SUM(g.revenue), 0) as total_revenue,
+            COALESCE(SUM(g.clicks), 0) as total_clicks,
+            COALESCE(SUM(g.orders), 0) as total_orders,
+            COALESCE(SUM(g.items_sold), 0) as total_items_sold,
+            COALESCE(SUM(g.confirmed_revenue), 0) as total_confirmed_revenue,
+            COUNT(CASE WHEN COALESCE(d.shop_id, g.shop_id) IS NOT NULL AND COALESCE(d.shop_id, g.shop_id) != '' THEN 1 END) as with_link,
+            MAX(g.datetime) as latest_datetime
+        FROM gmv_data g
+        LEFT JOIN deal_list d ON g.item_id = d.item_id
+    ''')
+    # Unique index bắt buộc cho REFRESH ... CONCURRENTLY
+    cursor.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_gmv_stats_id ON gmv_stats(id)')
+
+def _create_gmv_cluster_agg_view(cursor):
+    """Metric theo cluster cho /api/analytics/category-distribution: 1 row / (deal list, session, cluster).
+    Không filter session -> handler cộng dồn các session của deal_list"""
+    # Cột session_id do init_multi_session_tables thêm -> DB mới có thể chưa có lúc init_db tạo view
+    cursor.execute('ALTER TABLE gmv_data ADD COLUMN IF NOT EXISTS session_id TEXT')
+    selects = []
+    for deallist_table in ('deal_list', 'deal_list_2'):
+        join_sql, _, cluster_sql, _ = deallist_join_sql(deallist_table)
+        selects.append(f'''
+            SELECT 
+                '{deallist_table}'::text as deallist_table,
+                COALESCE(g.session_id, '') as session_id,
+                COALESCE({cluster_sql}, 'Không xác định') as cluster,
+                SUM(g.revenue) as revenue,
+                SUM(g.clicks) as clicks,
+                SUM(g.add_to_cart) as add_to_cart,
+                SUM(g.orders) as orders,
+                COUNT(*) as count
+            FROM gmv_data g
+            {join_sql}
+            GROUP BY 1, 2, 3
+        ''')
+    cursor.execute(f"CREATE MATERIALIZED VIEW IF NOT EXISTS gmv_cluster_agg AS {' UNION ALL '.join(selects)}")
+    cursor.execute('''
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_gmv_cluster_agg_key
+        ON gmv_cluster_agg(deallist_table, session_id, cluster)
+    ''')
+
+# Materialized view refresh cùng nhau (sau sync + định kỳ)
+STATS_MATVIEWS = ('gmv_stats', 'gmv_cluster_agg')
+
+def refresh_gmv_stats():
+    """REFRESH MATERIALIZED VIEW CONCURRENTLY gmv_stats + gmv_cluster_agg (reader không bị chặn).
+    Worker khác đang refresh -> bỏ qua, trả False."""
+    with db_cursor() as (conn, cursor):
+        cursor.execute('SELECT pg_try_advisory_xact_lock(%s)', (GMV_STATS_LOCK_ID,))
+        if not cursor.fetchone()[0]:
+            return False
+        for view in STATS_MATVIEWS:
+            cursor.execute(f'REFRESH MATERIALIZED VIEW CONCURRENTLY {view}')
+    return True
+
+def refresh_gmv_stats_job():
+    """Scheduler job: refresh gmv_stats + gmv_cluster_agg định kỳ"""
+    try:
+        refresh_gmv_stats()
+    except Exception as e:
+        print(f"[STATS] gmv_stats refresh failed: {e}")
+
+GMV_STATS_TOTAL_FIELDS = (
+    'total_products', 'total_revenue', 'total_clicks', 'total_orders', 'total_items_sold',
+    'total_confirmed_revenue', 'with_link'
+)
+
+def get_gmv_stats(cursor):
+    """Stats tổng từ gmv_stats (cursor RealDictCursor) -> dict như stats query cũ + latest_datetime"""
+    cursor.execute(f'''
+        SELECT {', '.join(GMV_STATS_TOTAL_FIELDS)}, latest_datetime
+        FROM gmv_stats
+    ''')
+    return cursor.fetchone()
+
+if scheduler is not None:
+    scheduler.add_job(
+        refresh_gmv_stats_job,
+        'interval',
+        seconds=GMV_STATS_REFRESH_INTERVAL,
+        id='gmv_stats_refresh',
+        max_instances=1,
+        coalesce=True,
+        replace_existing=True
+    )
+
+def deallist_join_sql(deallist_table='deal_list'):
+    """SQL (join, shop_id, cluster, link_sp) để đọc gmv_data g theo deal list của session.
+    Giá trị deal list ưu tiên hơn cột scraper ghi; item không có trong deal list giữ nguyên cột g.
+    Link theo g.shop_id đã có sẵn trong cột generated link_sp_computed -> chỉ row có shop trong
+    deal list khác g.shop_id mới phải ghép link lúc đọc."""
+    return (
+        f'LEFT JOIN {deallist_table} d ON g.item_id = d.item_id',
+        'COALESCE(d.shop_id, g.shop_id)',
+        'COALESCE(d.cluster, g.cluster)',
+        '''CASE 
+                WHEN d.shop_id IS NULL OR d.shop_id = g.shop_id THEN g.link_sp_computed
+                WHEN d.shop_id != '' THEN 'https://shopee.vn/a-i.' || d.shop_id || '.' || g.item_id
+                ELSE g.link_sp
+            END'''
+    )
+
+def _create_tables(conn):
+    """CREATE TABLE / ADD COLUMN IF NOT EXISTS + migrate kiểu cột (1 transaction, caller commit)"""
     cursor = conn.cursor()
     
     # Config table
@@ -242,23 +968,8 @@ def init_db():
     ''')
     
     # Migrate existing revenue columns from INTEGER to BIGINT if needed
-    try:
-        cursor.execute('''
-            ALTER TABLE gmv_data 
-            ALTER COLUMN revenue TYPE BIGINT
-        ''')
-        print("[DB] Migrated gmv_data.revenue to BIGINT")
-    except Exception as e:
-        print(f"[DB] Revenue column migration note: {e}")
-    
-    try:
-        cursor.execute('''
-            ALTER TABLE gmv_data 
-            ALTER COLUMN confirmed_revenue TYPE BIGINT
-        ''')
-        print("[DB] Migrated gmv_data.confirmed_revenue to BIGINT")
-    except Exception as e:
-        print(f"[DB] Confirmed revenue column migration note: {e}")
+    _migrate_to_bigint(cursor, 'gmv_data', 'revenue')
+    _migrate_to_bigint(cursor, 'gmv_data', 'confirmed_revenue')
     
     # Add new columns if not exists (for existing databases)
     cursor.execute('''
@@ -284,14 +995,7 @@ def init_db():
     ''')
     
     # Migrate existing revenue column from INTEGER to BIGINT if needed
-    try:
-        cursor.execute('''
-            ALTER TABLE raw_session_data 
-            ALTER COLUMN revenue TYPE BIGINT
-        ''')
-        print("[DB] Migrated raw_session_data.revenue to BIGINT")
-    except Exception as e:
-        print(f"[DB] Revenue column migration note: {e}")
+    _migrate_to_bigint(cursor, 'raw_session_data', 'revenue')
     
     # Add new columns to existing raw_session_data table if not exists
     try:
@@ -338,17 +1042,41 @@ def init_db():
     except Exception:
         pass  # Column might already exist
     
-    # Create indexes for faster sorting and filtering
-    try:
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_gmv_revenue ON gmv_data(revenue DESC)')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_gmv_clicks ON gmv_data(clicks DESC)')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_gmv_orders ON gmv_data(orders DESC)')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_gmv_add_to_cart ON gmv_data(add_to_cart DESC)')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_gmv_shop_id ON gmv_data(shop_id)')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_gmv_item_name ON gmv_data(item_name)')
-        print("[DB] Indexes created for gmv_data")
-    except Exception as e:
-        print(f"[DB] Index creation note: {e}")
+    # Link Shopee theo shop_id của chính row (cột scraper ghi), Postgres tính 1 lần lúc ghi;
+    # read path chỉ ghép lại link khi deal list map sang shop khác (xem deallist_join_sql)
+    cursor.execute('''
+        ALTER TABLE gmv_data ADD COLUMN IF NOT EXISTS link_sp_computed TEXT
+        GENERATED ALWAYS AS (
+            CASE WHEN shop_id IS NOT NULL AND shop_id != ''
+                 THEN 'https://shopee.vn/a-i.' || shop_id || '.' || item_id
+                 ELSE link_sp
+            END
+        ) STORED
+    ''')
+    
+    # Deal List tables (sync_deallist_only / sync_deallist2_only ghi vào)
+    for deallist_table in ('deal_list', 'deal_list_2'):
+        cursor.execute(f'''
+            CREATE TABLE IF NOT EXISTS {deallist_table} (
+                item_id TEXT PRIMARY KEY,
+                shop_id TEXT,
+                cluster TEXT,
+                brand_name TEXT
+            )
+        ''')
+        # Add brand_name column if not exists (for existing tables)
+        cursor.execute(f'ALTER TABLE {deallist_table} ADD COLUMN IF NOT EXISTS brand_name TEXT')
+    
+    _create_gmv_stats_view(cursor)
+    _create_gmv_cluster_agg_view(cursor)
+    
+    # Session -> Deal List (1 hoặc 2) mapping
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS session_deallist_config (
+            session_id TEXT PRIMARY KEY,
+            deallist_id INTEGER DEFAULT 1
+        )
+    ''')
     
     # Users table for OAuth authentication
     cursor.execute('''
@@ -400,17 +1128,6 @@ def init_db():
         )
     ''')
     
-    # Create indexes for brand tables
-    try:
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_brand_users_email ON brand_users(email)')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_user_brand_mapping_email ON user_brand_mapping(user_email)')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_user_brand_mapping_brand ON user_brand_mapping(brand_name)')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_user_shop_mapping_email ON user_shop_mapping(user_email)')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_user_shop_mapping_shop ON user_shop_mapping(shop_id)')
-        print("[DB] Indexes created for brand_users and user_brand_mapping")
-    except Exception as e:
-        print(f"[DB] Brand table index creation note: {e}")
-
     
     # Initialize host_schedule table (Host Performance feature)
     try:
@@ -428,16 +1145,22 @@ def init_db():
                 updated_at TIMESTAMP DEFAULT NOW()
             )
         ''')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_host_schedule_session ON host_schedule(session_id)')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_host_schedule_host ON host_schedule(host_name)')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_host_schedule_date ON host_schedule(session_date)')
-        print("[DB] host_schedule table and indexes created")
+        logger.info("[DB] host_schedule table created")
     except Exception as e:
-        print(f"[DB] Host schedule table creation note: {e}")
-    
-    conn.commit()
-    conn.close()
-    print("[DB] Database tables initialized")
+        logger.warning("[DB] Host schedule table creation note: %s", e)
+
+_db_initialized = False
+_db_init_lock = threading.Lock()
+
+def ensure_db_initialized():
+    """Chạy init_db() đúng 1 lần mỗi process"""
+    global _db_initialized
+    if _db_initialized:
+        return
+    with _db_init_lock:
+        if not _db_initialized:
+            init_db()
+            _db_initialized = True
 
 # ============== Host Performance Functions (NEW) ==============
 
@@ -464,13 +1187,13 @@ def init_host_schedule_table():
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_host_schedule_session ON host_schedule(session_id)')
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_host_schedule_host ON host_schedule(host_name)')
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_host_schedule_date ON host_schedule(session_date)')
-        print("[DB] Created indexes for host_schedule")
+        logger.info("[DB] Created indexes for host_schedule")
     except Exception as e:
-        print(f"[DB] Host schedule index creation note: {e}")
+        logger.warning("[DB] Host schedule index creation note: %s", e)
     
     conn.commit()
-    conn.close()
-    print("[DB] host_schedule table initialized")
+    close_db(conn)
+    logger.info("[DB] host_schedule table initialized")
 
 def sync_host_schedule_from_sheet(sheet_url):
     """
@@ -510,7 +1233,7 @@ def sync_host_schedule_from_sheet(sheet_url):
         except Exception:
             pass
         
-        inserted = 0
+        schedule_rows = []
         for record in records:
             # Adapt to various column naming conventions
             session_id = record.get("Session ID", record.get("SessionID", record.get("session_id", "")))
@@ -560,14 +1283,18 @@ def sync_host_schedule_from_sheet(sheet_url):
                         start_time = f"{hour:02d}:{minute:02d}:00"
             
             if session_id and host:
-                cursor.execute('''
-                    INSERT INTO host_schedule (session_id, session_date, start_time, end_time, duration_minutes, host_name, cohost_name)
-                    VALUES (%s, %s, %s, %s, %s, %s, %s)
-                ''', (session_id, date_str or None, start_time, end_time, duration, host, cohost or None))
-                inserted += 1
+                schedule_rows.append((session_id, date_str or None, start_time, end_time, duration, host, cohost or None))
+        
+        # 1 câu INSERT nhiều VALUES mỗi 500 row thay vì 1 round-trip mỗi row
+        if schedule_rows:
+            psycopg2.extras.execute_values(cursor, '''
+                INSERT INTO host_schedule (session_id, session_date, start_time, end_time, duration_minutes, host_name, cohost_name)
+                VALUES %s
+            ''', schedule_rows, page_size=500)
+        inserted = len(schedule_rows)
         
         conn.commit()
-        conn.close()
+        close_db(conn)
         
         return (True, f"Successfully synced {inserted} schedule entries", inserted)
         
@@ -746,7 +1473,7 @@ def get_host_performance_data(host_filter=None, time_filter="all"):
             achieved = r.get('achieved_gmv', 0)
             print(f"  {r['host_name']}: start_gmv={start_gmv:,}, end_gmv={end_gmv:,}, achieved={achieved:,}")
         
-        conn.close()
+        close_db(conn)
         
         return [dict(r) for r in results]
         
@@ -761,32 +1488,69 @@ def get_all_hosts():
         cursor = conn.cursor()
         cursor.execute('SELECT DISTINCT host_name FROM host_schedule ORDER BY host_name')
         hosts = [row[0] for row in cursor.fetchall()]
-        conn.close()
+        close_db(conn)
         return hosts
     except Exception as e:
         print(f"[HOST] Error getting hosts: {e}")
         return []
 
 
+# Config cache: key -> (fetched_at monotonic, value). set_config ghi xuyên;
+# TTL chặn stale khi worker gunicorn khác ghi config
+CONFIG_CACHE_TTL = 30  # seconds
+_config_cache = {}
+_config_cache_lock = threading.Lock()
+
 def get_config(key):
     """Get config value by key"""
-    conn = get_db()
-    cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-    cursor.execute('SELECT value FROM config WHERE key = %s', (key,))
-    row = cursor.fetchone()
-    conn.close()
-    return row['value'] if row else None
-
-def set_config(key, value):
-    """Set config value"""
-    conn = get_db()
-    cursor = conn.cursor()
-    cursor.execute('''
-        INSERT INTO config (key, value) VALUES (%s, %s)
+    return get_configs(key)[key]
+
+def get_configs(*keys):
+    """Nhiều config 1 lần: key còn trong cache lấy từ cache, key còn lại gom 1 query -> {key: value}"""
+    now = time.monotonic()
+    values = {}
+    missing = []
+    for key in keys:
+        entry = _config_cache.get(key)
+        if entry and now - entry[0] < CONFIG_CACHE_TTL:
+            values[key] = entry[1]
+        else:
+            missing.append(key)
+    if missing:
+        with db_cursor() as (conn, cursor):
+            cursor.execute('SELECT key, value FROM config WHERE key = ANY(%s)', (missing,))
+            found = dict(cursor.fetchall())
+        now = time.monotonic()
+        with _config_cache_lock:
+            for key in missing:
+                values[key] = found.get(key)
+                _config_cache[key] = (now, values[key])
+    return values
+
+def set_config(key, value, cursor=None):
+    """Set config value. Truyền cursor -> ghi trong transaction của caller (caller tự commit)"""
+    set_configs({key: value}, cursor=cursor)
+
+def set_configs(values, cursor=None):
+    """Ghi nhiều config {key: value} bằng 1 INSERT ... ON CONFLICT (1 round-trip)"""
+    sql = '''
+        INSERT INTO config (key, value) VALUES %s
         ON CONFLICT (key) DO UPDATE SET value = EXCLUDED.value
-    ''', (key, value))
-    conn.commit()
-    conn.close()
+    '''
+    rows = list(values.items())
+    if cursor is None:
+        with db_cursor() as (conn, cursor):
+            psycopg2.extras.execute_values(cursor, sql, rows)
+        now = time.monotonic()
+        with _config_cache_lock:
+            for key, value in rows:
+                _config_cache[key] = (now, value)
+    else:
+        psycopg2.extras.execute_values(cursor, sql, rows)
+        # Chưa commit (có thể rollback) -> chỉ bỏ cache, lần đọc sau lấy lại từ DB
+        with _config_cache_lock:
+            for key, _ in rows:
+                _config_cache.pop(key, None)
 
 # ============== Brand Portal Authentication Helpers ==============
 
@@ -829,7 +1593,7 @@ def create_brand_user(email, password, full_name=None):
         print(f"[BRAND AUTH] Error creating user: {e}")
         return None
     finally:
-        conn.close()
+        close_db(conn)
 
 def validate_brand_login(email, password):
     """Validate brand user login credentials"""
@@ -840,7 +1604,7 @@ def validate_brand_login(email, password):
         WHERE email = %s AND is_active = TRUE
     ''', (email,))
     user = cursor.fetchone()
-    conn.close()
+    close_db(conn)
     
     if not user:
         return None
@@ -854,7 +1618,7 @@ def validate_brand_login(email, password):
             WHERE id = %s
         ''', (user['id'],))
         conn.commit()
-        conn.close()
+        close_db(conn)
         return dict(user)
     
     return None
@@ -869,7 +1633,7 @@ def get_user_brands(user_email):
         ORDER BY brand_name
     ''', (user_email,))
     brands = [row[0] for row in cursor.fetchall()]
-    conn.close()
+    close_db(conn)
     return brands
 
 def assign_brand_to_user(user_email, brand_name):
@@ -890,7 +1654,7 @@ def assign_brand_to_user(user_email, brand_name):
         print(f"[BRAND] Error assigning brand: {e}")
         return False
     finally:
-        conn.close()
+        close_db(conn)
 
 def remove_brand_from_user(user_email, brand_name):
     """Remove a brand assignment from a user"""
@@ -901,7 +1665,7 @@ def remove_brand_from_user(user_email, brand_name):
         WHERE user_email = %s AND brand_name = %s
     ''', (user_email, brand_name))
     conn.commit()
-    conn.close()
+    close_db(conn)
     print(f"[BRAND] Removed {brand_name} from {user_email}")
     return True
 
@@ -927,7 +1691,7 @@ def get_all_brand_users():
         ORDER BY bu.created_at DESC
     ''')
     users = cursor.fetchall()
-    conn.close()
+    close_db(conn)
     return [dict(u) for u in users]
 
 def delete_brand_user(user_id):
@@ -954,7 +1718,7 @@ def delete_brand_user(user_id):
         print(f"[BRAND] Error deleting user: {e}")
         return False
     finally:
-        conn.close()
+        close_db(conn)
 
 def update_brand_user_password(user_id, new_password):
     """Update brand user password"""
@@ -974,7 +1738,7 @@ def update_brand_user_password(user_id, new_password):
         print(f"[BRAND] Error updating password: {e}")
         return False
     finally:
-        conn.close()
+        close_db(conn)
 
 def toggle_brand_user_status(user_id, is_active):
     """Enable or disable a brand user account"""
@@ -985,7 +1749,7 @@ def toggle_brand_user_status(user_id, is_active):
         WHERE id = %s
     ''', (is_active, user_id))
     conn.commit()
-    conn.close()
+    close_db(conn)
     status = "activated" if is_active else "deactivated"
     print(f"[BRAND] User ID {user_id} {status}")
     return True
@@ -1011,7 +1775,7 @@ def assign_shop_to_user(user_email, shop_id, brand_label=None):
         print(f"[SHOP] Error assigning shop: {e}")
         return False
     finally:
-        conn.close()
+        close_db(conn)
 
 def get_user_shops(user_email):
     """Get list of shop IDs and brand label assigned to a user"""
@@ -1024,7 +1788,7 @@ def get_user_shops(user_email):
         ORDER BY brand_label, shop_id
     ''', (user_email,))
     shops = cursor.fetchall()
-    conn.close()
+    close_db(conn)
     return [dict(s) for s in shops]
 
 def remove_shop_from_user(user_email, shop_id):
@@ -1036,7 +1800,7 @@ def remove_shop_from_user(user_email, shop_id):
         WHERE user_email = %s AND shop_id = %s
     ''', (user_email, shop_id))
     conn.commit()
-    conn.close()
+    close_db(conn)
     print(f"[SHOP] Removed shop {shop_id} from {user_email}")
     return True
 
@@ -1069,7 +1833,7 @@ def update_user_shops(user_email, shop_data):
         print(f"[SHOP] Error updating shops: {e}")
         return False
     finally:
-        conn.close()
+        close_db(conn)
 
 def update_brand_user_info(user_id, email=None, full_name=None, password=None):
     """Update brand user information"""
@@ -1103,12 +1867,13 @@ def update_brand_user_info(user_id, email=None, full_name=None, password=None):
         print(f"[BRAND] Error updating user info: {e}")
         return False
     finally:
-        conn.close()
+        close_db(conn)
 
 # ============== Google Sheets Functions ==============
 
+@lru_cache(maxsize=1)
 def get_gspread_client():
-    """Get authenticated gspread client"""
+    """Get authenticated gspread client (cache: credentials không đổi, token tự refresh)"""
     # Try service account key from env (base64) or file
     service_account_json = os.environ.get('GOOGLE_SERVICE_ACCOUNT_JSON')
     
@@ -1132,25 +1897,58 @@ def get_gspread_client():
     
     return gspread.authorize(creds)
 
+# Spreadsheet object theo spreadsheet ID (bỏ qua metadata lookup ở các lần sync sau)
+_spreadsheet_cache = {}
+
+@lru_cache(maxsize=64)
+def spreadsheet_id_from_url(spreadsheet_url):
+    """URL -> spreadsheet ID (ID của Google Sheet không bao giờ đổi)"""
+    return extract_id_from_url(spreadsheet_url)
+
+def open_spreadsheet_cached(spreadsheet_url):
+    """open_by_key 1 lần mỗi spreadsheet - title/worksheets có thể cũ, dùng fetch_spreadsheet_title nếu cần"""
+    spreadsheet_id = spreadsheet_id_from_url(spreadsheet_url)
+    spreadsheet = _spreadsheet_cache.get(spreadsheet_id)
+    if spreadsheet is None:
+        spreadsheet = get_gspread_client().open_by_key(spreadsheet_id)
+        _spreadsheet_cache[spreadsheet_id] = spreadsheet
+    return spreadsheet
+
+def fetch_spreadsheet_title(spreadsheet):
+    """Title mới nhất của spreadsheet (chỉ lấy field properties.title, không kéo metadata các sheet)"""
+    metadata = spreadsheet.fetch_sheet_metadata(params={'fields': 'properties.title'})
+    return metadata['properties']['title']
+
+def batch_get_sheet_values(spreadsheet, sheet_names):
+    """Đọc nhiều sheet trong 1 request values.batchGet.
+    Trả list values theo thứ tự sheet_names, đã pad ô trống như get_all_values()."""
+    ranges = ["'{}'".format(name.replace("'", "''")) for name in sheet_names]
+    response = spreadsheet.values_batch_get(ranges)
+    return [fill_gaps(value_range.get('values', [])) for value_range in response.get('valueRanges', [])]
+
 def get_spreadsheet_sheets(spreadsheet_url):
     """Get list of sheet names from spreadsheet"""
     client = get_gspread_client()
     spreadsheet = client.open_by_url(spreadsheet_url)
     return [sheet.title for sheet in spreadsheet.worksheets()]
 
+
+def begin_sync_transaction(cursor):
+    """Sync ghi cả bảng trong 1 transaction: tắt synchronous_commit (SET LOCAL -> chỉ transaction này,
+    connection trả về pool vẫn mặc định). Data dựng lại được từ Sheets nên mất vài ms cuối khi crash không sao."""
+    cursor.execute('SET LOCAL synchronous_commit = off')
+
 def sync_deallist_only(spreadsheet_url, deallist_sheet_name):
     """
     Sync Deal List vào bảng deal_list riêng trong PostgreSQL.
     Data mới từ scraper sẽ tự động được map qua JOIN.
     Returns: (count, spreadsheet_title)
     """
-    client = get_gspread_client()
-    spreadsheet = client.open_by_url(spreadsheet_url)
-    spreadsheet_title = spreadsheet.title  # Lấy tên spreadsheet
+    spreadsheet = open_spreadsheet_cached(spreadsheet_url)
+    spreadsheet_title = fetch_spreadsheet_title(spreadsheet)  # Lấy tên spreadsheet
     
     # Read Deal list
-    deallist_sheet = spreadsheet.worksheet(deallist_sheet_name)
-    deallist_values = deallist_sheet.get_all_values()
+    deallist_values, = batch_get_sheet_values(spreadsheet, [deallist_sheet_name])
     
     # Find header row - look for row with actual column names (not just counts)
     header_row_idx = 0
@@ -1170,62 +1968,37 @@ def sync_deallist_only(spreadsheet_url, deallist_sheet_name):
         headers = deallist_values[0] if deallist_values else []
         data_rows = deallist_values[1:] if len(deallist_values) > 1 else []
     
-    # Convert to list of dicts
-    deallist_data = []
-    for row in data_rows:
-        if any(cell.strip() for cell in row):
-            row_dict = {}
-            for i, header in enumerate(headers):
-                if i < len(row):
-                    row_dict[header] = row[i]
-            deallist_data.append(row_dict)
+    # Bỏ row trống; đọc thẳng từ list theo index cột (không dựng dict cho từng row)
+    deallist_rows = [row for row in data_rows if any(cell.strip() for cell in row)]
     
     # Find column names
     item_id_col = None
     shop_id_col = None
     cluster_col = None
     brand_col = None  # New: column for brand name (Nhãn hàng)
+    item_id_idx = shop_id_idx = cluster_idx = brand_idx = None
     
-    if deallist_data:
-        first_row_keys = list(deallist_data[0].keys())
-        # First pass: look for 'finalitemid' specifically (priority)
-        for key in first_row_keys:
-            key_lower = key.lower().replace(' ', '').replace('_', '')
-            if 'finalitemid' in key_lower:
-                item_id_col = key
-            if 'shopid' in key_lower:
-                shop_id_col = key
-            if 'cluster' in key_lower:
-                cluster_col = key
-            # Look for brand column: "Nhãn hàng" only (exact match to avoid matching price columns)
-            if key_lower == 'nhãnhàng' or key_lower == 'nhanhang' or key.strip().lower() == 'nhãn hàng':
-                brand_col = key
-        # Second pass: fallback to 'itemid' if finalitemid not found
-        if not item_id_col:
-            for key in first_row_keys:
-                key_lower = key.lower().replace(' ', '').replace('_', '')
-                if 'itemid' in key_lower:
-                    item_id_col = key
-                    break
+    if deallist_rows:
+        (item_id_col, shop_id_col, cluster_col, brand_col), \
+            (item_id_idx, shop_id_idx, cluster_idx, brand_idx) = _resolve_deallist_indexes(headers)
     
     # Debug log: which columns were found
     print(f"[DEALLIST DEBUG] item_id_col='{item_id_col}', shop_id_col='{shop_id_col}', cluster_col='{cluster_col}', brand_col='{brand_col}'")
     
     if not item_id_col or not shop_id_col:
-        print(f"[DEALLIST DEBUG] Headers found: {first_row_keys if deallist_data else 'No data'}")
+        print(f"[DEALLIST DEBUG] Headers found: {headers if deallist_rows else 'No data'}")
         raise Exception("Không tìm thấy cột Item ID hoặc Shop ID trong Deal List")
     
     # Prepare data for inserting into deal_list table
     deal_list_items = []
-    for row in deallist_data:
-        item_id = str(row.get(item_id_col, '')).strip()
-        shop_id_raw = str(row.get(shop_id_col, '')).strip()
-        cluster = str(row.get(cluster_col, '')).strip() if cluster_col else ''
+    for row in deallist_rows:
+        row_len = len(row)
+        item_id = row[item_id_idx].strip() if item_id_idx < row_len else ''
+        shop_id_raw = row[shop_id_idx].strip() if shop_id_idx < row_len else ''
+        cluster = row[cluster_idx].strip() if cluster_idx is not None and cluster_idx < row_len else ''
         
         # Get brand_name from dedicated column if exists, otherwise from shop_id format "brand+shopid"
-        brand_name = ''
-        if brand_col:
-            brand_name = str(row.get(brand_col, '')).strip()
+        brand_name = row[brand_idx].strip() if brand_idx is not None and brand_idx < row_len else ''
         
         # Extract shop_id and fallback brand_name from format "brand+shopid"
         if '+' in shop_id_raw:
@@ -1235,7 +2008,7 @@ def sync_deallist_only(spreadsheet_url, deallist_sheet_name):
             shop_id = parts[-1]  # Shop ID after +
         else:
             shop_id = shop_id_raw
-        shop_id = ''.join(c for c in shop_id if c.isdigit())
+        shop_id = _digits_only(shop_id)
         
         if item_id and shop_id:
             deal_list_items.append((item_id, shop_id, cluster, brand_name))
@@ -1251,41 +2024,15 @@ def sync_deallist_only(spreadsheet_url, deallist_sheet_name):
     # Save to deal_list table in PostgreSQL
     conn = get_db()
     cursor = conn.cursor()
-    
-    # Create deal_list table if not exists (with brand_name column)
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS deal_list (
-            item_id TEXT PRIMARY KEY,
-            shop_id TEXT,
-            cluster TEXT,
-            brand_name TEXT
-        )
-    ''')
-    
-    # Add brand_name column if not exists (for existing tables)
-    cursor.execute('''
-        DO $$ 
-        BEGIN 
-            ALTER TABLE deal_list ADD COLUMN IF NOT EXISTS brand_name TEXT;
-        EXCEPTION WHEN duplicate_column THEN 
-            NULL;
-        END $$;
-    ''')
+    begin_sync_transaction(cursor)
     
     # Clear old data
     cursor.execute("DELETE FROM deal_list")
     
-    # Batch insert using executemany
+    # Bulk load bằng COPY (dedupe item_id trước, giữ lần xuất hiện cuối như ON CONFLICT cũ)
     if deal_list_items:
-        insert_sql = '''
-            INSERT INTO deal_list (item_id, shop_id, cluster, brand_name)
-            VALUES (%s, %s, %s, %s)
-            ON CONFLICT (item_id) DO UPDATE SET
-                shop_id = EXCLUDED.shop_id,
-                cluster = EXCLUDED.cluster,
-                brand_name = EXCLUDED.brand_name
-        '''
-        psycopg2.extras.execute_batch(cursor, insert_sql, deal_list_items, page_size=500)
+        unique_items = {item[0]: item for item in deal_list_items}
+        copy_rows(cursor, 'deal_list', ('item_id', 'shop_id', 'cluster', 'brand_name'), unique_items.values())
     
     # Also update gmv_data với shop_id/link từ deal_list (JOIN approach)
     cursor.execute('''
@@ -1299,14 +2046,17 @@ def sync_deallist_only(spreadsheet_url, deallist_sheet_name):
     ''')
     updated_count = cursor.rowcount
     
+    # Update last sync time (cùng transaction -> 1 commit)
+    set_config('last_sync', datetime.now(TZ_ICT).strftime('%Y-%m-%d %H:%M:%S'), cursor=cursor)
+    
     conn.commit()
-    conn.close()
+    close_db(conn)
     
     print(f"[DEALLIST] Saved {len(deal_list_items)} items to deal_list table")
     print(f"[DEALLIST] Updated {updated_count} items in gmv_data with shop_id/link/cluster")
     
-    # Update last sync time
-    set_config('last_sync', datetime.now(timezone(timedelta(hours=7))).strftime('%Y-%m-%d %H:%M:%S'))
+    refresh_gmv_stats_job()
+    invalidate_cache()
     
     return len(deal_list_items), spreadsheet_title
 
@@ -1317,13 +2067,11 @@ def sync_deallist2_only(spreadsheet_url, deallist_sheet_name):
     Tương tự sync_deallist_only nhưng cho deal list thứ 2.
     Returns: (count, spreadsheet_title)
     """
-    client = get_gspread_client()
-    spreadsheet = client.open_by_url(spreadsheet_url)
-    spreadsheet_title = spreadsheet.title  # Lấy tên spreadsheet
+    spreadsheet = open_spreadsheet_cached(spreadsheet_url)
+    spreadsheet_title = fetch_spreadsheet_title(spreadsheet)  # Lấy tên spreadsheet
     
     # Read Deal list
-    deallist_sheet = spreadsheet.worksheet(deallist_sheet_name)
-    deallist_values = deallist_sheet.get_all_values()
+    deallist_values, = batch_get_sheet_values(spreadsheet, [deallist_sheet_name])
     
     # Find header row
     header_row_idx = 0
@@ -1342,62 +2090,37 @@ def sync_deallist2_only(spreadsheet_url, deallist_sheet_name):
         headers = deallist_values[0] if deallist_values else []
         data_rows = deallist_values[1:] if len(deallist_values) > 1 else []
     
-    # Convert to list of dicts
-    deallist_data = []
-    for row in data_rows:
-        if any(cell.strip() for cell in row):
-            row_dict = {}
-            for i, header in enumerate(headers):
-                if i < len(row):
-                    row_dict[header] = row[i]
-            deallist_data.append(row_dict)
+    # Bỏ row trống; đọc thẳng từ list theo index cột (không dựng dict cho từng row)
+    deallist_rows = [row for row in data_rows if any(cell.strip() for cell in row)]
     
     # Find column names - same logic as sync_deallist_only
     item_id_col = None
     shop_id_col = None
     cluster_col = None
     brand_col = None  # New: column for brand name (Nhãn hàng)
+    item_id_idx = shop_id_idx = cluster_idx = brand_idx = None
     
-    if deallist_data:
-        first_row_keys = list(deallist_data[0].keys())
-        # First pass: look for 'finalitemid' specifically (priority)
-        for key in first_row_keys:
-            key_lower = key.lower().replace(' ', '').replace('_', '')
-            if 'finalitemid' in key_lower:
-                item_id_col = key
-            if 'shopid' in key_lower:
-                shop_id_col = key
-            if 'cluster' in key_lower:
-                cluster_col = key
-            # Look for brand column: "Nhãn hàng" only (exact match to avoid matching price columns)
-            if key_lower == 'nhãnhàng' or key_lower == 'nhanhang' or key.strip().lower() == 'nhãn hàng':
-                brand_col = key
-        # Second pass: fallback to 'itemid' if finalitemid not found
-        if not item_id_col:
-            for key in first_row_keys:
-                key_lower = key.lower().replace(' ', '').replace('_', '')
-                if 'itemid' in key_lower:
-                    item_id_col = key
-                    break
+    if deallist_rows:
+        (item_id_col, shop_id_col, cluster_col, brand_col), \
+            (item_id_idx, shop_id_idx, cluster_idx, brand_idx) = _resolve_deallist_indexes(headers)
     
     # Debug log: which columns were found
     print(f"[DEALLIST2 DEBUG] item_id_col='{item_id_col}', shop_id_col='{shop_id_col}', cluster_col='{cluster_col}', brand_col='{brand_col}'")
     
     if not item_id_col or not shop_id_col:
-        print(f"[DEALLIST2 DEBUG] Headers found: {first_row_keys if deallist_data else 'No data'}")
+        print(f"[DEALLIST2 DEBUG] Headers found: {headers if deallist_rows else 'No data'}")
         raise Exception("Không tìm thấy cột Item ID hoặc Shop ID trong Deal List 2")
     
     # Prepare data - same logic as sync_deallist_only
     deal_list_items = []
-    for row in deallist_data:
-        item_id = str(row.get(item_id_col, '')).strip()
-        shop_id_raw = str(row.get(shop_id_col, '')).strip()
-        cluster = str(row.get(cluster_col, '')).strip() if cluster_col else ''
+    for row in deallist_rows:
+        row_len = len(row)
+        item_id = row[item_id_idx].strip() if item_id_idx < row_len else ''
+        shop_id_raw = row[shop_id_idx].strip() if shop_id_idx < row_len else ''
+        cluster = row[cluster_idx].strip() if cluster_idx is not None and cluster_idx < row_len else ''
         
         # Get brand_name from dedicated column if exists, otherwise from shop_id format "brand+shopid"
-        brand_name = ''
-        if brand_col:
-            brand_name = str(row.get(brand_col, '')).strip()
+        brand_name = row[brand_idx].strip() if brand_idx is not None and brand_idx < row_len else ''
         
         # Extract shop_id and fallback brand_name from format "brand+shopid"
         if '+' in shop_id_raw:
@@ -1407,7 +2130,7 @@ def sync_deallist2_only(spreadsheet_url, deallist_sheet_name):
             shop_id = parts[-1]  # Shop ID after +
         else:
             shop_id = shop_id_raw
-        shop_id = ''.join(c for c in shop_id if c.isdigit())
+        shop_id = _digits_only(shop_id)
         
         if item_id and shop_id:
             deal_list_items.append((item_id, shop_id, cluster, brand_name))
@@ -1417,92 +2140,59 @@ def sync_deallist2_only(spreadsheet_url, deallist_sheet_name):
     # Save to deal_list_2 table in PostgreSQL
     conn = get_db()
     cursor = conn.cursor()
-    
-    # Create deal_list_2 table if not exists (with brand_name column)
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS deal_list_2 (
-            item_id TEXT PRIMARY KEY,
-            shop_id TEXT,
-            cluster TEXT,
-            brand_name TEXT
-        )
-    ''')
-    
-    # Add brand_name column if not exists (for existing tables)
-    cursor.execute('''
-        DO $$ 
-        BEGIN 
-            ALTER TABLE deal_list_2 ADD COLUMN IF NOT EXISTS brand_name TEXT;
-        EXCEPTION WHEN duplicate_column THEN 
-            NULL;
-        END $$;
-    ''')
+    begin_sync_transaction(cursor)
     
     # Clear old data
     cursor.execute("DELETE FROM deal_list_2")
     
-    # Batch insert
+    # Bulk load bằng COPY (dedupe item_id trước, giữ lần xuất hiện cuối như ON CONFLICT cũ)
     if deal_list_items:
-        insert_sql = '''
-            INSERT INTO deal_list_2 (item_id, shop_id, cluster, brand_name)
-            VALUES (%s, %s, %s, %s)
-            ON CONFLICT (item_id) DO UPDATE SET
-                shop_id = EXCLUDED.shop_id,
-                cluster = EXCLUDED.cluster,
-                brand_name = EXCLUDED.brand_name
-        '''
-        psycopg2.extras.execute_batch(cursor, insert_sql, deal_list_items, page_size=500)
+        unique_items = {item[0]: item for item in deal_list_items}
+        copy_rows(cursor, 'deal_list_2', ('item_id', 'shop_id', 'cluster', 'brand_name'), unique_items.values())
     
     conn.commit()
-    conn.close()
+    close_db(conn)
     
     print(f"[DEALLIST2] Saved {len(deal_list_items)} items to deal_list_2 table")
+    refresh_gmv_stats_job()
+    invalidate_cache()
     
     return len(deal_list_items), spreadsheet_title
 
 
 def get_session_deallist_mapping():
     """Get all session -> deallist mappings"""
-    conn = get_db()
-    cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-    
-    # Create table if not exists
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS session_deallist_config (
-            session_id TEXT PRIMARY KEY,
-            deallist_id INTEGER DEFAULT 1
-        )
-    ''')
-    conn.commit()
-    
-    cursor.execute('SELECT session_id, deallist_id FROM session_deallist_config')
-    rows = cursor.fetchall()
-    conn.close()
+    with db_cursor(dict_cursor=True) as (conn, cursor):
+        cursor.execute('SELECT session_id, deallist_id FROM session_deallist_config')
+        rows = cursor.fetchall()
     
-    return {row['session_id']: row['deallist_id'] for row in rows}
+    mapping = {row['session_id']: row['deallist_id'] for row in rows}
+    # Đã có cả bảng -> nạp luôn cache của get_deallist_for_session
+    now = time.monotonic()
+    with _session_deallist_lock:
+        if len(_session_deallist_cache) + len(mapping) > SESSION_DEALLIST_CACHE_MAX:
+            _session_deallist_cache.clear()
+        for session_id, deallist_id in mapping.items():
+            _session_deallist_cache[session_id] = (now, deallist_id)
+    return mapping
 
 
+# session_id -> (fetched_at monotonic, deallist_id), TTL như config cache
+_session_deallist_cache = {}
+_session_deallist_lock = threading.Lock()
+SESSION_DEALLIST_CACHE_MAX = 1024  # session_id lạ (query string) không làm cache phình mãi
+
 def set_session_deallist_mapping(session_id, deallist_id):
     """Set which deallist a session uses (1 or 2)"""
-    conn = get_db()
-    cursor = conn.cursor()
-    
-    # Create table if not exists
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS session_deallist_config (
-            session_id TEXT PRIMARY KEY,
-            deallist_id INTEGER DEFAULT 1
-        )
-    ''')
-    
-    cursor.execute('''
-        INSERT INTO session_deallist_config (session_id, deallist_id)
-        VALUES (%s, %s)
-        ON CONFLICT (session_id) DO UPDATE SET deallist_id = EXCLUDED.deallist_id
-    ''', (session_id, deallist_id))
-    
-    conn.commit()
-    conn.close()
+    with db_cursor() as (conn, cursor):
+        cursor.execute('''
+            INSERT INTO session_deallist_config (session_id, deallist_id)
+            VALUES (%s, %s)
+            ON CONFLICT (session_id) DO UPDATE SET deallist_id = EXCLUDED.deallist_id
+        ''', (session_id, deallist_id))
+    with _session_deallist_lock:
+        _session_deallist_cache[session_id] = (time.monotonic(), deallist_id)
+    invalidate_cache()  # mapping đổi -> cluster/shop join theo deal list khác
     
     return True
 
@@ -1512,10 +2202,28 @@ def get_deallist_for_session(session_id):
     if not session_id:
         return 1
     
-    mapping = get_session_deallist_mapping()
-    return mapping.get(session_id, 1)
+    entry = _session_deallist_cache.get(session_id)
+    if entry and time.monotonic() - entry[0] < CONFIG_CACHE_TTL:
+        return entry[1]
+    
+    # Lookup 1 row theo PK (không kéo cả bảng như get_session_deallist_mapping)
+    with db_cursor() as (conn, cursor):
+        cursor.execute('SELECT deallist_id FROM session_deallist_config WHERE session_id = %s', (session_id,))
+        row = cursor.fetchone()
+    deallist_id = row[0] if row else 1
+    with _session_deallist_lock:
+        if len(_session_deallist_cache) >= SESSION_DEALLIST_CACHE_MAX:
+            _session_deallist_cache.clear()
+        _session_deallist_cache[session_id] = (time.monotonic(), deallist_id)
+    return deallist_id
 
 
+# Thứ tự cột khi bulk insert gmv_data từ Google Sheet
+GMV_DATA_COLUMNS = (
+    'item_id', 'item_name', 'revenue', 'shop_id', 'link_sp', 'datetime', 'clicks',
+    'ctr', 'orders', 'items_sold', 'cluster', 'add_to_cart', 'confirmed_revenue'
+)
+
 def sync_data_from_sheets(spreadsheet_url, rawdata_sheet_name, deallist_sheet_name):
     """
     Sync data from Google Sheets to SQLite
@@ -1524,15 +2232,15 @@ def sync_data_from_sheets(spreadsheet_url, rawdata_sheet_name, deallist_sheet_na
     3. Generate link sản phẩm
     4. Lưu vào SQLite
     """
-    client = get_gspread_client()
-    spreadsheet = client.open_by_url(spreadsheet_url)
+    spreadsheet = open_spreadsheet_cached(spreadsheet_url)
     
-    # 1. Read Deal list to create item_id -> shop_id mapping
-    deallist_sheet = spreadsheet.worksheet(deallist_sheet_name)
+    # Deal list + Raw data trong 1 request batchGet
+    # (sheet có notes row ở trên: Row 1 = notes/colors, Row 2 = actual headers)
+    deallist_values, rawdata_values = batch_get_sheet_values(
+        spreadsheet, [deallist_sheet_name, rawdata_sheet_name]
+    )
     
-    # Use get_all_values() to handle sheets with notes row at top
-    # Row 1 = notes/colors, Row 2 = actual headers
-    deallist_values = deallist_sheet.get_all_values()
+    # 1. Read Deal list to create item_id -> shop_id mapping
     
     # Find header row (skip empty rows and look for row with column names)
     header_row_idx = 0
@@ -1551,48 +2259,24 @@ def sync_data_from_sheets(spreadsheet_url, rawdata_sheet_name, deallist_sheet_na
         headers = deallist_values[0] if deallist_values else []
         data_rows = deallist_values[1:] if len(deallist_values) > 1 else []
     
-    # Convert to list of dicts
-    deallist_data = []
-    for row in data_rows:
-        if any(cell.strip() for cell in row):  # Skip empty rows
-            row_dict = {}
-            for i, header in enumerate(headers):
-                if i < len(row):
-                    row_dict[header] = row[i]
-            deallist_data.append(row_dict)
-    
-    # Find the correct column names for item_id, shop_id, and cluster in deal list
-    item_id_col = None
-    shop_id_col = None
-    cluster_col = None
+    # Bỏ row trống; đọc thẳng từ list theo index cột (không dựng dict cho từng row)
+    deallist_rows = [row for row in data_rows if any(cell.strip() for cell in row)]  # Skip empty rows
     
-    if deallist_data:
-        first_row_keys = list(deallist_data[0].keys())
-        # First pass: look for 'finalitemid' specifically (priority)
-        for key in first_row_keys:
-            key_lower = key.lower().replace(' ', '').replace('_', '')
-            if 'finalitemid' in key_lower:
-                item_id_col = key
-            if 'shopid' in key_lower:
-                shop_id_col = key
-            if 'cluster' in key_lower:
-                cluster_col = key
-        # Second pass: fallback to 'itemid' if finalitemid not found
-        if not item_id_col:
-            for key in first_row_keys:
-                key_lower = key.lower().replace(' ', '').replace('_', '')
-                if 'itemid' in key_lower:
-                    item_id_col = key
-                    break
+    # Find the correct columns for item_id, shop_id, and cluster in deal list
+    item_id_idx = shop_id_idx = cluster_idx = None
+    
+    if deallist_rows:
+        _, (item_id_idx, shop_id_idx, cluster_idx, _) = _resolve_deallist_indexes(headers)
     
     # Create mapping dicts
     item_to_shop = {}
     item_to_cluster = {}
-    if item_id_col and shop_id_col:
-        for row in deallist_data:
-            item_id = str(row.get(item_id_col, '')).strip()
-            shop_id_raw = str(row.get(shop_id_col, '')).strip()
-            cluster = str(row.get(cluster_col, '')).strip() if cluster_col else ''
+    if item_id_idx is not None and shop_id_idx is not None:
+        for row in deallist_rows:
+            row_len = len(row)
+            item_id = row[item_id_idx].strip() if item_id_idx < row_len else ''
+            shop_id_raw = row[shop_id_idx].strip() if shop_id_idx < row_len else ''
+            cluster = row[cluster_idx].strip() if cluster_idx is not None and cluster_idx < row_len else ''
             
             # Extract only numeric part from shop_id (remove brand+ prefix if exists)
             # e.g., "vinamilk+975865932" -> "975865932"
@@ -1602,7 +2286,7 @@ def sync_data_from_sheets(spreadsheet_url, rawdata_sheet_name, deallist_sheet_na
                 shop_id = shop_id_raw
             
             # Ensure shop_id is numeric only
-            shop_id = ''.join(c for c in shop_id if c.isdigit())
+            shop_id = _digits_only(shop_id)
             
             if item_id and shop_id:
                 item_to_shop[item_id] = shop_id
@@ -1610,9 +2294,7 @@ def sync_data_from_sheets(spreadsheet_url, rawdata_sheet_name, deallist_sheet_na
                 item_to_cluster[item_id] = cluster
 
     
-    # 2. Read Raw data sheet (GMV data) - same approach for handling notes row
-    rawdata_sheet = spreadsheet.worksheet(rawdata_sheet_name)
-    rawdata_values = rawdata_sheet.get_all_values()
+    # 2. Raw data sheet (GMV data) - same approach for handling notes row
     
     # Find header row
     raw_header_idx = 0
@@ -1630,171 +2312,137 @@ def sync_data_from_sheets(spreadsheet_url, rawdata_sheet_name, deallist_sheet_na
         raw_headers = rawdata_values[0] if rawdata_values else []
         raw_data_rows = rawdata_values[1:] if len(rawdata_values) > 1 else []
     
-    # Convert to list of dicts
-    rawdata = []
-    for row in raw_data_rows:
-        if any(str(cell).strip() for cell in row):
-            row_dict = {}
-            for i, header in enumerate(raw_headers):
-                if i < len(row):
-                    row_dict[header] = row[i]
-            rawdata.append(row_dict)
-    
     # Find column names in raw data
     # Expected: DateTime, Item ID, Tên sản phẩm, Lượt click, Tỷ lệ click, Tổng đơn hàng, Các mặt hàng được bán, Doanh thu, Tỷ lệ click để đặt hàng, Thêm vào giỏ hàng
     
-    gmv_items = []
-    
-    for row in rawdata:
-        # Try to find item_id column
-        item_id = None
-        for key in row.keys():
-            key_lower = key.lower().replace(' ', '').replace('_', '')
-            if 'itemid' in key_lower:
-                item_id = str(row[key]).strip()
-                break
-        
-        if not item_id:
-            continue
-        
-        # Get other fields
-        item_name = ''
-        datetime_str = ''
-        revenue = 0
-        clicks = 0
-        ctr = ''
-        orders = 0
-        items_sold = 0
-        add_to_cart = 0
-        confirmed_revenue = 0
-        
-        for key, value in row.items():
-            key_lower = key.lower().replace(' ', '')
-            key_normalized = normalize_vietnamese(key)  # Remove Vietnamese diacritics
+    # Resolve header -> chỉ số cột 1 lần, sau đó đọc thẳng theo index trên list
+    # get_all_values() (không dựng dict cho từng row, không normalize từng cell)
+    item_id_idx = None
+    field_idx = {}
+    for idx, key in enumerate(raw_headers):
+        if item_id_idx is None and 'itemid' in key.lower().replace(' ', '').replace('_', ''):
+            item_id_idx = idx
+        field = _classify_gmv_header(key)
+        if field:
+            field_idx.setdefault(field, []).append(idx)
+    # Nhiều cột cùng field -> cột bên phải nhất (mà row có) thắng
+    field_idx = {field: idxs[::-1] for field, idxs in field_idx.items()}
+    
+    def cell(row, field, default=None):
+        n = len(row)
+        for i in field_idx.get(field, ()):
+            if i < n:
+                return row[i]
+        return default
+    
+    # Keep LAST occurrence of each item_id: data append từ trên xuống -> duyệt ngược,
+    # gặp item_id lần đầu là bản mới nhất, các row cũ hơn bỏ qua luôn (không parse rồi ghi đè)
+    item_latest = {}
+    if item_id_idx is not None:
+        for row in reversed(raw_data_rows):
+            if item_id_idx >= len(row):
+                continue
+            item_id = str(row[item_id_idx]).strip()
+            if not item_id or item_id in item_latest:
+                continue
             
-            if 'tensanpham' in key_normalized or 'itemname' in key_normalized:
-                item_name = str(value)
-            elif 'datetime' in key_lower or 'thoigian' in key_normalized:
-                datetime_str = str(value)
-            elif ('doanhthu' in key_normalized) and 'confirm' not in key_lower and 'nmv' not in key_lower:
-                # Only match "Doanh thu" column, NOT "NMV (Confirmed Revenue)"
-                try:
-                    revenue = int(float(str(value).replace(',', '').replace('.', '').strip() or 0))
-                except:
-                    revenue = 0
-            elif 'luotclick' in key_normalized or 'clicks' in key_normalized:
-                try:
-                    clicks = int(value or 0)
-                except:
-                    clicks = 0
-            elif 'tyleclick' in key_normalized and 'dathang' not in key_normalized:
-                ctr = str(value)
-            elif 'tongdonhang' in key_normalized or 'orders' in key_normalized:
-                try:
-                    orders = int(value or 0)
-                except:
-                    orders = 0
-            elif 'mathang' in key_normalized or 'itemssold' in key_normalized:
-                try:
-                    items_sold = int(value or 0)
-                except:
-                    items_sold = 0
-            elif 'themvaogio' in key_normalized or 'giohang' in key_normalized or 'addtocart' in key_lower:
-                try:
-                    add_to_cart = int(value or 0)
-                except:
-                    add_to_cart = 0
-            elif 'nmv' in key_lower or 'confirm' in key_lower:
-                try:
-                    confirmed_revenue = int(float(str(value).replace(',', '').replace('.', '').strip() or 0))
-                except:
-                    confirmed_revenue = 0
-        # Map shop_id and cluster from deal list
-        shop_id = item_to_shop.get(item_id, '')
-        cluster = item_to_cluster.get(item_id, '')
-        
-        # Generate link
-        link_sp = ''
-        if shop_id and item_id:
-            link_sp = f"https://shopee.vn/a-i.{shop_id}.{item_id}"
-        
-        gmv_items.append({
-            'item_id': item_id,
-            'item_name': item_name,
-            'revenue': revenue,
-            'shop_id': shop_id,
-            'link_sp': link_sp,
-            'datetime': datetime_str,
-            'clicks': clicks,
-            'ctr': ctr,
-            'orders': orders,
-            'items_sold': items_sold,
-            'cluster': cluster,
-            'add_to_cart': add_to_cart,
-            'confirmed_revenue': confirmed_revenue
-        })
+            # Map shop_id and cluster from deal list
+            shop_id = item_to_shop.get(item_id, '')
+            
+            # Thứ tự theo GMV_DATA_COLUMNS
+            item_latest[item_id] = (
+                item_id,
+                str(cell(row, 'item_name', '')),
+                _parse_money(cell(row, 'revenue')),
+                shop_id,
+                f"https://shopee.vn/a-i.{shop_id}.{item_id}" if shop_id else '',
+                str(cell(row, 'datetime', '')),
+                _parse_int(cell(row, 'clicks')),
+                str(cell(row, 'ctr', '')),
+                _parse_int(cell(row, 'orders')),
+                _parse_int(cell(row, 'items_sold')),
+                item_to_cluster.get(item_id, ''),
+                _parse_int(cell(row, 'add_to_cart')),
+                _parse_money(cell(row, 'confirmed_revenue'))
+            )
+    
+    print(f"[SYNC] Processing {len(item_latest)} unique items")
     
-    # 3. Save to SQLite - Keep LAST occurrence of each item_id
-    # Since data is appended top-to-bottom, we iterate and OVERWRITE
-    # so the last (most recent) row for each item is kept
     conn = get_db()
     cursor = conn.cursor()
     
-    # Clear old data
-    cursor.execute('DELETE FROM gmv_data')
+    columns = ', '.join(GMV_DATA_COLUMNS)
+    begin_sync_transaction(cursor)
     
-    # Keep LAST occurrence of each item_id (just overwrite as we iterate)
-    item_latest = {}
-    for item in gmv_items:
-        item_latest[item['item_id']] = item
+    # Nạp vào bảng tạm (TEMP -> không ghi WAL), tự drop khi commit/rollback
+    cursor.execute('''
+        CREATE TEMP TABLE gmv_data_stage (LIKE gmv_data INCLUDING DEFAULTS) ON COMMIT DROP
+    ''')
+    copy_rows(cursor, 'gmv_data_stage', GMV_DATA_COLUMNS, item_latest.values())
+    cursor.execute('ANALYZE gmv_data_stage')
     
-    print(f"[SYNC] Processing {len(item_latest)} unique items")
+    # Merge trong cùng transaction (reader không bao giờ thấy bảng rỗng):
+    # chỉ xóa row không còn / đã đổi, chỉ insert row mới -> row không đổi không sinh dead tuple
+    cursor.execute(f'''
+        DELETE FROM gmv_data g
+        WHERE g.session_id IS NOT NULL
+           OR NOT EXISTS (
+                SELECT 1 FROM gmv_data_stage s
+                WHERE s.item_id = g.item_id
+                  AND ({', '.join('s.' + c for c in GMV_DATA_COLUMNS)})
+                      IS NOT DISTINCT FROM ({', '.join('g.' + c for c in GMV_DATA_COLUMNS)})
+           )
+    ''')
+    removed = cursor.rowcount
+    cursor.execute(f'''
+        INSERT INTO gmv_data ({columns})
+        SELECT {columns} FROM gmv_data_stage s
+        WHERE NOT EXISTS (SELECT 1 FROM gmv_data g WHERE g.item_id = s.item_id)
+    ''')
+    inserted = cursor.rowcount
+    print(f"[SYNC] gmv_data merge: {removed} removed/changed, {inserted} inserted")
     
-    # Insert
-    for item in item_latest.values():
-        cursor.execute('''
-            INSERT INTO gmv_data 
-            (item_id, item_name, revenue, shop_id, link_sp, datetime, clicks, ctr, orders, items_sold, cluster, add_to_cart, confirmed_revenue)
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-            ON CONFLICT (item_id) DO UPDATE SET
-                item_name = EXCLUDED.item_name,
-                revenue = EXCLUDED.revenue,
-                shop_id = EXCLUDED.shop_id,
-                link_sp = EXCLUDED.link_sp,
-                datetime = EXCLUDED.datetime,
-                clicks = EXCLUDED.clicks,
-                ctr = EXCLUDED.ctr,
-                orders = EXCLUDED.orders,
-                items_sold = EXCLUDED.items_sold,
-                cluster = EXCLUDED.cluster,
-                add_to_cart = EXCLUDED.add_to_cart,
-                confirmed_revenue = EXCLUDED.confirmed_revenue
-        ''', (
-            item['item_id'],
-            item['item_name'],
-            item['revenue'],
-            item['shop_id'],
-            item['link_sp'],
-            item['datetime'],
-            item['clicks'],
-            item['ctr'],
-            item['orders'],
-            item['items_sold'],
-            item['cluster'],
-            item['add_to_cart'],
-            item['confirmed_revenue']
-        ))
+    # Update last sync time (cùng transaction -> 1 commit)
+    set_config('last_sync', datetime.now(TZ_ICT).strftime('%Y-%m-%d %H:%M:%S'), cursor=cursor)
     
     conn.commit()
-    conn.close()
+    close_db(conn)
+    
+    # Data đổi -> cập nhật thống kê cho planner ngay (không đợi autovacuum) để chọn đúng index
+    if removed or inserted:
+        with db_cursor() as (conn, cursor):
+            cursor.execute('ANALYZE gmv_data')
     
-    # Update last sync time
-    set_config('last_sync', datetime.now(timezone(timedelta(hours=7))).strftime('%Y-%m-%d %H:%M:%S'))
+    refresh_gmv_stats_job()
+    invalidate_cache()
     
     return len(item_latest)
 
 # ============== Auto-Sync Functions ==============
 
+# Advisory lock id cho sync gmv_data: mỗi gunicorn worker có scheduler riêng,
+# chỉ worker giữ được lock mới chạy sync (các worker khác bỏ qua lượt này).
+# /api/sync thủ công cũng lấy lock này -> không bao giờ 2 merge gmv_data chạy song song
+AUTO_SYNC_LOCK_ID = 9001
+
+def acquire_auto_sync_lock():
+    """Thử lấy advisory lock của auto-sync; trả về connection giữ lock, hoặc None nếu worker khác đang giữ.
+    
+    Dùng xact lock trên connection riêng (không mượn pool) -> lock tự nhả khi rollback/close,
+    kể cả khi worker chết giữa chừng.
+    """
+    conn = psycopg2.connect(DATABASE_URL)
+    try:
+        cursor = conn.cursor()
+        cursor.execute('SELECT pg_try_advisory_xact_lock(%s)', (AUTO_SYNC_LOCK_ID,))
+        if cursor.fetchone()[0]:
+            return conn
+    except Exception:
+        conn.close()
+        raise
+    conn.close()
+    return None
+
 def auto_sync_job():
     """Background job that syncs data every 5 minutes (300 seconds)"""
     global auto_sync_state
@@ -1802,23 +2450,31 @@ def auto_sync_job():
     now = datetime.now()
     
     # Perform sync
+    lock_conn = None
     try:
-        spreadsheet_url = get_config('spreadsheet_url')
-        rawdata_sheet = get_config('rawdata_sheet')
-        deallist_sheet = get_config('deallist_sheet')
-        
-        if all([spreadsheet_url, rawdata_sheet, deallist_sheet]):
-            count = sync_data_from_sheets(spreadsheet_url, rawdata_sheet, deallist_sheet)
-            auto_sync_state['last_auto_sync'] = now.isoformat()
-            print(f"[AUTO-SYNC] {now.strftime('%H:%M:%S')} - Synced {count} products successfully")
+        lock_conn = acquire_auto_sync_lock()
+        if lock_conn is None:
+            print(f"[AUTO-SYNC] {now.strftime('%H:%M:%S')} - Another worker is syncing. Skipping.")
         else:
-            print(f"[AUTO-SYNC] Missing configuration. Skipping sync.")
+            config = get_configs('spreadsheet_url', 'rawdata_sheet', 'deallist_sheet')
+            spreadsheet_url = config['spreadsheet_url']
+            rawdata_sheet = config['rawdata_sheet']
+            deallist_sheet = config['deallist_sheet']
+            
+            if all([spreadsheet_url, rawdata_sheet, deallist_sheet]):
+                count = sync_data_from_sheets(spreadsheet_url, rawdata_sheet, deallist_sheet)
+                auto_sync_state['last_auto_sync'] = now.isoformat()
+                print(f"[AUTO-SYNC] {now.strftime('%H:%M:%S')} - Synced {count} products successfully")
+            else:
+                print(f"[AUTO-SYNC] Missing configuration. Skipping sync.")
     except Exception as e:
         print(f"[AUTO-SYNC] Error: {str(e)}")
+    finally:
+        if lock_conn is not None:
+            lock_conn.close()  # nhả advisory lock
     
     # Update next sync time (5 minutes = 300 seconds)
-    auto_sync_state['next_sync'] = (now.replace(second=0, microsecond=0) + 
-                                     __import__('datetime').timedelta(seconds=300)).isoformat()
+    auto_sync_state['next_sync'] = (now.replace(second=0, microsecond=0) + SYNC_INTERVAL).isoformat()
 
 def start_auto_sync():
     """Start the auto-sync scheduler (runs every 5 minutes continuously)"""
@@ -1834,19 +2490,20 @@ def start_auto_sync():
     
     auto_sync_state['running'] = True
     
-    # Run first sync immediately
-    print(f"[AUTO-SYNC] Running first sync immediately...")
-    auto_sync_job()
-    
-    # Schedule every 300 seconds (5 minutes)
+    # Schedule every 300 seconds (5 minutes); lượt đầu chạy ngay trên thread scheduler,
+    # request /api/auto-sync/start không phải chờ gspread + ghi DB
     job = scheduler.add_job(
         auto_sync_job,
         'interval',
-        seconds=300,
-        id='auto_sync_job'
+        seconds=SYNC_INTERVAL.total_seconds(),
+        id='auto_sync_job',
+        next_run_time=datetime.now(),
+        max_instances=1,
+        coalesce=True,
+        replace_existing=True
     )
     auto_sync_state['job_id'] = job.id
-    print(f"[AUTO-SYNC] Started. Will run every 5 minutes continuously.")
+    print(f"[AUTO-SYNC] Started. First sync running in background, then every 5 minutes.")
     return True
 
 def stop_auto_sync():
@@ -1964,14 +2621,9 @@ def admin_fix_history():
 @bod_required
 def admin_setting():
     """Admin Settings panel"""
-    config = {
-        'spreadsheet_url': get_config('spreadsheet_url') or '',
-        'rawdata_sheet': get_config('rawdata_sheet') or '',
-        'deallist_sheet': get_config('deallist_sheet') or '',
-        'deallist2_url': get_config('deallist2_url') or '',
-        'deallist2_sheet': get_config('deallist2_sheet') or '',
-        'last_sync': get_config('last_sync') or 'Chưa sync'
-    }
+    values = get_configs('spreadsheet_url', 'rawdata_sheet', 'deallist_sheet', 'deallist2_url', 'deallist2_sheet', 'last_sync')
+    config = {key: value or '' for key, value in values.items()}
+    config['last_sync'] = values['last_sync'] or 'Chưa sync'
     return render_template('admin.html', config=config)
 
 @app.route('/admin/login', methods=['GET', 'POST'])
@@ -2001,8 +2653,9 @@ def admin_logout():
 def host_performance():
     """Host Performance Report page"""
     # Get config
-    sheet_url = get_config('host_schedule_sheet_url') or ''
-    last_sync = get_config('host_schedule_last_sync') or 'Chưa sync'
+    config = get_configs('host_schedule_sheet_url', 'host_schedule_last_sync')
+    sheet_url = config['host_schedule_sheet_url'] or ''
+    last_sync = config['host_schedule_last_sync'] or 'Chưa sync'
     
     # Get all hosts for filter
     hosts = get_all_hosts()
@@ -2027,8 +2680,10 @@ def api_sync_host_schedule():
     
     if success:
         # Save config
-        set_config('host_schedule_sheet_url', sheet_url)
-        set_config('host_schedule_last_sync', datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+        set_configs({
+            'host_schedule_sheet_url': sheet_url,
+            'host_schedule_last_sync': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        })
     
     return jsonify({
         'success': success,
@@ -2068,7 +2723,7 @@ def api_host_debug():
         ''')
         
         results = cursor.fetchall()
-        conn.close()
+        close_db(conn)
         
         return jsonify({
             'success': True,
@@ -2345,7 +3000,7 @@ def api_brand_gmv_data():
         cursor.execute(stats_query, params)
         stats = cursor.fetchone()
         
-        conn.close()
+        close_db(conn)
         
         return jsonify({
             'success': True,
@@ -2430,7 +3085,7 @@ def api_update_brand_user(user_id):
         cursor = conn.cursor()
         cursor.execute('SELECT email FROM brand_users WHERE id = %s', (user_id,))
         result = cursor.fetchone()
-        conn.close()
+        close_db(conn)
         
         if not result:
             return jsonify({'success': False, 'error': 'User not found'}), 404
@@ -2469,7 +3124,7 @@ def api_update_brand_user(user_id):
                     ''', (working_email, shop_id, brand_label))
             
             conn.commit()
-            conn.close()
+            close_db(conn)
         
         return jsonify({
             'success': True,
@@ -2492,7 +3147,7 @@ def api_update_brand_user_brands(user_id):
         cursor = conn.cursor()
         cursor.execute('SELECT email FROM brand_users WHERE id = %s', (user_id,))
         result = cursor.fetchone()
-        conn.close()
+        close_db(conn)
         
         if not result:
             return jsonify({'success': False, 'error': 'User not found'}), 404
@@ -2724,7 +3379,89 @@ def api_staff_search():
     except Exception as e:
         return jsonify({'success': False, 'error': str(e), 'data': []})
 
+# Field của mỗi item trong /api/top-gmv
+TOP_GMV_FIELDS = (
+    'item_id', 'item_name', 'revenue', 'shop_id', 'link_sp', 'datetime', 'clicks',
+    'ctr', 'orders', 'items_sold', 'cluster', 'add_to_cart', 'confirmed_revenue'
+)
+
+# Cột sort hợp lệ (whitelist chống SQL injection) + ORDER BY dựng sẵn cho mọi (cột, chiều)
+SORT_DIRECTIONS = ('asc', 'desc')
+TOP_GMV_SORT_COLUMNS = frozenset(('revenue', 'clicks', 'add_to_cart', 'orders', 'item_name', 'confirmed_revenue', 'items_sold'))
+ALL_DATA_SORT_COLUMNS = TOP_GMV_SORT_COLUMNS - {'item_name'}
+# top-gmv: item_id làm tie-breaker -> thứ tự ổn định cho OFFSET lẫn keyset
+TOP_GMV_ORDER_BY_SQL = {
+    (col, dir_): f"ORDER BY g.{col} {dir_.upper()}, g.item_id {dir_.upper()}"
+    for col in TOP_GMV_SORT_COLUMNS for dir_ in SORT_DIRECTIONS
+}
+# all-data: NULL luôn coi là nhỏ nhất (DESC NULLS LAST / ASC NULLS FIRST) -> cả 2 chiều đọc theo
+# index (session_id, metric DESC NULLS LAST), chiều ASC là scan ngược
+ALL_DATA_NULLS_SQL = {'desc': 'NULLS LAST', 'asc': 'NULLS FIRST'}
+ALL_DATA_ORDER_BY_SQL = {
+    (col, dir_): f"ORDER BY g.{col} {dir_.upper()} {ALL_DATA_NULLS_SQL[dir_]}"
+    for col in ALL_DATA_SORT_COLUMNS for dir_ in SORT_DIRECTIONS
+}
+
+# Tổng count/stats theo filter tính bằng window OVER () ngay trong query phân trang
+# (1 round-trip, filter chỉ plan + evaluate 1 lần); MAX(datetime) là InitPlan chạy 1 lần
+TOP_GMV_STATS_COLUMNS = '''
+            COUNT(*) OVER () as total_products,
+            COALESCE(SUM(g.revenue) OVER (), 0) as total_revenue,
+            COALESCE(SUM(g.clicks) OVER (), 0) as total_clicks,
+            COALESCE(SUM(g.orders) OVER (), 0) as total_orders,
+            COALESCE(SUM(g.items_sold) OVER (), 0) as total_items_sold,
+            COALESCE(SUM(g.confirmed_revenue) OVER (), 0) as total_confirmed_revenue,
+            COUNT(CASE WHEN COALESCE(d.shop_id, g.shop_id) IS NOT NULL AND COALESCE(d.shop_id, g.shop_id) != '' THEN 1 END) OVER () as with_link
+    '''
+
+@lru_cache(maxsize=256)
+def top_gmv_page_sql(sort_by, sort_dir, has_shop, has_search, use_keyset, window_stats):
+    """SQL query trang của /api/top-gmv theo từng biến thể (dựng 1 lần, cache theo tham số).
+    Thứ tự param: shop_id, search x2, [after_value, after_item_id], limit, [offset]"""
+    where_clauses = []
+    if has_shop:
+        where_clauses.append("COALESCE(d.shop_id, g.shop_id) = %s")
+    if has_search:
+        where_clauses.append("(g.item_name ILIKE %s OR g.item_id ILIKE %s)")
+    if use_keyset:
+        # Row sau cursor theo (sort column, item_id); ASC thì NULL xếp cuối -> luôn nằm sau cursor
+        keyset_sql = f"(g.{sort_by}, g.item_id) {'<' if sort_dir == 'desc' else '>'} (%s, %s)"
+        if sort_dir == 'asc':
+            keyset_sql = f"({keyset_sql} OR g.{sort_by} IS NULL)"
+        where_clauses.append(keyset_sql)
+        limit_sql = "LIMIT %s"
+    else:
+        limit_sql = "LIMIT %s OFFSET %s"
+    where_sql = "WHERE " + " AND ".join(where_clauses) if where_clauses else ""
+    
+    join_sql, shop_id_sql, cluster_sql, link_sp_sql = deallist_join_sql()
+    sql = f'''
+        SELECT 
+            g.item_id, 
+            g.item_name, 
+            g.revenue, 
+            {shop_id_sql} as shop_id,
+            {link_sp_sql} as link_sp,
+            g.datetime, 
+            g.clicks, 
+            g.ctr, 
+            g.orders, 
+            g.items_sold, 
+            COALESCE(g.confirmed_revenue, 0) as confirmed_revenue,
+            {cluster_sql} as cluster, 
+            COALESCE(g.add_to_cart, 0) as add_to_cart,
+            g.{sort_by} as sort_value
+            {',' + TOP_GMV_STATS_COLUMNS + ', (SELECT MAX(datetime) FROM gmv_data) as latest_datetime' if window_stats else ''}
+        FROM gmv_data g
+        {join_sql}
+        {where_sql}
+        {TOP_GMV_ORDER_BY_SQL[(sort_by, sort_dir)]}
+        {limit_sql}
+    '''
+    return sql
+
 @app.route('/api/top-gmv')
+@cached_view('gmv_top')
 def api_top_gmv():
     """API: Get GMV data with pagination and filters"""
     # Pagination params
@@ -2740,16 +3477,26 @@ def api_top_gmv():
     sort_dir = request.args.get('sort_dir', 'desc', type=str).strip().lower()
     
     # Validate sort params to prevent SQL injection
-    allowed_sort_columns = ['revenue', 'clicks', 'add_to_cart', 'orders', 'item_name', 'confirmed_revenue', 'items_sold']
-    if sort_by not in allowed_sort_columns:
+    if sort_by not in TOP_GMV_SORT_COLUMNS:
         sort_by = 'revenue'
-    if sort_dir not in ['asc', 'desc']:
+    if sort_dir not in SORT_DIRECTIONS:
         sort_dir = 'desc'
     
     # Limit per_page to reasonable values
     per_page = min(max(per_page, 10), 10000)  # Allow up to 10000 for full data load
     offset = (page - 1) * per_page
     
+    # Keyset pagination: after_value + after_item_id lấy từ pagination.next_cursor của trang trước
+    # (không có -> LIMIT/OFFSET theo page, dùng cho nhảy trang)
+    after_value = request.args.get('after_value', None, type=str)
+    after_item_id = request.args.get('after_item_id', '', type=str).strip()
+    use_keyset = after_value is not None and bool(after_item_id)
+    if use_keyset and sort_by != 'item_name':
+        try:
+            after_value = int(after_value)
+        except ValueError:
+            return jsonify({'success': False, 'error': 'after_value không hợp lệ'}), 400
+    
     conn = get_db()
     cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
     
@@ -2758,11 +3505,11 @@ def api_top_gmv():
     params = []
     
     if shop_id_filter:
-        where_clauses.append("shop_id = %s")
+        where_clauses.append("COALESCE(d.shop_id, g.shop_id) = %s")
         params.append(shop_id_filter)
     
     if search:
-        where_clauses.append("(item_name ILIKE %s OR item_id ILIKE %s)")
+        where_clauses.append("(g.item_name ILIKE %s OR g.item_id ILIKE %s)")
         search_term = f"%{search}%"
         params.extend([search_term, search_term])
     
@@ -2770,94 +3517,62 @@ def api_top_gmv():
     if where_clauses:
         where_sql = "WHERE " + " AND ".join(where_clauses)
     
-    # Get total count
-    count_query = f"SELECT COUNT(*) as total FROM gmv_data {where_sql}"
-    cursor.execute(count_query, params)
-    total_count = cursor.fetchone()['total']
+    # Không filter -> stats đọc từ materialized view gmv_stats, query trang chỉ còn Index Scan + LIMIT;
+    # có filter -> window trong query trang (keyset thì query stats riêng, xem dưới)
+    use_stats_view = not where_sql
+    window_stats = not use_stats_view and not use_keyset
     
-    # Get paginated data with dynamic sorting - JOIN with deal_list for shop_id mapping
-    data_query = f'''
-        SELECT 
-            g.item_id, 
-            g.item_name, 
-            g.revenue, 
-            COALESCE(d.shop_id, g.shop_id) as shop_id,
-            CASE 
-                WHEN COALESCE(d.shop_id, g.shop_id) IS NOT NULL AND COALESCE(d.shop_id, g.shop_id) != ''
-                THEN 'https://shopee.vn/a-i.' || COALESCE(d.shop_id, g.shop_id) || '.' || g.item_id
-                ELSE g.link_sp
-            END as link_sp,
-            g.datetime, 
-            g.clicks, 
-            g.ctr, 
-            g.orders, 
-            g.items_sold, 
-            g.confirmed_revenue,
-            COALESCE(d.cluster, g.cluster) as cluster, 
-            g.add_to_cart
-        FROM gmv_data g
-        LEFT JOIN deal_list d ON g.item_id = d.item_id
-        {where_sql}
-        ORDER BY g.{sort_by} {sort_dir.upper()}
-        LIMIT %s OFFSET %s
-    '''
-    cursor.execute(data_query, params + [per_page, offset])
+    if use_keyset:
+        page_params = params + [after_value, after_item_id, per_page]
+    else:
+        page_params = params + [per_page, offset]
+    
+    # Get paginated data with dynamic sorting: SQL mỗi biến thể chỉ dựng 1 lần
+    data_query = top_gmv_page_sql(
+        sort_by, sort_dir, bool(shop_id_filter), bool(search), use_keyset, window_stats
+    )
+    cursor.execute(data_query, page_params)
     
     rows = cursor.fetchall()
     
-    # Also get all unique shop_ids for filter dropdown - JOIN with deal_list
-    cursor.execute('''
-        SELECT DISTINCT COALESCE(d.shop_id, g.shop_id) as shop_id 
-        FROM gmv_data g
-        LEFT JOIN deal_list d ON g.item_id = d.item_id
-        WHERE COALESCE(d.shop_id, g.shop_id) IS NOT NULL 
-          AND COALESCE(d.shop_id, g.shop_id) != ''
-        ORDER BY shop_id
-    ''')
-    shop_ids = [row['shop_id'] for row in cursor.fetchall()]
+    if use_stats_view:
+        stats = get_gmv_stats(cursor)
+    elif rows and window_stats:
+        stats = rows[0]
+    elif window_stats and offset == 0:
+        # Trang đầu rỗng = filter không khớp row nào -> tổng = 0, khỏi aggregate lại;
+        # latest_datetime lấy từ gmv_stats (1 row) thay cho MAX(datetime)
+        stats = dict.fromkeys(GMV_STATS_TOTAL_FIELDS, 0)
+        stats['latest_datetime'] = get_gmv_stats(cursor)['latest_datetime']
+    else:
+        # Trang rỗng (page vượt quá / filter không khớp) hoặc keyset (window chỉ thấy row sau cursor)
+        # -> query stats riêng trên toàn bộ filter
+        cursor.execute(f'''
+            SELECT {TOP_GMV_STATS_COLUMNS.replace(' OVER ()', '')},
+                   (SELECT MAX(datetime) FROM gmv_data) as latest_datetime
+            FROM gmv_data g
+            LEFT JOIN deal_list d ON g.item_id = d.item_id
+            {where_sql}
+        ''', params)
+        stats = cursor.fetchone()
+    latest_datetime = stats['latest_datetime']
+    total_count = stats['total_products']
     
-    # Get stats (total revenue, total clicks for summary)
-    stats_query = f'''
-        SELECT 
-            COUNT(*) as total_products,
-            COALESCE(SUM(revenue), 0) as total_revenue,
-            COALESCE(SUM(clicks), 0) as total_clicks,
-            COALESCE(SUM(orders), 0) as total_orders,
-            COALESCE(SUM(items_sold), 0) as total_items_sold,
-            COALESCE(SUM(confirmed_revenue), 0) as total_confirmed_revenue,
-           COUNT(CASE WHEN COALESCE(d.shop_id, g.shop_id) IS NOT NULL AND COALESCE(d.shop_id, g.shop_id) != '' THEN 1 END) as with_link
-        FROM gmv_data g
-        LEFT JOIN deal_list d ON g.item_id = d.item_id
-        {where_sql}
-    '''
-    cursor.execute(stats_query, params)
-    stats = cursor.fetchone()
-    # Get latest datetime from gmv_data
-    cursor.execute('SELECT MAX(datetime) as latest_datetime FROM gmv_data')
-    datetime_row = cursor.fetchone()
-    latest_datetime = datetime_row['latest_datetime'] if datetime_row else None
-    conn.close()
+    # Also get all unique shop_ids for filter dropdown (cache TTL, bỏ trùng do nhiều brand_name)
+    shop_ids = list(dict.fromkeys(get_shop_options(cursor)[0]))
+    close_db(conn)
     
-    data = []
-    for row in rows:
-        data.append({
-            'item_id': row['item_id'],
-            'item_name': row['item_name'],
-            'revenue': row['revenue'],
-            'shop_id': row['shop_id'],
-            'link_sp': row['link_sp'],
-            'datetime': row['datetime'],
-            'clicks': row['clicks'],
-            'ctr': row['ctr'],
-            'orders': row['orders'],
-            'items_sold': row['items_sold'],
-            'cluster': row['cluster'],
-            'add_to_cart': row.get('add_to_cart', 0),
-            'confirmed_revenue': row.get('confirmed_revenue', 0)
-        })
+    # Chỉ lấy field item (row còn cột stats/latest_datetime của window)
+    pick_fields = operator.itemgetter(*TOP_GMV_FIELDS)
+    data = [dict(zip(TOP_GMV_FIELDS, pick_fields(row))) for row in rows]
     
     total_pages = (total_count + per_page - 1) // per_page
     
+    # Cursor cho trang kế (NULL ở cột sort -> không keyset được, frontend dùng page)
+    next_cursor = None
+    if len(rows) == per_page and rows[-1]['sort_value'] is not None:
+        next_cursor = {'after_value': rows[-1]['sort_value'], 'after_item_id': rows[-1]['item_id']}
+    
     return jsonify({
         'success': True,
         'data': data,
@@ -2867,7 +3582,8 @@ def api_top_gmv():
             'total': total_count,
             'total_pages': total_pages,
             'has_next': page < total_pages,
-            'has_prev': page > 1
+            'has_prev': page > 1,
+            'next_cursor': next_cursor
         },
         'stats': {
             'total_products': stats['total_products'],
@@ -2893,29 +3609,101 @@ def api_all_data():
     session_id = request.args.get('session_id', '', type=str).strip()
     
     # Validate sort params
-    allowed_sort_columns = ['revenue', 'clicks', 'add_to_cart', 'orders', 'confirmed_revenue', 'items_sold']
-    if sort_by and sort_by not in allowed_sort_columns:
+    if sort_by and sort_by not in ALL_DATA_SORT_COLUMNS:
         sort_by = ''
-    if sort_dir not in ['asc', 'desc']:
+    if sort_dir not in SORT_DIRECTIONS:
         sort_dir = 'desc'
     
     # Build cache key based on sort and session
     cache_key = f"{sort_by}_{sort_dir}_{session_id}" if sort_by or session_id else "no_sort"
     
     # Check cache first (only if same sort)
-    cached = get_cached_data()
-    if cached is not None and data_cache.get('sort_key') == cache_key:
-        print(f"[CACHE] Serving {len(cached)} products from cache (sort: {cache_key})")
-        return jsonify({
-            'success': True,
-            'data': cached,
-            'shop_ids': data_cache['shop_ids'],
-            'shop_info': data_cache.get('shop_info', []),
-            'stats': data_cache['stats'],
-            'last_sync': data_cache.get('latest_datetime'),
-            'from_cache': True
-        })
+    snapshot = get_cache_snapshot(cache_key)
+    if is_snapshot_fresh(snapshot):
+        print(f"[CACHE] Serving {len(snapshot.data)} products from cache (sort: {cache_key})")
+        return app.response_class(snapshot.body, mimetype='application/json')
+    
+    # Worker khác đã load -> body JSON trong Redis, trả thẳng không encode lại
+    body = redis_get_all_data(cache_key)
+    if body is not None:
+        print(f"[CACHE] Serving all-data from Redis (sort: {cache_key})")
+        return app.response_class(body, mimetype='application/json')
+    
+    # Hết hạn: 1 thread reload, các thread khác trả bản cũ (stale-while-revalidate)
+    refreshing = _cache_refresh_lock.acquire(blocking=False)
+    if not refreshing and snapshot is not None:
+        print(f"[CACHE] Serving stale {len(snapshot.data)} products while reloading (sort: {cache_key})")
+        return jsonify(cache_snapshot_response(snapshot, stale=True))
+    
+    try:
+        data, shop_ids, shop_info, stats, latest_datetime = load_all_data(sort_by, sort_dir, session_id, cache_key)
+    finally:
+        if refreshing:
+            _cache_refresh_lock.release()
+    
+    # Store in cache with sort key
+    snapshot = set_cached_data(data, shop_ids, stats, sort_key=cache_key, shop_info=shop_info, latest_datetime=latest_datetime)
+    redis_set_all_data(cache_key, snapshot.body)
     
+    return jsonify({
+        'success': True,
+        'data': data,
+        'shop_ids': shop_ids,
+        'shop_info': shop_info,
+        'stats': stats,
+        'last_sync': latest_datetime,
+        'from_cache': False
+    })
+
+# ETag + Cache-Control cho response hay bị poll: browser giữ max-age giây, sau đó
+# If-None-Match -> 304 không gửi lại body khi data chưa đổi. endpoint -> max-age (seconds);
+# cache-status = 0: luôn revalidate để trạng thái sync hiện ngay
+CONDITIONAL_ENDPOINTS = {
+    'api_all_data': 30,
+    'api_analytics_top_products': CACHE_TTL,
+    'api_analytics_category_distribution': CACHE_TTL,
+    'api_cache_status': 0,
+}
+# Chart không phụ thuộc user/login -> proxy/CDN được cache chung (s-maxage)
+PUBLIC_CACHE_ENDPOINTS = {'api_analytics_top_products', 'api_analytics_category_distribution'}
+
+@app.after_request
+def add_conditional_headers(response):
+    max_age = CONDITIONAL_ENDPOINTS.get(request.endpoint)
+    if (max_age is not None and request.method == 'GET'
+            and response.status_code == 200 and not response.direct_passthrough):
+        if request.endpoint in PUBLIC_CACHE_ENDPOINTS:
+            response.headers['Cache-Control'] = f'public, max-age={max_age}, s-maxage={max_age}'
+        else:
+            response.headers['Cache-Control'] = f'private, max-age={max_age}'
+        response.add_etag()
+        response.make_conditional(request)
+    return response
+
+def cache_snapshot_response(snapshot, stale=False):
+    response = {
+        'success': True,
+        'data': snapshot.data,
+        'shop_ids': snapshot.shop_ids,
+        'shop_info': snapshot.shop_info,
+        'stats': snapshot.stats,
+        'last_sync': snapshot.latest_datetime,
+        'from_cache': True
+    }
+    if stale:
+        response['stale'] = True
+    return response
+
+# Field của mỗi item trong /api/all-data (thứ tự = cột SELECT trong load_all_data)
+ALL_DATA_FIELDS = (
+    'item_id', 'item_name', 'cover_image', 'revenue', 'shop_id', 'link_sp', 'datetime',
+    'clicks', 'ctr', 'orders', 'items_sold', 'cluster', 'add_to_cart', 'confirmed_revenue'
+)
+
+ALL_DATA_ITERSIZE = 5000  # row / lần fetch của server-side cursor
+
+def load_all_data(sort_by, sort_dir, session_id, cache_key):
+    """Query toàn bộ data cho /api/all-data -> (data, shop_ids, shop_info, stats, latest_datetime)"""
     # Cache miss - load from database
     print(f"[CACHE] Cache miss, loading from database (sort: {cache_key}, session: {session_id})...")
     conn = get_db()
@@ -2937,136 +3725,64 @@ def api_all_data():
             print(f"[API] Using deal_list_2 for session {session_id}")
     
     # Build ORDER BY clause
-    order_clause = f"ORDER BY g.{sort_by} {sort_dir.upper()}" if sort_by else ""
+    order_clause = ALL_DATA_ORDER_BY_SQL[(sort_by, sort_dir)] if sort_by else ""
     
-    # Get all data with optional ORDER BY and session filter - JOIN with appropriate deal_list
+    # JOIN deal list của session (deal_list / deal_list_2) lúc đọc
+    join_sql, shop_id_sql, cluster_sql, link_sp_sql = deallist_join_sql(deallist_table)
+    
+    # Get all data with optional ORDER BY and session filter
+    # Cột SELECT đúng thứ tự ALL_DATA_FIELDS -> đọc tuple, zip 1 lần thành dict
     query = f'''
         SELECT 
             g.item_id, g.item_name, g.cover_image, g.revenue,
-            COALESCE(d.shop_id, g.shop_id) as shop_id,
-            CASE 
-                WHEN COALESCE(d.shop_id, g.shop_id) IS NOT NULL AND COALESCE(d.shop_id, g.shop_id) != ''
-                THEN 'https://shopee.vn/a-i.' || COALESCE(d.shop_id, g.shop_id) || '.' || g.item_id
-                ELSE g.link_sp
-            END as link_sp,
-            g.datetime, g.clicks, g.ctr, g.orders, g.items_sold, g.confirmed_revenue,
-            COALESCE(d.cluster, g.cluster) as cluster, g.add_to_cart,
-            g.session_id, g.session_title
+            {shop_id_sql} as shop_id,
+            {link_sp_sql} as link_sp,
+            g.datetime, g.clicks, g.ctr, g.orders, g.items_sold,
+            {cluster_sql} as cluster,
+            COALESCE(g.add_to_cart, 0) as add_to_cart, COALESCE(g.confirmed_revenue, 0) as confirmed_revenue
         FROM gmv_data g
-        LEFT JOIN {deallist_table} d ON g.item_id = d.item_id
+        {join_sql}
         {where_clause}
         {order_clause}
     '''
-    cursor.execute(query, params)
-    rows = cursor.fetchall()
+    # Server-side cursor: fetch từng ALL_DATA_ITERSIZE row và dựng dict ngay,
+    # không giữ cả list tuple lẫn list dict của toàn bảng cùng lúc trong RAM worker
+    with conn.cursor(name='all_data_cur') as stream_cursor:
+        stream_cursor.itersize = ALL_DATA_ITERSIZE
+        stream_cursor.execute(query, params)
+        data = [dict(zip(ALL_DATA_FIELDS, row)) for row in stream_cursor]
     
-    # Get shop_ids with brand_name - JOIN with deal_list to get brand info
-    # First, try to add brand_name column if not exists (for backward compatibility)
-    try:
-        cursor.execute('''
-            ALTER TABLE deal_list ADD COLUMN IF NOT EXISTS brand_name TEXT
-        ''')
-        conn.commit()
-    except Exception as e:
-        print(f"[API] Note: Could not add brand_name column: {e}")
-        conn.rollback()
+    # Get shop_ids with brand_name (cache TTL, xem get_shop_options)
+    shop_ids, shop_info = get_shop_options(cursor)
     
-    # Try to query with brand_name, fallback to without if column doesn't exist
-    try:
-        cursor.execute('''
-            SELECT DISTINCT 
-                COALESCE(d.shop_id, g.shop_id) as shop_id,
-                COALESCE(d.brand_name, '') as brand_name
-            FROM gmv_data g
-            LEFT JOIN deal_list d ON g.item_id = d.item_id
-            WHERE COALESCE(d.shop_id, g.shop_id) IS NOT NULL 
-              AND COALESCE(d.shop_id, g.shop_id) != ''
-            ORDER BY shop_id
-        ''')
-        shop_info_rows = cursor.fetchall()
-        # Build shop_ids list (for backward compatibility) and shop_info list (new, with brand)
-        shop_ids = [row['shop_id'] for row in shop_info_rows]
-        shop_info = [{'shop_id': row['shop_id'], 'brand_name': row['brand_name']} for row in shop_info_rows]
-    except Exception as e:
-        print(f"[API] Fallback: brand_name column not available, using shop_id only: {e}")
-        cursor.execute('''
-            SELECT DISTINCT COALESCE(d.shop_id, g.shop_id) as shop_id 
+    # Get stats (không filter session -> materialized view gmv_stats)
+    if not session_id:
+        stats_row = get_gmv_stats(cursor)
+        latest_datetime = stats_row['latest_datetime']
+    else:
+        cursor.execute(f'''
+            SELECT 
+                COUNT(*) as total_products,
+                COALESCE(SUM(g.revenue), 0) as total_revenue,
+                COALESCE(SUM(g.clicks), 0) as total_clicks,
+                COALESCE(SUM(g.orders), 0) as total_orders,
+                COALESCE(SUM(g.items_sold), 0) as total_items_sold,
+                COALESCE(SUM(g.confirmed_revenue), 0) as total_confirmed_revenue,
+                COUNT(CASE WHEN {shop_id_sql} IS NOT NULL AND {shop_id_sql} != '' THEN 1 END) as with_link
             FROM gmv_data g
-            LEFT JOIN deal_list d ON g.item_id = d.item_id
-            WHERE COALESCE(d.shop_id, g.shop_id) IS NOT NULL 
-              AND COALESCE(d.shop_id, g.shop_id) != ''
-            ORDER BY shop_id
-        ''')
-        shop_info_rows = cursor.fetchall()
-        shop_ids = [row['shop_id'] for row in shop_info_rows]
-        shop_info = [{'shop_id': row['shop_id'], 'brand_name': ''} for row in shop_info_rows]
-    
-    # Get stats
-    cursor.execute(f'''
-        SELECT 
-            COUNT(*) as total_products,
-            COALESCE(SUM(revenue), 0) as total_revenue,
-            COALESCE(SUM(clicks), 0) as total_clicks,
-            COALESCE(SUM(orders), 0) as total_orders,
-            COALESCE(SUM(items_sold), 0) as total_items_sold,
-            COALESCE(SUM(confirmed_revenue), 0) as total_confirmed_revenue,
-            COUNT(CASE WHEN COALESCE(d.shop_id, g.shop_id) IS NOT NULL AND COALESCE(d.shop_id, g.shop_id) != '' THEN 1 END) as with_link
-        FROM gmv_data g
-        LEFT JOIN {deallist_table} d ON g.item_id = d.item_id
-        {where_clause}
-    ''', params)
-    stats_row = cursor.fetchone()
-    # Get latest datetime from gmv_data
-    cursor.execute('SELECT MAX(datetime) as latest_datetime FROM gmv_data')
-    datetime_row = cursor.fetchone()
-    latest_datetime = datetime_row['latest_datetime'] if datetime_row else None
-    conn.close()
-    
-    # Convert to list of dicts
-    data = []
-    for row in rows:
-        data.append({
-            'item_id': row['item_id'],
-            'item_name': row['item_name'],
-            'cover_image': row.get('cover_image', ''),
-            'revenue': row['revenue'],
-            'shop_id': row['shop_id'],
-            'link_sp': row['link_sp'],
-            'datetime': row['datetime'],
-            'clicks': row['clicks'],
-            'ctr': row['ctr'],
-            'orders': row['orders'],
-            'items_sold': row['items_sold'],
-            'cluster': row['cluster'],
-            'add_to_cart': row.get('add_to_cart', 0),
-            'confirmed_revenue': row.get('confirmed_revenue', 0)
-        })
-    
-    stats = {
-        'total_products': stats_row['total_products'],
-        'total_revenue': stats_row['total_revenue'],
-        'total_clicks': stats_row['total_clicks'],
-        'total_orders': stats_row['total_orders'],
-        'total_items_sold': stats_row['total_items_sold'],
-        'total_confirmed_revenue': stats_row['total_confirmed_revenue'],
-        'with_link': stats_row['with_link']
-    }
+            {join_sql}
+            {where_clause}
+        ''', params)
+        stats_row = cursor.fetchone()
+        # Get latest datetime from gmv_data
+        cursor.execute('SELECT MAX(datetime) as latest_datetime FROM gmv_data')
+        datetime_row = cursor.fetchone()
+        latest_datetime = datetime_row['latest_datetime'] if datetime_row else None
+    close_db(conn)
     
-    # Store in cache with sort key
-    set_cached_data(data, shop_ids, stats)
-    data_cache['sort_key'] = cache_key
-    data_cache['latest_datetime'] = latest_datetime
-    data_cache['shop_info'] = shop_info
+    stats = {field: stats_row[field] for field in GMV_STATS_TOTAL_FIELDS}
     
-    return jsonify({
-        'success': True,
-        'data': data,
-        'shop_ids': shop_ids,
-        'shop_info': shop_info,
-        'stats': stats,
-        'last_sync': latest_datetime,
-        'from_cache': False
-    })
+    return data, shop_ids, shop_info, stats, latest_datetime
 
 @app.route('/api/sheets', methods=['POST'])
 @admin_required
@@ -3080,9 +3796,10 @@ def api_get_sheets():
         return jsonify({'success': False, 'error': 'URL không được để trống'})
     
     # Save config if provided
-    set_config('spreadsheet_url', spreadsheet_url)
+    values = {'spreadsheet_url': spreadsheet_url}
     if deallist_sheet:
-        set_config('deallist_sheet', deallist_sheet)
+        values['deallist_sheet'] = deallist_sheet
+    set_configs(values)
     
     try:
         sheets = get_spreadsheet_sheets(spreadsheet_url)
@@ -3098,10 +3815,9 @@ def api_save_config():
     data = request.get_json()
     
     # Save deallist2 config if provided
-    if 'deallist2_url' in data:
-        set_config('deallist2_url', data['deallist2_url'])
-    if 'deallist2_sheet' in data:
-        set_config('deallist2_sheet', data['deallist2_sheet'])
+    values = {key: data[key] for key in ('deallist2_url', 'deallist2_sheet') if key in data}
+    if values:
+        set_configs(values)
     
     return jsonify({'success': True, 'message': 'Config saved'})
 
@@ -3118,11 +3834,18 @@ def api_sync():
     if not all([spreadsheet_url, rawdata_sheet, deallist_sheet]):
         return jsonify({'success': False, 'error': 'Vui lòng điền đầy đủ thông tin'})
     
+    lock_conn = None
     try:
         # Save config
-        set_config('spreadsheet_url', spreadsheet_url)
-        set_config('rawdata_sheet', rawdata_sheet)
-        set_config('deallist_sheet', deallist_sheet)
+        set_configs({
+            'spreadsheet_url': spreadsheet_url,
+            'rawdata_sheet': rawdata_sheet,
+            'deallist_sheet': deallist_sheet,
+        })
+        
+        lock_conn = acquire_auto_sync_lock()
+        if lock_conn is None:
+            return jsonify({'success': False, 'error': 'Đang có sync khác chạy, vui lòng thử lại sau'})
         
         # Sync data
         count = sync_data_from_sheets(spreadsheet_url, rawdata_sheet, deallist_sheet)
@@ -3134,13 +3857,42 @@ def api_sync():
         })
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)})
+    finally:
+        if lock_conn is not None:
+            lock_conn.close()  # nhả advisory lock
+
+def update_session_titles(cursor, title, session_ids=None):
+    """Ghi session_title cho gmv_data (session chưa archive) + gmv_history trong 1 statement (writable CTE).
+    session_ids=None -> mọi session. Row đã đúng title thì bỏ qua (không sinh dead tuple).
+    Returns: (gmv_data rows, gmv_history rows) đã update"""
+    # IN (SELECT unnest(...)) -> planner chọn được hash semi-join khi danh sách session dài
+    session_filter = "AND session_id IN (SELECT unnest(%(session_ids)s::text[]))" if session_ids is not None else ""
+    cursor.execute(f'''
+        WITH upd_data AS (
+            UPDATE gmv_data 
+            SET session_title = %(title)s 
+            WHERE (is_archived IS NULL OR is_archived = FALSE)
+              AND session_title IS DISTINCT FROM %(title)s
+              {session_filter}
+            RETURNING 1
+        ), upd_history AS (
+            UPDATE gmv_history 
+            SET session_title = %(title)s 
+            WHERE session_title IS DISTINCT FROM %(title)s
+              {session_filter}
+            RETURNING 1
+        )
+        SELECT (SELECT COUNT(*) FROM upd_data), (SELECT COUNT(*) FROM upd_history)
+    ''', {'title': title, 'session_ids': session_ids})
+    return cursor.fetchone()
 
 @app.route('/api/refresh-deallist', methods=['POST'])
 @admin_required
 def api_refresh_deallist():
     """API: Refresh Deal List mapping only (shop_id, link_sp, cluster) without touching GMV data"""
-    spreadsheet_url = get_config('spreadsheet_url')
-    deallist_sheet = get_config('deallist_sheet')
+    config = get_configs('spreadsheet_url', 'deallist_sheet')
+    spreadsheet_url = config['spreadsheet_url']
+    deallist_sheet = config['deallist_sheet']
     
     if not spreadsheet_url or not deallist_sheet:
         return jsonify({'success': False, 'error': 'Chưa cấu hình spreadsheet URL hoặc Deal List sheet'})
@@ -3149,32 +3901,20 @@ def api_refresh_deallist():
         count, sheet_title = sync_deallist_only(spreadsheet_url, deallist_sheet)
         
         # Parse sheet title để lấy tên ngắn gọn
-        from db_helpers import parse_sheet_title
         parsed_title = parse_sheet_title(sheet_title)
         
         # Lưu parsed title vào config để dùng cho session hiện tại
         if parsed_title:
             set_config('current_session_title', parsed_title)
             
-            # Update session_title cho tất cả session active (chưa archive)
+            # Update session_title cho tất cả session active (chưa archive) + gmv_history cho History page
             conn = get_db()
             cursor = conn.cursor()
-            cursor.execute('''
-                UPDATE gmv_data 
-                SET session_title = %s 
-                WHERE (is_archived IS NULL OR is_archived = FALSE)
-            ''',(parsed_title,))
-            updated_rows = cursor.rowcount
-            
-            # Cũng update session_title trong gmv_history cho History page
-            cursor.execute('''
-                UPDATE gmv_history 
-                SET session_title = %s 
-            ''', (parsed_title,))
-            history_updated = cursor.rowcount
+            updated_rows, history_updated = update_session_titles(cursor, parsed_title)
             
             conn.commit()
-            conn.close()
+            close_db(conn)
+            invalidate_cache()
             
             return jsonify({
                 'success': True,
@@ -3196,8 +3936,9 @@ def api_refresh_deallist():
 @admin_required
 def api_refresh_deallist2():
     """API: Refresh Deal List 2 mapping"""
-    spreadsheet_url = get_config('deallist2_url')
-    deallist_sheet = get_config('deallist2_sheet')
+    config = get_configs('deallist2_url', 'deallist2_sheet')
+    spreadsheet_url = config['deallist2_url']
+    deallist_sheet = config['deallist2_sheet']
     
     if not spreadsheet_url or not deallist_sheet:
         return jsonify({'success': False, 'error': 'Chưa cấu hình Deal List 2 URL hoặc sheet'})
@@ -3206,7 +3947,6 @@ def api_refresh_deallist2():
         count, sheet_title = sync_deallist2_only(spreadsheet_url, deallist_sheet)
         
         # Parse sheet title để lấy tên ngắn gọn
-        from db_helpers import parse_sheet_title
         parsed_title = parse_sheet_title(sheet_title)
         
         if parsed_title:
@@ -3218,25 +3958,12 @@ def api_refresh_deallist2():
             if sessions_using_dl2:
                 conn = get_db()
                 cursor = conn.cursor()
-                # Update session_title CHỈ cho các sessions dùng Deal List 2
-                cursor.execute('''
-                    UPDATE gmv_data 
-                    SET session_title = %s 
-                    WHERE session_id = ANY(%s)
-                      AND (is_archived IS NULL OR is_archived = FALSE)
-                ''', (parsed_title, sessions_using_dl2))
-                updated_rows = cursor.rowcount
-                
-                # Cũng update session_title trong gmv_history cho History page
-                cursor.execute('''
-                    UPDATE gmv_history 
-                    SET session_title = %s 
-                    WHERE session_id = ANY(%s)
-                ''', (parsed_title, sessions_using_dl2))
-                history_updated = cursor.rowcount
+                # Update session_title CHỈ cho các sessions dùng Deal List 2 (gmv_data + gmv_history)
+                updated_rows, history_updated = update_session_titles(cursor, parsed_title, sessions_using_dl2)
                 
                 conn.commit()
-                conn.close()
+                close_db(conn)
+                invalidate_cache()
             
             return jsonify({
                 'success': True,
@@ -3293,6 +4020,7 @@ def api_set_session_deallist():
 
 
 @app.route('/api/deallist-count')
+@cached_view('deallist_count')
 def api_deallist_count():
     """API: Get count of items in both deal lists"""
     try:
@@ -3313,7 +4041,7 @@ def api_deallist_count():
         else:
             count2 = 0
         
-        conn.close()
+        close_db(conn)
         
         return jsonify({
             'success': True,
@@ -3327,6 +4055,7 @@ def api_deallist_count():
 # ============== Multi-Session API Routes ==============
 
 @app.route('/api/sessions')
+@cached_view('sessions')
 def api_sessions():
     """API: Get list of active sessions in gmv_data"""
     try:
@@ -3363,10 +4092,10 @@ def api_session_rename():
         if not session_id or not new_title:
             return jsonify({'success': False, 'error': 'Missing session_id or new_title'})
         
-        from db_helpers import update_session_title
         success = update_session_title(DATABASE_URL, session_id, new_title)
         
         if success:
+            invalidate_cache()
             return jsonify({'success': True, 'message': 'Updated session title'})
         else:
             return jsonify({'success': False, 'error': 'Failed to update database'})
@@ -3407,7 +4136,7 @@ def api_cleanup_old_sessions():
         all_sessions = [row[0] for row in cursor.fetchall()]
         
         if len(all_sessions) <= 2:
-            conn.close()
+            close_db(conn)
             return jsonify({
                 'success': True,
                 'message': f'Chỉ có {len(all_sessions)} session(s), không cần xóa',
@@ -3425,7 +4154,9 @@ def api_cleanup_old_sessions():
             deleted_count += cursor.rowcount
         
         conn.commit()
-        conn.close()
+        close_db(conn)
+        refresh_gmv_stats_job()
+        invalidate_cache()
         
         return jsonify({
             'success': True,
@@ -3461,7 +4192,12 @@ def api_delete_selected_sessions():
             cursor.execute('DELETE FROM session_deallist_config WHERE session_id = %s', (session_id,))
         
         conn.commit()
-        conn.close()
+        close_db(conn)
+        refresh_gmv_stats_job()
+        invalidate_cache()
+        with _session_deallist_lock:
+            for session_id in session_ids:
+                _session_deallist_cache.pop(session_id, None)
         
         return jsonify({
             'success': True,
@@ -3478,7 +4214,6 @@ def api_delete_selected_sessions():
 def api_archived_sessions():
     """API: Get list of archived sessions from gmv_history"""
     try:
-        from db_helpers import get_archived_sessions
         sessions = get_archived_sessions(DATABASE_URL)
         
         formatted_sessions = []
@@ -4019,7 +4754,19 @@ def api_fix_history_delete_session():
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)})
 
+def fetch_json_rows(cursor, query, params=()):
+    """JSON array của kết quả query do Postgres dựng (json_agg, giữ thứ tự ORDER BY của subquery).
+    Cast ::text -> psycopg2 trả chuỗi, không parse JSON thành object Python."""
+    cursor.execute(f"SELECT COALESCE(json_agg(t), '[]'::json)::text FROM ({query}) t", params)
+    return cursor.fetchone()[0]
+
+def json_rows_response(rows_json, **extra):
+    """{"success": true, **extra, "data": <rows_json>} - ghép thẳng chuỗi JSON, không encode lại từng row"""
+    head = app.json.dumps({'success': True, **extra})
+    return app.response_class(f'{head[:-1]}, "data": {rows_json}}}', mimetype='application/json')
+
 @app.route('/api/analytics/top-products')
+@cached_view('analytics_top_products')
 def api_analytics_top_products():
     """API: Get top 10 products by selected metric for chart"""
     try:
@@ -4039,20 +4786,20 @@ def api_analytics_top_products():
             params = [session_id]
         
         conn = get_db()
-        cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-        cursor.execute(f'''
+        cursor = conn.cursor()
+        body = fetch_json_rows(cursor, f'''
             SELECT g.item_name as name, g.revenue, g.clicks, g.add_to_cart, g.orders
             FROM gmv_data g
             {where_clause}
             ORDER BY g.{metric} DESC NULLS LAST
             LIMIT 10
         ''', params)
-        rows = cursor.fetchall()
-        conn.close()
-        return jsonify({'success': True, 'data': [dict(r) for r in rows]})
+        close_db(conn)
+        return json_rows_response(body)
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)})
 @app.route('/api/analytics/category-distribution')
+@cached_view('analytics_category')
 def api_analytics_category_distribution():
     """API: Get metric distribution by cluster (category)"""
     try:
@@ -4063,40 +4810,35 @@ def api_analytics_category_distribution():
         if metric not in valid_metrics:
             metric = 'revenue'
         
-        # Build WHERE clause
-        where_clause = ""
-        params = []
-        if session_id:
-            where_clause = "WHERE g.session_id = %s"
-            params = [session_id]
-        
         # Determine which deal_list to use based on session mapping
         deallist_table = "deal_list"
         if session_id:
             deallist_id = get_deallist_for_session(session_id)
             if deallist_id == 2:
                 deallist_table = "deal_list_2"
-                print(f"[CHART] Using deal_list_2 for session {session_id}")
+                logger.debug("[CHART] Using deal_list_2 for session %s", session_id)
         
+        # Đọc aggregate dựng sẵn trong gmv_cluster_agg (refresh sau sync), không GROUP BY gmv_data mỗi request
         conn = get_db()
-        cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-        cursor.execute(f'''
-            SELECT 
-                COALESCE(d.cluster, g.cluster, 'Không xác định') as cluster,
-                SUM(g.revenue) as revenue,
-                SUM(g.clicks) as clicks,
-                SUM(g.add_to_cart) as add_to_cart,
-                SUM(g.orders) as orders,
-                COUNT(*) as count
-            FROM gmv_data g
-            LEFT JOIN {deallist_table} d ON g.item_id = d.item_id
-            {where_clause}
-            GROUP BY COALESCE(d.cluster, g.cluster, 'Không xác định')
-            ORDER BY {metric} DESC NULLS LAST
-        ''', params)
-        rows = cursor.fetchall()
-        conn.close()
-        return jsonify({'success': True, 'data': [dict(r) for r in rows], 'metric': metric})
+        cursor = conn.cursor()
+        if session_id:
+            body = fetch_json_rows(cursor, f'''
+                SELECT cluster, revenue, clicks, add_to_cart, orders, count
+                FROM gmv_cluster_agg
+                WHERE deallist_table = %s AND session_id = %s
+                ORDER BY {metric} DESC NULLS LAST
+            ''', (deallist_table, session_id))
+        else:
+            body = fetch_json_rows(cursor, f'''
+                SELECT cluster, SUM(revenue) as revenue, SUM(clicks) as clicks,
+                       SUM(add_to_cart) as add_to_cart, SUM(orders) as orders, SUM(count)::bigint as count
+                FROM gmv_cluster_agg
+                WHERE deallist_table = 'deal_list'
+                GROUP BY cluster
+                ORDER BY {metric} DESC NULLS LAST
+            ''')
+        close_db(conn)
+        return json_rows_response(body, metric=metric)
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)})
 
@@ -4104,28 +4846,27 @@ def api_analytics_category_distribution():
 def api_cache_status():
     """API: Get cache/data status"""
     conn = get_db()
-    cursor = conn.cursor()
+    cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
     
-    # Count GMV items
-    cursor.execute('SELECT COUNT(*) FROM gmv_data')
-    gmv_count = cursor.fetchone()[0]
+    # Count GMV items + items with shop_id (mapped from deal list): 1 row của gmv_stats, không scan gmv_data
+    stats = get_gmv_stats(cursor)
+    gmv_count = stats['total_products']
+    mapped_count = stats['with_link']
     
-    # Count items with shop_id (mapped from deal list)
-    cursor.execute("SELECT COUNT(*) FROM gmv_data WHERE shop_id IS NOT NULL AND shop_id != ''")
-    mapped_count = cursor.fetchone()[0]
+    close_db(conn)
     
-    conn.close()
+    config = get_configs('last_sync', 'last_deallist_sync')
     
     return jsonify({
         'gmv': {
             'count': gmv_count,
-            'last_update': get_config('last_sync'),
+            'last_update': config['last_sync'],
             'age_seconds': 0,
             'ttl': 300
         },
         'deallist': {
             'count': mapped_count,
-            'last_update': get_config('last_deallist_sync'),
+            'last_update': config['last_deallist_sync'],
             'age_seconds': 0,
             'ttl': 7200
         }
@@ -4150,11 +4891,9 @@ def api_auto_sync_status():
 def api_auto_sync_start():
     """API: Start auto-sync scheduler (every 5 minutes continuously)"""
     # Check if config exists
-    spreadsheet_url = get_config('spreadsheet_url')
-    rawdata_sheet = get_config('rawdata_sheet')
-    deallist_sheet = get_config('deallist_sheet')
+    config = get_configs('spreadsheet_url', 'rawdata_sheet', 'deallist_sheet')
     
-    if not all([spreadsheet_url, rawdata_sheet, deallist_sheet]):
+    if not all(config.values()):
         return jsonify({'success': False, 'error': 'Chưa cấu hình Google Sheets. Vui lòng sync thủ công trước.'})
     
     result = start_auto_sync()
@@ -4177,13 +4916,14 @@ def api_auto_sync_stop():
 @admin_required
 def api_config():
     """API: Get current config"""
+    config = get_configs('spreadsheet_url', 'rawdata_sheet', 'deallist_sheet', 'last_sync')
     return jsonify({
         'success': True,
         'config': {
-            'spreadsheet_url': get_config('spreadsheet_url') or '',
-            'rawdata_sheet': get_config('rawdata_sheet') or '',
-            'deallist_sheet': get_config('deallist_sheet') or '',
-            'last_sync': get_config('last_sync') or 'Chưa sync'
+            'spreadsheet_url': config['spreadsheet_url'] or '',
+            'rawdata_sheet': config['rawdata_sheet'] or '',
+            'deallist_sheet': config['deallist_sheet'] or '',
+            'last_sync': config['last_sync'] or 'Chưa sync'
         }
     })
 
@@ -4201,7 +4941,7 @@ def api_category_distribution():
     ''')
     
     rows = cursor.fetchall()
-    conn.close()
+    close_db(conn)
     
     data = []
     for row in rows:
@@ -4229,7 +4969,7 @@ def api_top_products():
     ''')
     
     rows = cursor.fetchall()
-    conn.close()
+    close_db(conn)
     
     data = []
     for row in rows:
@@ -4290,10 +5030,10 @@ def api_sync_raw_monthly():
     if not spreadsheet_url or not sheet_name:
         return jsonify({'success': False, 'error': 'URL và tên sheet không được để trống'})
     
+    conn = None
     try:
         # Save config
-        set_config('rawdata_monthly_url', spreadsheet_url)
-        set_config('rawdata_monthly_sheet', sheet_name)
+        set_configs({'rawdata_monthly_url': spreadsheet_url, 'rawdata_monthly_sheet': sheet_name})
         
         # Get credentials
         gc = get_gspread_client()
@@ -4304,260 +5044,185 @@ def api_sync_raw_monthly():
         spreadsheet = gc.open_by_url(spreadsheet_url)
         worksheet = spreadsheet.worksheet(sheet_name)
         
-        # Get all data
-        all_data = worksheet.get_all_records()
+        # Get all data (list of lists, không dựng dict cho từng row như get_all_records)
+        values = worksheet.get_all_values()
         
-        if not all_data:
+        if len(values) < 2:
             return jsonify({'success': False, 'error': 'Sheet không có dữ liệu'})
         
         # Find column mappings
-        first_row = all_data[0]
-        keys = list(first_row.keys())
-        
-        item_name_col = None
-        item_id_col = None
-        revenue_col = None
-        clicks_col = None
-        file_col = None
-        session_col = None
-        total_orders_col = None
-        items_sold_col = None
-        add_to_cart_col = None
-        click_to_product_rate_col = None
-        click_to_order_rate_col = None
-        
-        for key in keys:
-            key_lower = key.lower().replace(' ', '').replace('_', '')
-            key_original = key.lower()
-            
-            # Match product name column
-            if item_name_col is None:
-                if 'tên sản phẩm' in key_original or 'tensanpham' in key_lower or 'tênsp' in key_lower or 'tensp' in key_lower or 'itemname' in key_lower or 'productname' in key_lower:
-                    item_name_col = key
-            
-            # Match item ID column
-            if item_id_col is None:
-                if 'item id' in key_original or 'itemid' in key_lower:
-                    item_id_col = key
-            
-            # Match revenue column
-            if revenue_col is None:
-                if 'doanh thu' in key_original or 'doanhthu' in key_lower or 'revenue' in key_lower:
-                    revenue_col = key
-            
-            # Match clicks column
-            if clicks_col is None:
-                if 'click' in key_lower:
-                    clicks_col = key
-            
-            # Match file column
-            if file_col is None:
-                if 'file' in key_lower:
-                    file_col = key
-            
-            # Match session column
-            if session_col is None:
-                if 'phiên' in key_original or 'phien' in key_lower or 'session' in key_lower:
-                    session_col = key
-            
-            # Match total orders column
-            if total_orders_col is None:
-                if 'tổng đơn hàng' in key_original or 'tongdonhang' in key_lower or 'totalorders' in key_lower or 'orders' in key_lower:
-                    total_orders_col = key
-            
-            # Match items sold column
-            if items_sold_col is None:
-                if 'các mặt hàng được bán' in key_original or 'cacmathangduocban' in key_lower or 'itemssold' in key_lower or 'mặt hàng' in key_original:
-                    items_sold_col = key
-            
-            # Match add to cart column
-            if add_to_cart_col is None:
-                if 'thêm vào giỏ hàng' in key_original or 'themvaogiohang' in key_lower or 'addtocart' in key_lower or 'giỏ hàng' in key_original:
-                    add_to_cart_col = key
-            
-            # Match click to product rate column
-            if click_to_product_rate_col is None:
-                if 'tỷ lệ click vào sản phẩm' in key_original or 'tyleclickvaosanpham' in key_lower or 'clicktoproductrate' in key_lower or 'product click rate' in key_original:
-                    click_to_product_rate_col = key
-            
-            # Match click to order rate column
-            if click_to_order_rate_col is None:
-                if 'tỷ lệ click để đặt hàng' in key_original or 'tyleclickdedathang' in key_lower or 'clicktoorderrate' in key_lower or 'click to order rate' in key_original:
-                    click_to_order_rate_col = key
+        keys = [str(h).strip() for h in values[0]]
+        rows = values[1:]
+        
+        # Header -> cột theo role (xem _MONTHLY_HEADER_PATTERNS)
+        cols = _resolve_monthly_cols(keys)
+        item_name_col = cols.get('item_name')
+        item_id_col = cols.get('item_id')
+        revenue_col = cols.get('revenue')
+        clicks_col = cols.get('clicks')
+        file_col = cols.get('file')
+        session_col = cols.get('session')
+        total_orders_col = cols.get('total_orders')
+        items_sold_col = cols.get('items_sold')
+        add_to_cart_col = cols.get('add_to_cart')
+        click_to_product_rate_col = cols.get('click_to_product_rate')
+        click_to_order_rate_col = cols.get('click_to_order_rate')
         
         if not item_id_col:
             return jsonify({'success': False, 'error': 'Không tìm thấy cột Item ID'})
         
         # Log detected columns for debugging
-        print(f"[SYNC DEBUG] Headers: {keys}")
-        print(f"[SYNC DEBUG] Detected: item_name_col={item_name_col}, item_id_col={item_id_col}, revenue_col={revenue_col}, clicks_col={clicks_col}, file_col={file_col}, session_col={session_col}, total_orders_col={total_orders_col}, items_sold_col={items_sold_col}, add_to_cart_col={add_to_cart_col}, click_to_product_rate_col={click_to_product_rate_col}, click_to_order_rate_col={click_to_order_rate_col}")
-        
-        # Clear old data and insert new
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"[SYNC DEBUG] Headers: {keys}")
+            logger.debug(f"[SYNC DEBUG] Detected: item_name_col={item_name_col}, item_id_col={item_id_col}, revenue_col={revenue_col}, clicks_col={clicks_col}, file_col={file_col}, session_col={session_col}, total_orders_col={total_orders_col}, items_sold_col={items_sold_col}, add_to_cart_col={add_to_cart_col}, click_to_product_rate_col={click_to_product_rate_col}, click_to_order_rate_col={click_to_order_rate_col}")
+        
+        # Tách theo cột (column-major): mỗi cột cần dùng là 1 list độ dài N, cột không có -> None
+        col_index = {key: i for i, key in enumerate(keys)}
+        
+        def column(col, default=''):
+            if not col:
+                return None
+            i = col_index[col]
+            return [row[i] if i < len(row) else default for row in rows]
+        
+        def text_column(col):
+            values_ = column(col)
+            return [str(v).strip() for v in values_] if values_ is not None else None
+        
+        def count_column(col, drop_dots=False):
+            values_ = column(col, 0)
+            return [_parse_sheet_count(v, drop_dots) for v in values_] if values_ is not None else None
+        
+        n_rows = len(rows)
+        empty_text = [''] * n_rows
+        zeros = [0] * n_rows
+        item_ids = text_column(item_id_col)
+        item_names = text_column(item_name_col) or empty_text
+        # Parse số (dấu ',' nghìn; doanh thu bỏ cả '.')
+        revenues = count_column(revenue_col, drop_dots=True) or zeros
+        clicks_list = count_column(clicks_col) or zeros
+        file_names = text_column(file_col) or empty_text
+        # Use session_col if exists, otherwise use the selected sheet_name as session_name
+        session_names = text_column(session_col) or [sheet_name] * n_rows
+        total_orders_list = count_column(total_orders_col) or zeros
+        items_sold_list = count_column(items_sold_col) or zeros
+        add_to_cart_list = count_column(add_to_cart_col) or zeros
+        # Click rates giữ dạng text phần trăm ("5.2%", "3.1%")
+        click_to_product_rates = text_column(click_to_product_rate_col) or empty_text
+        click_to_order_rates = text_column(click_to_order_rate_col) or empty_text
+        
+        # Ghép lại thành tuple theo thứ tự cột insert, bỏ row không có item_id
+        batch_data = [
+            (item_name, item_id, revenue, clicks, file_name, session_name, total_orders, items_sold, add_to_cart, click_to_product_rate, click_to_order_rate)
+            for item_name, item_id, revenue, clicks, file_name, session_name, total_orders, items_sold, add_to_cart, click_to_product_rate, click_to_order_rate
+            in zip(item_names, item_ids, revenues, clicks_list, file_names, session_names, total_orders_list, items_sold_list, add_to_cart_list, click_to_product_rates, click_to_order_rates)
+            if item_id
+        ]
+        
+        # Clear old data and insert new (DELETE + bulk insert + sync time trong 1 transaction).
+        # Bảng bị thay toàn bộ -> drop index trước khi load, tạo lại 1 lần sau (rẻ hơn cập nhật từng row);
+        # DROP/CREATE cùng transaction nên lỗi giữa chừng rollback cả index lẫn data
         conn = get_db()
         cursor = conn.cursor()
+        begin_sync_transaction(cursor)
+        raw_indexes = table_db_indexes('raw_session_data')
+        for index_name, _ in raw_indexes:
+            cursor.execute(f'DROP INDEX IF EXISTS {index_name}')
         cursor.execute('DELETE FROM raw_session_data')
         
-        # Prepare batch data for faster insert
-        batch_data = []
-        for row in all_data:
-            item_id = str(row.get(item_id_col, '')).strip()
-            if not item_id:
-                continue
-            
-            item_name = str(row.get(item_name_col, '')).strip() if item_name_col else ''
-            
-            # Parse revenue
-            revenue_raw = row.get(revenue_col, 0) if revenue_col else 0
-            if isinstance(revenue_raw, str):
-                revenue_raw = revenue_raw.replace(',', '').replace('.', '')
-            try:
-                revenue = int(revenue_raw)
-            except:
-                revenue = 0
-            
-            # Parse clicks
-            clicks_raw = row.get(clicks_col, 0) if clicks_col else 0
-            if isinstance(clicks_raw, str):
-                clicks_raw = clicks_raw.replace(',', '')
-            try:
-                clicks = int(clicks_raw)
-            except:
-                clicks = 0
-            
-            file_name = str(row.get(file_col, '')).strip() if file_col else ''
-            # Use session_col if exists, otherwise use the selected sheet_name as session_name
-            if session_col:
-                session_name = str(row.get(session_col, '')).strip()
-            else:
-                session_name = sheet_name  # Use selected sheet name as session name
-            
-            # Parse total orders
-            total_orders_raw = row.get(total_orders_col, 0) if total_orders_col else 0
-            if isinstance(total_orders_raw, str):
-                total_orders_raw = total_orders_raw.replace(',', '')
-            try:
-                total_orders = int(total_orders_raw)
-            except:
-                total_orders = 0
-            
-            # Parse items sold
-            items_sold_raw = row.get(items_sold_col, 0) if items_sold_col else 0
-            if isinstance(items_sold_raw, str):
-                items_sold_raw = items_sold_raw.replace(',', '')
-            try:
-                items_sold = int(items_sold_raw)
-            except:
-                items_sold = 0
-            
-            # Parse add to cart
-            add_to_cart_raw = row.get(add_to_cart_col, 0) if add_to_cart_col else 0
-            if isinstance(add_to_cart_raw, str):
-                add_to_cart_raw = add_to_cart_raw.replace(',', '')
-            try:
-                add_to_cart = int(add_to_cart_raw)
-            except:
-                add_to_cart = 0
-            
-            # Parse click to product rate (as text percentage like "5.2%")
-            click_to_product_rate = str(row.get(click_to_product_rate_col, '')).strip() if click_to_product_rate_col else ''
-            
-            # Parse click to order rate (as text percentage like "3.1%")
-            click_to_order_rate = str(row.get(click_to_order_rate_col, '')).strip() if click_to_order_rate_col else ''
-            
-            batch_data.append((item_name, item_id, revenue, clicks, file_name, session_name, total_orders, items_sold, add_to_cart, click_to_product_rate, click_to_order_rate))
+        # Batch insert for much faster performance (COPY cho sheet lớn, execute_values cho sheet nhỏ)
+        bulk_insert_rows(cursor, 'raw_session_data', (
+            'item_name', 'item_id', 'revenue', 'clicks', 'file_name', 'session_name', 'total_orders',
+            'items_sold', 'add_to_cart', 'click_to_product_rate', 'click_to_order_rate'
+        ), batch_data)
         
-        # Batch insert for much faster performance
-        if batch_data:
-            insert_sql = '''
-                INSERT INTO raw_session_data (item_name, item_id, revenue, clicks, file_name, session_name, total_orders, items_sold, add_to_cart, click_to_product_rate, click_to_order_rate)
-                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-            '''
-            psycopg2.extras.execute_batch(cursor, insert_sql, batch_data, page_size=500)
+        for index_name, columns in raw_indexes:
+            cursor.execute(f'CREATE INDEX {index_name} ON raw_session_data ({columns})')
         
         count = len(batch_data)
-        conn.commit()
-        conn.close()
         
         # Save sync time
-        from datetime import datetime
-        set_config('rawdata_monthly_sync', datetime.now(timezone(timedelta(hours=7))).strftime('%Y-%m-%d %H:%M:%S'))
+        set_config('rawdata_monthly_sync', datetime.now(TZ_ICT).strftime('%Y-%m-%d %H:%M:%S'), cursor=cursor)
+        
+        conn.commit()
+        close_db(conn)
         
         return jsonify({'success': True, 'count': count})
         
     except Exception as e:
+        # close_db rollback transaction dở (giữ nguyên data + index cũ)
+        close_db(conn)
         return jsonify({'success': False, 'error': str(e)})
 
+# Tên session dạng '1.12', '11.12 S2' -> (ngày, tháng, hậu tố)
+_SESSION_DATE_RE = re.compile(r'^(\d{1,2})\.(\d{1,2})(?:\s*(.*))?$')
+
+@lru_cache(maxsize=4096)
+def parse_session_date(session_name):
+    """Parse session name like '1.12', '11.12 S2' to sortable tuple (tên session lặp lại giữa các item -> cache)"""
+    if not session_name:
+        return (99, 99, '')
+    match = _SESSION_DATE_RE.match(session_name.strip())
+    if match:
+        day = int(match.group(1))
+        month = int(match.group(2))
+        suffix = match.group(3) or ''
+        return (month, day, suffix)
+    return (99, 99, session_name)
+
 @app.route('/api/item-analytics/<item_id>')
 def api_item_analytics(item_id):
     """API: Get analytics data for specific item"""
-    import re
-    
-    def parse_session_date(session_name):
-        """Parse session name like '1.12', '11.12 S2' to sortable tuple"""
-        if not session_name:
-            return (99, 99, '')
-        match = re.match(r'^(\d{1,2})\.(\d{1,2})(?:\s*(.*))?$', session_name.strip())
-        if match:
-            day = int(match.group(1))
-            month = int(match.group(2))
-            suffix = match.group(3) or ''
-            return (month, day, suffix)
-        return (99, 99, session_name)
-    
     conn = get_db()
-    cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+    # Cursor tuple (không dựng dict cho từng row); 1 row / session nên fetchall 1 lần là đủ
+    cursor = conn.cursor()
     
+    # item_name fallback từ gmv_data đi kèm mỗi row (InitPlan chạy 1 lần) -> 1 round-trip
     cursor.execute('''
-        SELECT item_name, revenue, clicks, file_name, session_name, total_orders, items_sold, add_to_cart, click_to_product_rate, click_to_order_rate
+        SELECT item_name, revenue, clicks, file_name, session_name, total_orders, items_sold, add_to_cart, click_to_product_rate, click_to_order_rate,
+               (SELECT item_name FROM gmv_data WHERE item_id = %s LIMIT 1) as gmv_item_name
         FROM raw_session_data
         WHERE item_id = %s
-    ''', (item_id,))
+    ''', (item_id, item_id))
     
     rows = cursor.fetchall()
-    conn.close()
+    close_db(conn)
     
     if not rows:
         return jsonify({'success': False, 'error': 'Không tìm thấy Item ID'})
     
-    # Sort rows by date
-    rows_list = [dict(row) for row in rows]
-    rows_list.sort(key=lambda x: parse_session_date(x.get('session_name', '')))
+    # Sort rows by date (session_name = cột 4)
+    rows.sort(key=lambda row: parse_session_date(row[4] or ''))
     
     sessions = []
     total_revenue = 0
     total_clicks = 0
     item_name = ''
     
-    # Get first non-empty item_name from raw_session_data
-    for row in rows_list:
-        if row.get('item_name') and row['item_name'].strip():
-            item_name = row['item_name'].strip()
-            break
-    
-    # Fallback: Get item_name from gmv_data table if not found
-    if not item_name:
-        conn2 = get_db()
-        cursor2 = conn2.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-        cursor2.execute('SELECT item_name FROM gmv_data WHERE item_id = %s', (item_id,))
-        gmv_row = cursor2.fetchone()
-        conn2.close()
-        if gmv_row and gmv_row['item_name']:
-            item_name = gmv_row['item_name']
-    
-    for row in rows_list:
+    for (row_item_name, revenue, clicks, file_name, session_name, total_orders, items_sold,
+         add_to_cart, click_to_product_rate, click_to_order_rate, gmv_item_name) in rows:
+        # Get first non-empty item_name from raw_session_data
+        if not item_name and row_item_name and row_item_name.strip():
+            item_name = row_item_name.strip()
+        revenue = revenue or 0
+        clicks = clicks or 0
         sessions.append({
-            'session': row.get('session_name') or 'N/A',
-            'file': row.get('file_name') or 'N/A',
-            'revenue': row.get('revenue') or 0,
-            'clicks': row.get('clicks') or 0,
-            'total_orders': row.get('total_orders') or 0,
-            'items_sold': row.get('items_sold') or 0,
-            'add_to_cart': row.get('add_to_cart') or 0,
-            'click_to_product_rate': row.get('click_to_product_rate') or '',
-            'click_to_order_rate': row.get('click_to_order_rate') or ''
+            'session': session_name or 'N/A',
+            'file': file_name or 'N/A',
+            'revenue': revenue,
+            'clicks': clicks,
+            'total_orders': total_orders or 0,
+            'items_sold': items_sold or 0,
+            'add_to_cart': add_to_cart or 0,
+            'click_to_product_rate': click_to_product_rate or '',
+            'click_to_order_rate': click_to_order_rate or ''
         })
-        total_revenue += row.get('revenue') or 0
-        total_clicks += row.get('clicks') or 0
+        total_revenue += revenue
+        total_clicks += clicks
+    
+    # Fallback: item_name from gmv_data table if not found (giống nhau ở mọi row)
+    if not item_name and gmv_item_name:
+        item_name = gmv_item_name
     
     return jsonify({
         'success': True,
@@ -4573,12 +5238,13 @@ def api_item_analytics(item_id):
 @admin_required
 def api_rawdata_config():
     """API: Get raw data config"""
+    config = get_configs('rawdata_monthly_url', 'rawdata_monthly_sheet', 'rawdata_monthly_sync')
     return jsonify({
         'success': True,
         'config': {
-            'url': get_config('rawdata_monthly_url') or '',
-            'sheet': get_config('rawdata_monthly_sheet') or '',
-            'last_sync': get_config('rawdata_monthly_sync') or 'Chưa sync'
+            'url': config['rawdata_monthly_url'] or '',
+            'sheet': config['rawdata_monthly_sheet'] or '',
+            'last_sync': config['rawdata_monthly_sync'] or 'Chưa sync'
         }
     })
 
@@ -4586,10 +5252,9 @@ def api_rawdata_config():
 
 # Initialize database tables on module import (required for gunicorn)
 try:
-    init_db()
-    print("[DB] Database tables initialized")
+    ensure_db_initialized()
 except Exception as e:
-    print(f"[DB WARNING] init_db failed: {e}")
+    logger.warning("[DB WARNING] init_db failed: %s", e)
 
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 4000))